@@ -9,66 +9,353 @@
 Action overrides
 """
 
+import functools
 import logging
 import uuid
 
+import requests
 from requests import HTTPError
 from requests.exceptions import ReadTimeout
 
 import ckanext.etsin.metax_api as metax_api
+from ckanext.etsin.data_catalog_service import get_data_catalog_id_for_harvest_source
+from ckanext.etsin.fingerprints import fingerprint, get_fingerprint_store
+from ckanext.etsin.metax_batch import CREATE, UPDATE, MetaxWriteBatch, PendingWrite, WriteResult
+from ckanext.etsin.metax_workers import MetaxWorkerPool
+from ckanext.etsin.package_indexing import PackageIndexBatch
+from ckanext.etsin.package_index import PackageNameIndex, DEFAULT_INDEX_MAX_AGE
 from ckanext.etsin.refine import refine
-from ckanext.etsin.utils import convert_to_metax_catalog_record
+from ckanext.etsin.utils import convert_to_metax_catalog_record, encode_metax_payload, str_to_bool
 
 import ckan.model as model
 import ckan.logic.action.create
+import ckan.logic.action.delete
+import ckan.logic.action.get
 import ckan.logic.action.update
+import ckan.lib.search as search
+from ckan.logic import NotFound
 from ckan.lib.navl.validators import not_empty
+from ckanext.harvest.model import HarvestObject, HarvestObjectError
+from pylons import config
+from sqlalchemy import event
 from ckanext.etsin.exceptions import DatasetFieldsMissingError
 
 log = logging.getLogger(__name__)
 
+HARVEST_USER_NAME = 'harvest'
+
+DEFAULT_PACKAGE_INDEX_BATCH_SIZE = 100
+
 package_schema = {
     'id': [not_empty, unicode],
     'name': [not_empty, unicode]
 }
 
+_metax_write_batch = None
+_metax_worker_pool = None
+_package_index_batch = None
+_package_name_indexes = {}
+_harvest_user_id = None
+
+
+def _is_harvest_user(context):
+    """
+    Check whether the action is called by the harvest user. The context user is usually the user name,
+    which is compared without querying the user table. Otherwise it is compared to the id of the harvest
+    user, which is resolved once per process and forgotten whenever users change.
+    """
+    user = context.get('user')
+    if user == HARVEST_USER_NAME:
+        return True
+    if not user:
+        return False
+    return user == _get_harvest_user_id()
+
+
+def _get_harvest_user_id():
+    global _harvest_user_id
+    if _harvest_user_id is None:
+        harvest_user = model.User.get(HARVEST_USER_NAME)
+        # An empty string stands for a missing harvest user, so that it is not looked up again
+        _harvest_user_id = harvest_user.id if harvest_user is not None else ''
+    return _harvest_user_id
+
+
+@event.listens_for(model.User, 'after_insert')
+@event.listens_for(model.User, 'after_update')
+@event.listens_for(model.User, 'after_delete')
+def _forget_harvest_user(mapper, connection, target):
+    global _harvest_user_id
+    _harvest_user_id = None
 
-def _create_catalog_record_to_metax(context, metax_rd_dict):
+
+def get_metax_write_batch():
+    """
+    Get the batch buffering MetaX writes, or None if batching is not enabled.
+
+    Batching is enabled by setting metax.batch_size to the number of catalog records per MetaX bulk request.
+    Pending writes are also flushed on the next harvest action after metax.batch_max_wait seconds, before
+    deletes, and by the harvest action importing the last harvest object of a job, see _harvest_action.
+    """
+    global _metax_write_batch
+    batch_size = int(config.get('metax.batch_size', 0) or 0)
+    if batch_size <= 0:
+        return None
+    if _metax_write_batch is None:
+        max_wait = config.get('metax.batch_max_wait')
+        _metax_write_batch = MetaxWriteBatch(batch_size, max_wait=int(max_wait) if max_wait else None)
+    return _metax_write_batch
+
+
+def get_metax_worker_pool():
     """
+    Get the pool running MetaX writes on worker threads, or None if it is not enabled.
+
+    The pool is enabled by setting metax.workers to the number of worker threads. metax.max_in_flight limits
+    how many catalog records may wait for MetaX at a time, after which harvest actions block until there is room.
+    Finished writes are handled by the next harvest action, and the rest by joining the pool in the harvest
+    action importing the last harvest object of a job, see _harvest_action. If batching is enabled as well,
+    batching is used instead.
+    """
+    global _metax_worker_pool
+    workers = int(config.get('metax.workers', 0) or 0)
+    if workers <= 0:
+        return None
+    if _metax_worker_pool is None:
+        _metax_worker_pool = MetaxWorkerPool(workers, max_in_flight=int(config.get('metax.max_in_flight', 0) or 0))
+    return _metax_worker_pool
+
+
+def get_package_index_batch():
+    """
+    Get the batch indexing harvested CKAN packages in chunks, or None if it is not enabled.
+
+    CKAN indexes packages as they are committed unless ckan.search.automatic_indexing is disabled. Then the
+    harvested packages are indexed metax.package_index_batch_size packages at a time, or not at all if
+    metax.package_indexing is false, since the packages hold nothing but their MetaX CR identifier. Pending
+    packages are also indexed on the next harvest action after metax.package_index_max_wait seconds, and by
+    flush_metax_writes.
+
+    Note that ckan.search.automatic_indexing applies to every package written in the process, not only to
+    the harvested ones, so it should only be disabled in a CKAN process running nothing but the harvester.
+    """
+    global _package_index_batch
+    if str_to_bool(config.get('ckan.search.automatic_indexing', 'true')) or \
+            not str_to_bool(config.get('metax.package_indexing', 'true')):
+        return None
+    if _package_index_batch is None:
+        batch_size = int(config.get('metax.package_index_batch_size', DEFAULT_PACKAGE_INDEX_BATCH_SIZE))
+        max_wait = config.get('metax.package_index_max_wait')
+        _package_index_batch = PackageIndexBatch(batch_size, _index_packages,
+                                                 max_wait=int(max_wait) if max_wait else None)
+    return _package_index_batch
+
+
+def flush_metax_writes():
+    """
+    Write all buffered catalog records to MetaX, wait for the writes running on worker threads, finish
+    their CKAN packages and index the packages waiting to be indexed. Packages written with defer_commit
+    are committed first, since they are indexed before the harvester commits the current harvest object.
+
+    :return: list of metax_batch.WriteResults
+    """
+    results = []
+    batch = get_metax_write_batch()
+    if batch is not None:
+        results.extend(batch.flush())
+    pool = get_metax_worker_pool()
+    if pool is not None:
+        results.extend(pool.join())
+    index_batch = get_package_index_batch()
+    if (results or (index_batch is not None and len(index_batch))) and _package_commits_deferred():
+        model.repo.commit()
+    if index_batch is not None:
+        index_batch.flush()
+    return results
+
+
+def _has_pending_writes():
+    batch = get_metax_write_batch()
+    pool = get_metax_worker_pool()
+    index_batch = get_package_index_batch()
+    return bool((batch is not None and len(batch)) or (pool is not None and len(pool)) or
+                (index_batch is not None and len(index_batch)))
+
+
+def _harvest_action(action):
+    """
+    Flush pending writes with flush_metax_writes after the harvest call of action for the last harvest object
+    of a harvest job. ckanext-harvest does not tell plugins when a harvest job ends, so the pending writes are
+    finished by the action importing the last object, on the importing thread, before the harvester commits it.
+    """
+    @functools.wraps(action)
+    def wrapper(context, data_dict):
+        output = action(context, data_dict)
+        if _is_harvest_user(context) and _has_pending_writes() and _is_last_harvest_object(context):
+            log.info("Last harvest object of the harvest job imported, flushing pending writes")
+            flush_metax_writes()
+        return output
+    return wrapper
+
+
+def _is_last_harvest_object(context):
+    """
+    Tell whether no other harvest object of the harvest job of the harvest object in context is waiting to be
+    imported. Without a harvest object in context MetaX writes are not deferred, see _can_defer_metax_write.
+    """
+    harvest_object = context.get('harvest_object', None)
+    if harvest_object is None:
+        return True
+    waiting = model.Session.query(HarvestObject.id) \
+        .filter(HarvestObject.harvest_job_id == harvest_object.harvest_job_id) \
+        .filter(HarvestObject.id != harvest_object.id) \
+        .filter(HarvestObject.state.in_(['WAITING', 'FETCH', 'IMPORT'])) \
+        .first()
+    return waiting is None
+
+
+def _can_defer_metax_write(context):
+    """
+    Tell whether the MetaX write of a harvest action may be left to the write batch or the worker pool. Only
+    writes for a harvest object are deferred, since the last harvest object of a job flushes them, see
+    _harvest_action, and a failed write marks its harvest object as failed, see _mark_harvest_object_failed.
+    """
+    if get_metax_write_batch() is None and get_metax_worker_pool() is None:
+        return False
+    return context.get('harvest_object', None) is not None
+
+
+def _get_catalog_record_snapshot(context):
+    """
+    :return: snapshot of the catalog records in the data catalog of the harvest source, or None if
+             snapshots are not enabled, see metax_api.get_catalog_record_snapshot
+    """
+    harvest_source_name = context.get('harvest_source_name', None)
+    if not harvest_source_name:
+        return None
+    return metax_api.get_catalog_record_snapshot(get_data_catalog_id_for_harvest_source(harvest_source_name))
+
+
+def _remember_catalog_record(snapshot, metax_rd_dict, metax_cr_id):
+    """ Keep the catalog record snapshot up to date with a catalog record written to MetaX """
+    if snapshot is not None:
+        snapshot.set(metax_rd_dict.get('preferred_identifier', None), metax_cr_id, metax_rd_dict.get('modified', None))
+
+
+def _update_existing_catalog_record(context, metax_rd_dict, md=None):
+    """
+    Find the catalog record having the preferred identifier of metax_rd_dict and PUT metax_rd_dict into it.
+    The catalog record identifier is taken from the catalog record snapshot or the fingerprint store if either
+    knows it, and otherwise asked from MetaX. A known identifier that MetaX no longer has is asked from MetaX.
+
+    :param md: metax_rd_dict already converted to a MetaX catalog record, which is then not converted again
+    :return: identifier of the catalog record if it was updated successfully. Otherwise return None.
+    """
+    pref_id = metax_rd_dict.get('preferred_identifier', None)
+    log.info("Trying to PUT the CR in case it already existed in Metax..")
+    if md is None:
+        md = convert_to_metax_catalog_record(metax_rd_dict, context)
+        if not md:
+            return None
+    snapshot = _get_catalog_record_snapshot(context)
+    metax_cr_id = _find_known_catalog_record_identifier(snapshot, pref_id)
+    looked_up = not metax_cr_id
+    if looked_up:
+        metax_cr_id = metax_api.get_catalog_record_identifier_using_preferred_identifier(pref_id)
+
+    while metax_cr_id:
+        try:
+            log.debug("Found Metax CR ID: {0}".format(metax_cr_id))
+            metax_api.update_catalog_record(metax_cr_id, encode_metax_payload(dict(md, identifier=metax_cr_id)))
+            log.info("PUT operation successful.")
+            _remember_catalog_record(snapshot, metax_rd_dict, metax_cr_id)
+            return metax_cr_id
+        except HTTPError as e:
+            if looked_up or e.response is None or e.response.status_code != requests.codes.not_found:
+                log.error("Unable to PUT the CR into Metax")
+                return None
+            log.info("CR {0} known to have preferred identifier {1} was not found from MetaX".format(metax_cr_id,
+                                                                                                   pref_id))
+            if snapshot is not None:
+                snapshot.remove(metax_cr_id)
+            looked_up = True
+            metax_cr_id = metax_api.get_catalog_record_identifier_using_preferred_identifier(pref_id)
+        except Exception as e:
+            log.error("Unable to PUT the CR into Metax: {0}".format(repr(e)))
+            return None
+
+    log.info("Unable to find CR having preferred identifier {0} from Metax".format(pref_id))
+    log.error("Unable to store catalog record to Metax")
+    return None
+
+
+def _find_known_catalog_record_identifier(snapshot, pref_id):
+    """
+    :return: identifier of the catalog record having pref_id according to the catalog record snapshot or the
+             fingerprint store, or None if neither knows it
+    """
+    known = snapshot.find_by_preferred_identifier(pref_id) if snapshot is not None else None
+    if known:
+        return known[0]
+    known = get_fingerprint_store().find_by_preferred_identifier(pref_id)
+    if known and known[2]:
+        return known[2]
+    return None
+
+
+def _catalog_record_exists(context, metax_cr_id):
+    """
+    :return: True if the catalog record snapshot has metax_cr_id, otherwise whether MetaX has it. A failed
+             existence check counts as the catalog record not existing.
+    """
+    snapshot = _get_catalog_record_snapshot(context)
+    if snapshot is not None and snapshot.find_by_identifier(metax_cr_id):
+        return True
+    try:
+        return metax_api.check_catalog_record_exists(metax_cr_id)
+    except Exception as e:
+        log.error("Unable to check whether CR {0} exists in MetaX: {1}".format(metax_cr_id, repr(e)))
+        return False
+
+
+def _create_catalog_record_to_metax(context, metax_rd_dict, md=None):
+    """
+    Create a catalog record to MetaX, or update the existing catalog record having the same preferred identifier.
+    Records MetaX rejects for their content are not sent again as updates.
 
     :param context:
     :param metax_rd_dict: contains the metadata for the MetaX catalog record research_dataset relation
-    :param ckan_package_id: identifier that will be the id for the package in CKAN database in case catalog record
-    is created successfully to MetaX
+    :param md: metax_rd_dict already converted to a MetaX catalog record, which is then not converted again
     :return: identifier of the catalog record if catalog record was successfully created to MetaX.
     Otherwise return None.
     """
     pref_id = metax_rd_dict.get('preferred_identifier', None)
 
     if pref_id:
+        if md is None:
+            md = convert_to_metax_catalog_record(metax_rd_dict, context)
+        if not md:
+            return None
+        snapshot = _get_catalog_record_snapshot(context)
+        if snapshot is not None and snapshot.find_by_preferred_identifier(pref_id):
+            log.info("A CR having preferred_identifier {0} already exists in MetaX".format(pref_id))
+            return _update_existing_catalog_record(context, metax_rd_dict, md)
         try:
             log.info("Trying to create a catalog record (CR) to MetaX having preferred_identifier {0}"
                      .format(pref_id))
-            md = convert_to_metax_catalog_record(metax_rd_dict, context)
-            log.info("Payload to be sent to MetaX: {0}".format(md))
-            metax_cr_id = metax_api.create_catalog_record(md)
+            # Encoded once, for both the log and the request
+            payload = encode_metax_payload(md)
+            log.info("Payload to be sent to MetaX: %s", payload)
+            metax_cr_id = metax_api.create_catalog_record(payload)
             log.info("Successfully created a CR to MetaX. Returned CR identifier: %s", metax_cr_id)
+            _remember_catalog_record(snapshot, metax_rd_dict, metax_cr_id)
         except HTTPError as e:
-            log.info("Trying to PUT the CR in case it already existed in Metax..")
-            metax_cr_id = metax_api.get_catalog_record_identifier_using_preferred_identifier(pref_id)
-            if not metax_cr_id:
-                log.info("Unable to find CR having preferred identifier {0} from Metax".format(pref_id))
-                log.error("Unable to store catalog record to Metax")
-                return None
-            try:
-                log.debug("Found Metax CR ID: {0}".format(metax_cr_id))
-                metax_api.update_catalog_record(metax_cr_id, convert_to_metax_catalog_record(metax_rd_dict,
-                                                                                             context, metax_cr_id))
-                log.info("PUT operation successful.")
-                return metax_cr_id
-            except:
-                log.error("Unable to PUT the CR into Metax")
+            if metax_api.get_write_error_reason(e) == metax_api.REJECTED:
+                # Sending the same CR again, as an update, would be rejected the same way
+                log.error("MetaX rejected the CR having preferred_identifier {0}: {1}".format(
+                    pref_id, metax_api.json_or_empty(e.response)))
                 return None
+            return _update_existing_catalog_record(context, metax_rd_dict, md)
         except ReadTimeout as e:
             log.error("Connection timeout: {0}".format(repr(e)))
             return None
@@ -81,6 +368,7 @@ def _create_catalog_record_to_metax(context, metax_rd_dict):
     return metax_cr_id
 
 
+@_harvest_action
 def package_create(context, metax_rd_dict):
     """
     Refines metax_rd_dict further with harvester source specific refiners. Calls MetaX API to create a new dataset.
@@ -92,9 +380,9 @@ def package_create(context, metax_rd_dict):
     :returns: package dictionary that was saved to CKAN db in case everything went well.
     """
 
-    user = model.User.get(context['user'])
+    if _is_harvest_user(context):
+        _flush_due_metax_writes()
 
-    if user.name == "harvest":
         # Create the package_id for the package dict
         ckan_package_id = unicode(uuid.uuid4())
 
@@ -107,13 +395,31 @@ def package_create(context, metax_rd_dict):
             log.error(e)
             return False
 
-        # Creating catalog record to MetaX should return catalog record identifier
-        metax_cr_id = _create_catalog_record_to_metax(context, metax_rd_dict)
-        if not metax_cr_id:
-            return False
+        # If an identical dataset has already been sent to MetaX, reuse its catalog record instead of creating one
+        pref_id = metax_rd_dict.get('preferred_identifier', None)
+        rd_fingerprint = fingerprint(metax_rd_dict)
+        fingerprint_store = get_fingerprint_store()
+        known = fingerprint_store.find_by_preferred_identifier(pref_id) if pref_id else None
+        if known and known[1] == rd_fingerprint and known[2] and not _catalog_record_exists(context, known[2]):
+            # The CR has been deleted from MetaX after it was fingerprinted, so it is created again
+            log.info("CR %s last sent to MetaX for dataset %s no longer exists in MetaX", known[2], pref_id)
+            fingerprint_store.delete(known[0])
+            known = None
+        if known and known[1] == rd_fingerprint and known[2]:
+            metax_cr_id = known[2]
+            log.info("Dataset %s unchanged since it was last sent to MetaX as CR %s. Skipping MetaX create...",
+                     pref_id, metax_cr_id)
+        elif _can_defer_metax_write(context):
+            return _create_deferred(context, ckan_package_id, metax_rd_dict, rd_fingerprint)
+        else:
+            # Creating catalog record to MetaX should return catalog record identifier
+            metax_cr_id = _create_catalog_record_to_metax(context, metax_rd_dict)
+            if not metax_cr_id:
+                return False
 
         # Create the package to CKAN database linking ckan_package_id and metax_cr_id together
         context['schema'] = package_schema
+        _defer_package_commits(context)
         log.info("Trying to create package to CKAN database with ID: %s and name: %s", ckan_package_id, metax_cr_id)
         data_dict = _get_data_dict_for_ckan_db(ckan_package_id, metax_cr_id)
         try:
@@ -126,6 +432,10 @@ def package_create(context, metax_rd_dict):
                 log.error(e)
                 log.error("Unable to package_update package. Aborting")
                 return False
+        # Fingerprint is stored only once the package exists, so that a failed create is not skipped next time
+        fingerprint_store.set(ckan_package_id, rd_fingerprint, metax_cr_id, pref_id)
+        _set_package_name(context, ckan_package_id, metax_cr_id)
+        _index_package_later(ckan_package_id)
         log.info("Created package to CKAN database successfully with ID: %s and name: %s", ckan_package_id, metax_cr_id)
     else:
         output = ckan.logic.action.create.package_create(context, metax_rd_dict)
@@ -133,6 +443,7 @@ def package_create(context, metax_rd_dict):
     return output
 
 
+@_harvest_action
 def package_update(context, metax_rd_dict):
     """
     Refines metax_rd_dict further with harvester source specific refiners. Call MetaX API to update an existing dataset.
@@ -144,9 +455,9 @@ def package_update(context, metax_rd_dict):
     :returns: package dictionary that was saved to CKAN db in case everything went well.
     """
 
-    user = model.User.get(context['user'])
+    if _is_harvest_user(context):
+        _flush_due_metax_writes()
 
-    if user.name == "harvest":
         # Get the ckan_package_id for the dict
         ckan_package_id = metax_rd_dict.pop('id')
 
@@ -163,14 +474,37 @@ def package_update(context, metax_rd_dict):
             log.error(e)
             return False
 
-        # Get MetaX catalog record identifier from CKAN database by searching for a package with given ckan_package_id
-        metax_cr_id = _get_metax_id_from_ckan_db(ckan_package_id)
+        rd_fingerprint = fingerprint(metax_rd_dict)
+        fingerprint_store = get_fingerprint_store()
 
-        if metax_api.check_catalog_record_exists(metax_cr_id):
+        # Get MetaX catalog record identifier from CKAN database by searching for a package with given ckan_package_id
+        package_names = _get_package_name_index(context)
+        metax_cr_id = _get_metax_id_from_ckan_db(ckan_package_id, package_names)
+        if metax_cr_id == ckan_package_id:
+            # The package is still waiting for its catalog record to be created to MetaX
+            flush_metax_writes()
+            metax_cr_id = _get_metax_id_from_ckan_db(ckan_package_id, package_names)
+
+        # The refined dataset may be identical to the one last sent to MetaX
+        unchanged = fingerprint_store.is_unchanged(ckan_package_id, rd_fingerprint)
+
+        # Check existence and retrieve modified parameter of existing dataset from the catalog record snapshot
+        # without contacting MetaX, or with one request
+        snapshot = _get_catalog_record_snapshot(context)
+        known = snapshot.find_by_identifier(metax_cr_id) if snapshot is not None else None
+        if known:
+            cr_exists, existing_dataset_modified = True, known[1]
+        else:
+            cr_exists, existing_dataset_modified = metax_api.get_catalog_record_modified(metax_cr_id)
+
+        if cr_exists:
+            # Skip an unchanged dataset only once the CR is known to still exist, so that CRs deleted from
+            # MetaX are recreated below. Without metax.catalog_snapshot this costs the one request above.
+            if unchanged:
+                log.info("Dataset of CKAN package %s unchanged since it was last sent to MetaX. Skipping...",
+                         ckan_package_id)
+                return False
 
-            # Retrieve modified parameter of existing dataset
-            pref_id = metax_rd_dict.get('preferred_identifier', None)
-            existing_dataset_modified = metax_api.get_catalog_record_research_dataset_modified_using_preferred_identifier(pref_id)
             log.info("existing_dataset_modified is %s", existing_dataset_modified)
 
             # Retrieve modified parameter of incoming dataset
@@ -180,21 +514,38 @@ def package_update(context, metax_rd_dict):
             # Check whether the dataset has been modified
             if (existing_dataset_modified == incoming_dataset_modified):
                 log.info("Dataset %s unchanged. Parameter 'modified' is the same. Skipping...", metax_cr_id)
+                fingerprint_store.set(ckan_package_id, rd_fingerprint, metax_cr_id,
+                                      metax_rd_dict.get('preferred_identifier', None))
                 return False
 
             # If the dataset has actually been altered, proceed...
-            try:
-                log.info("Trying to update catalog record (CR) to MetaX having CR identifier: %s", metax_cr_id)
-                metax_api.update_catalog_record(metax_cr_id, convert_to_metax_catalog_record(metax_rd_dict,
-                                                                                             context, metax_cr_id))
-                log.info("Successfully updated CR to MetaX!")
-            except HTTPError as e:
-                log.error("Failed to update CR to MetaX having CR identifier {0} for a "
-                          "CKAN package ID: {1}, error: {2}".format(metax_cr_id, ckan_package_id, repr(e)))
-                return False
-            except ReadTimeout as e:
-                log.error("Connection timeout: {0}".format(repr(e)))
-                return False
+            if _can_defer_metax_write(context):
+                md = convert_to_metax_catalog_record(metax_rd_dict, context, metax_cr_id)
+                if not md:
+                    return False
+                log.info("Deferring update of catalog record (CR) having CR identifier %s to MetaX", metax_cr_id)
+                _defer_metax_write(PendingWrite(UPDATE, ckan_package_id, md,
+                                                _on_deferred_update(metax_rd_dict, rd_fingerprint, snapshot,
+                                                                    context['harvest_object'].id)),
+                                   lambda: _put_catalog_record_to_metax(metax_cr_id, md))
+                # Fingerprint is stored when the catalog record has been written
+                rd_fingerprint = None
+            else:
+                try:
+                    log.info("Trying to update catalog record (CR) to MetaX having CR identifier: %s", metax_cr_id)
+                    md = convert_to_metax_catalog_record(metax_rd_dict, context, metax_cr_id)
+                    if not md:
+                        return False
+                    metax_api.update_catalog_record(metax_cr_id, encode_metax_payload(md))
+                    log.info("Successfully updated CR to MetaX!")
+                    _remember_catalog_record(snapshot, metax_rd_dict, metax_cr_id)
+                except HTTPError as e:
+                    log.error("Failed to update CR to MetaX having CR identifier {0} for a "
+                              "CKAN package ID: {1}, error: {2}".format(metax_cr_id, ckan_package_id, repr(e)))
+                    return False
+                except ReadTimeout as e:
+                    log.error("Connection timeout: {0}".format(repr(e)))
+                    return False
         else:
             # CR does not exist in Metax even though it has been stored to local CKAN database
             # Most likely because the Metax target env has been emptied
@@ -208,8 +559,13 @@ def package_update(context, metax_rd_dict):
 
         # Update the package into CKAN database
         context['schema'] = package_schema
+        _defer_package_commits(context)
         log.info("Trying to update package to CKAN database with ID: %s and name: %s", ckan_package_id, metax_cr_id)
         output = ckan.logic.action.update.package_update(context, _get_data_dict_for_ckan_db(ckan_package_id, metax_cr_id))
+        fingerprint_store.set(ckan_package_id, rd_fingerprint, metax_cr_id,
+                              metax_rd_dict.get('preferred_identifier', None))
+        _set_package_name(context, ckan_package_id, metax_cr_id)
+        _index_package_later(ckan_package_id)
         log.info("Updated package to CKAN database successfully with ID: %s and name: %s", ckan_package_id, metax_cr_id)
     else:
         output = ckan.logic.action.update.package_update(context, metax_rd_dict)
@@ -217,6 +573,7 @@ def package_update(context, metax_rd_dict):
     return output
 
 
+@_harvest_action
 def package_delete(context, data_dict):
     """
     Calls MetaX API to delete a dataset.
@@ -225,10 +582,12 @@ def package_delete(context, data_dict):
     In other cases (e.g. creating harvest source) do NOT use 'harvest' user
     """
 
-    user = model.User.get(context['user'])
     return_id_only = context.get('return_id_only', False)
 
-    if user.name == "harvest":
+    if _is_harvest_user(context):
+        # Buffered writes may concern the package being deleted
+        flush_metax_writes()
+
         # Get the ckan_package_id for the dict
         ckan_package_id = data_dict.pop('id')
 
@@ -237,13 +596,18 @@ def package_delete(context, data_dict):
             return False
 
         # Get Metax catalog record identifier from CKAN database
-        metax_cr_id = _get_metax_id_from_ckan_db(ckan_package_id)
+        package_names = _get_package_name_index(context)
+        metax_cr_id = _get_metax_id_from_ckan_db(ckan_package_id, package_names)
 
-        if metax_api.check_catalog_record_exists(metax_cr_id):
+        snapshot = _get_catalog_record_snapshot(context)
+        if (snapshot is not None and snapshot.find_by_identifier(metax_cr_id)) or \
+                metax_api.check_catalog_record_exists(metax_cr_id):
             try:
                 log.info("Trying to delete catalog record (CR) from MetaX having MetaX CR identifier: %s", metax_cr_id)
                 metax_api.delete_catalog_record(metax_cr_id)
                 log.info("Successfully deleted package from MetaX!")
+                if snapshot is not None:
+                    snapshot.remove(metax_cr_id)
             except HTTPError:
                 log.error("Failed to delete package from MetaX for a CR having CKAN package ID: %s and "
                           "MetaX CR identifier: %s", ckan_package_id, metax_cr_id)
@@ -256,9 +620,15 @@ def package_delete(context, data_dict):
                         "CKAN database with id {1}".format(metax_cr_id, ckan_package_id))
             log.info("Skipping delete operation in MetaX")
 
+        get_fingerprint_store().delete(ckan_package_id)
+
         package_dict = _get_data_dict_for_ckan_db(ckan_package_id, metax_cr_id)
         log.info("Trying to delete package from CKAN database with ID: %s and name: %s", ckan_package_id, metax_cr_id)
         package_dict = ckan.logic.action.delete.package_delete(context, package_dict)
+        if package_names is not None:
+            package_names.remove(ckan_package_id)
+        # The package may have to be removed from the search index
+        _index_package_later(ckan_package_id)
         log.info("Successfully deleted package from CKAN database with ID: %s and name: %s",
                  ckan_package_id, metax_cr_id)
     else:
@@ -268,11 +638,284 @@ def package_delete(context, data_dict):
     return output
 
 
-def _get_metax_id_from_ckan_db(package_id):
-    return model.Session.query(model.Package) \
-                        .filter(model.Package.id == package_id) \
-                        .first() \
-                        .name
+def _flush_due_metax_writes():
+    batch = get_metax_write_batch()
+    if batch is not None:
+        batch.flush_if_due()
+    pool = get_metax_worker_pool()
+    if pool is not None:
+        pool.drain()
+    index_batch = get_package_index_batch()
+    if index_batch is not None:
+        # The packages written by earlier harvest actions have been committed by the harvester by now
+        index_batch.flush_if_due()
+
+
+def _package_commits_deferred():
+    return str_to_bool(config.get('metax.defer_package_commits', 'false'))
+
+
+def _defer_package_commits(context):
+    """
+    Let CKAN actions called with context leave committing to the harvester if metax.defer_package_commits
+    is enabled. ckanext-harvest commits the session once per harvest object after the import stage, so the
+    package is then committed together with its harvest object instead of with a commit of its own.
+    """
+    if _package_commits_deferred():
+        context['defer_commit'] = True
+
+
+def _index_package_later(package_id):
+    index_batch = get_package_index_batch()
+    if index_batch is not None:
+        index_batch.add(package_id)
+
+
+def _index_packages(package_ids):
+    """
+    Index committed packages, or remove deleted ones from the search index, with one search index commit.
+    """
+    package_index = search.index_for('package')
+    for package_id in package_ids:
+        try:
+            pkg_dict = ckan.logic.action.get.package_show(
+                {'model': model, 'ignore_auth': True, 'validate': False, 'use_cache': False}, {'id': package_id})
+        except NotFound:
+            pkg_dict = {'id': package_id, 'state': 'deleted'}
+        if pkg_dict.get('state') == 'deleted':
+            package_index.remove_dict(pkg_dict)
+        else:
+            package_index.index_package(pkg_dict, defer_commit=True)
+    package_index.commit()
+    log.info("Indexed %d committed packages", len(package_ids))
+
+
+def _defer_metax_write(write, metax_request):
+    """
+    Add write to the MetaX write batch, or submit metax_request to the worker pool if batching is not enabled.
+
+    :param write: metax_batch.PendingWrite whose callback is called with the WriteResult
+    :param metax_request: function doing the MetaX requests of write on a worker thread, returning
+                          the MetaX CR identifier or None on failure
+    """
+    batch = get_metax_write_batch()
+    if batch is not None:
+        if write.operation == CREATE:
+            batch.add_create(write.package_id, write.catalog_record, write.callback)
+        else:
+            batch.add_update(write.package_id, write.catalog_record, write.callback)
+        return
+
+    def task():
+        try:
+            metax_cr_id = metax_request()
+        except Exception as e:
+            return WriteResult(write, errors={'request': [repr(e)]})
+        if not metax_cr_id:
+            return WriteResult(write, errors={'detail': ['Writing catalog record to MetaX failed']})
+        return WriteResult(write, metax_cr_id=metax_cr_id)
+
+    get_metax_worker_pool().submit(write.preferred_identifier, task, write.callback)
+
+
+def _put_catalog_record_to_metax(metax_cr_id, md):
+    metax_api.update_catalog_record(metax_cr_id, encode_metax_payload(md))
+    return metax_cr_id
+
+
+def _create_deferred(context, ckan_package_id, metax_rd_dict, rd_fingerprint):
+    """
+    Create the CKAN package right away and leave creating its catalog record to MetaX to the write batch or
+    the worker pool. Until the catalog record has been created the package name is the package id, since the
+    MetaX CR identifier is not known yet. Then the package is renamed to the MetaX CR identifier, or deleted
+    and its harvest object marked failed if creating the catalog record failed.
+    """
+    pref_id = metax_rd_dict.get('preferred_identifier', None)
+    if not pref_id:
+        log.error("Package does not have a preferred identifier. Skipping.")
+        return False
+
+    md = convert_to_metax_catalog_record(metax_rd_dict, context)
+    if not md:
+        return False
+
+    context['schema'] = package_schema
+    _defer_package_commits(context)
+    log.info("Trying to create package to CKAN database with ID: %s while its CR is waiting to be sent to MetaX",
+             ckan_package_id)
+    try:
+        output = ckan.logic.action.create.package_create(context, _get_data_dict_for_ckan_db(ckan_package_id,
+                                                                                             ckan_package_id))
+    except Exception as e:
+        log.error(e)
+        log.error("Unable to package_create package. Aborting")
+        return False
+    _set_package_name(context, ckan_package_id, ckan_package_id)
+    _index_package_later(ckan_package_id)
+
+    # Worker threads fall back to updating an existing catalog record themselves
+    batched = get_metax_write_batch() is not None
+    context = dict(context)
+    harvest_object_id = context['harvest_object'].id
+    _defer_metax_write(PendingWrite(CREATE, ckan_package_id, md,
+                                    _on_deferred_create(context, metax_rd_dict, rd_fingerprint, batched,
+                                                        harvest_object_id)),
+                       lambda: _create_catalog_record_to_metax(context, metax_rd_dict, md))
+    return output
+
+
+def _on_deferred_create(context, metax_rd_dict, rd_fingerprint, update_on_failure, harvest_object_id):
+    def callback(result):
+        metax_cr_id = result.metax_cr_id
+        if not result.ok and update_on_failure:
+            log.error("Failed to create CR to MetaX for CKAN package {0}: {1}".format(result.package_id,
+                                                                                     result.errors))
+            if not _is_rejected_write(result):
+                metax_cr_id = _update_existing_catalog_record(context, metax_rd_dict, result.write.catalog_record)
+
+        if not metax_cr_id:
+            log.info("Rolling back package with ID %s from CKAN database", result.package_id)
+            _mark_harvest_object_failed(harvest_object_id, "Creating the catalog record to MetaX failed: {0}"
+                                        .format(result.errors), not_current=True)
+            ckan.logic.action.delete.package_delete(context, {'id': result.package_id})
+            package_names = _get_package_name_index(context)
+            if package_names is not None:
+                package_names.remove(result.package_id)
+            _index_package_later(result.package_id)
+            return
+
+        _remember_catalog_record(_get_catalog_record_snapshot(context), metax_rd_dict, metax_cr_id)
+        get_fingerprint_store().set(result.package_id, rd_fingerprint, metax_cr_id,
+                                    metax_rd_dict.get('preferred_identifier', None))
+        ckan.logic.action.update.package_update(context, _get_data_dict_for_ckan_db(result.package_id, metax_cr_id))
+        _set_package_name(context, result.package_id, metax_cr_id)
+        _index_package_later(result.package_id)
+        log.info("Created package to CKAN database successfully with ID: %s and name: %s",
+                 result.package_id, metax_cr_id)
+    return callback
+
+
+def _is_rejected_write(result):
+    """
+    Tell whether MetaX refused the catalog record of a failed bulk write because of its content. Errors of
+    the whole request, and records missing from the response, may have nothing to do with the content.
+    """
+    errors = result.errors or {}
+    if 'request' in errors or 'detail' in errors:
+        return False
+    return metax_api.get_errors_reason(errors) == metax_api.REJECTED
+
+
+def _on_deferred_update(metax_rd_dict, rd_fingerprint, snapshot, harvest_object_id):
+    def callback(result):
+        if not result.ok:
+            log.error("Failed to update CR to MetaX for CKAN package {0}: {1}".format(result.package_id,
+                                                                                     result.errors))
+            _mark_harvest_object_failed(harvest_object_id, "Updating the catalog record to MetaX failed: {0}"
+                                        .format(result.errors))
+            return
+        _remember_catalog_record(snapshot, metax_rd_dict, result.metax_cr_id)
+        get_fingerprint_store().set(result.package_id, rd_fingerprint, result.metax_cr_id,
+                                    metax_rd_dict.get('preferred_identifier', None))
+        log.info("Successfully updated CR %s to MetaX!", result.metax_cr_id)
+    return callback
+
+
+def _mark_harvest_object_failed(harvest_object_id, message, not_current=False):
+    """
+    Report the harvest object of a deferred MetaX write that failed as an import error, since the harvester
+    has already marked it imported. A harvest object whose package was rolled back is also made not current,
+    so that the next harvest job imports its record again instead of taking it for unchanged. The harvest
+    object is committed by the harvester with the harvest object being imported.
+    """
+    harvest_object = HarvestObject.get(harvest_object_id)
+    if harvest_object is None:
+        log.error("Harvest object {0} of a failed MetaX write not found".format(harvest_object_id))
+        return
+    harvest_object.state = 'ERROR'
+    if not_current:
+        harvest_object.current = False
+    model.Session.add(harvest_object)
+    model.Session.add(HarvestObjectError(message=message, object=harvest_object, stage='Import'))
+
+
+def _get_package_name_index(context):
+    """
+    Get the index of the package names of the harvest source, loading it from the CKAN database on first use.
+    The index is reloaded after metax.package_index_max_age seconds, so in practice once per harvest job.
+
+    :return: PackageNameIndex, or None if the harvest source is not known
+    """
+    harvest_source_name = context.get('harvest_source_name', None)
+    if not harvest_source_name:
+        return None
+    index = _package_name_indexes.get(harvest_source_name)
+    if index is None or index.expired():
+        index = PackageNameIndex(_load_package_names(context),
+                                 max_age=int(config.get('metax.package_index_max_age', DEFAULT_INDEX_MAX_AGE)))
+        _package_name_indexes[harvest_source_name] = index
+    return index
+
+
+def _get_harvest_source_id(context):
+    """
+    Resolve the harvest source of a harvest action from the harvest object or harvest job in context.
+    Harvesters that pass neither are assumed to set harvest_source_name to the name of the harvest
+    source package.
+
+    :return: harvest source id, or None if the harvest source cannot be resolved
+    """
+    harvest_object = context.get('harvest_object', None)
+    if harvest_object is not None and harvest_object.harvest_source_id:
+        return harvest_object.harvest_source_id
+    harvest_job = context.get('harvest_job', None)
+    if harvest_job is not None and harvest_job.source_id:
+        return harvest_job.source_id
+    source = model.Session.query(model.Package.id) \
+                          .filter(model.Package.name == context.get('harvest_source_name', None)) \
+                          .filter(model.Package.type == 'harvest') \
+                          .first()
+    return source.id if source is not None else None
+
+
+def _load_package_names(context):
+    """
+    Load (id, name) pairs of the packages of a harvest source with one query, without loading Package objects.
+    If the harvest source cannot be resolved, nothing is loaded and package names are looked up one at a time.
+    """
+    harvest_source_name = context.get('harvest_source_name', None)
+    harvest_source_id = _get_harvest_source_id(context)
+    if harvest_source_id is None:
+        log.warning("Unable to resolve harvest source %s: no harvest object or harvest job in the context, and "
+                    "no harvest source package of that name. Package names are looked up one at a time.",
+                    harvest_source_name)
+        return []
+    names = model.Session.query(model.Package.id, model.Package.name) \
+                         .join(HarvestObject, HarvestObject.package_id == model.Package.id) \
+                         .filter(HarvestObject.harvest_source_id == harvest_source_id) \
+                         .filter(HarvestObject.current == True) \
+                         .distinct() \
+                         .all()
+    log.info("Loaded names of %d packages of harvest source %s", len(names), harvest_source_name)
+    return names
+
+
+def _set_package_name(context, package_id, name):
+    package_names = _get_package_name_index(context)
+    if package_names is not None:
+        package_names.set(package_id, name)
+
+
+def _get_metax_id_from_ckan_db(package_id, package_names=None):
+    metax_cr_id = package_names.get(package_id) if package_names is not None else None
+    if metax_cr_id is None:
+        metax_cr_id = model.Session.query(model.Package.name) \
+                                   .filter(model.Package.id == package_id) \
+                                   .first() \
+                                   .name
+        if package_names is not None:
+            package_names.set(package_id, metax_cr_id)
+    return metax_cr_id
 
 
 def _get_data_dict_for_ckan_db(package_id, metax_id):
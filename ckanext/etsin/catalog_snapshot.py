@@ -0,0 +1,92 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+In-memory snapshot of the catalog records of a MetaX data catalog
+"""
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_MAX_AGE = 3600
+DEFAULT_SNAPSHOT_PAGE_SIZE = 1000
+
+
+class CatalogRecordSnapshot(object):
+    """
+    Index of the catalog records of one data catalog: preferred identifier to catalog record identifier and
+    research_dataset.modified, and back. Loaded from MetaX once per harvest job, so that harvest actions can
+    find out whether a dataset already has a catalog record, and when it was modified, without asking MetaX
+    one record at a time.
+
+    The snapshot is kept up to date with the catalog records the harvester itself creates, updates and deletes.
+    Records missing from the snapshot may still have been created to MetaX by someone else after the snapshot
+    was loaded, so callers should only trust hits and ask MetaX on a miss.
+    """
+
+    def __init__(self, data_catalog_id, records=(), max_age=None):
+        """
+        :param data_catalog_id: identifier of the data catalog the records belong to
+        :param records: MetaX catalog record dicts, having at least identifier and research_dataset
+        :param max_age: seconds after which the snapshot is considered expired, None for never
+        """
+        self.data_catalog_id = data_catalog_id
+        self.loaded_at = time.time()
+        self.max_age = max_age
+        self._by_preferred_identifier = {}
+        self._by_identifier = {}
+        self._lock = threading.Lock()
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self._by_identifier)
+
+    def add(self, record):
+        """
+        :param record: MetaX catalog record dict
+        """
+        research_dataset = record.get('research_dataset') or {}
+        self.set(research_dataset.get('preferred_identifier'), record.get('identifier'),
+                 research_dataset.get('modified'))
+
+    def set(self, preferred_identifier, metax_cr_id, modified):
+        """
+        Remember that the catalog record metax_cr_id has the given preferred identifier and modified value.
+        """
+        if not preferred_identifier or not metax_cr_id:
+            return
+        with self._lock:
+            previous = self._by_identifier.get(metax_cr_id)
+            if previous is not None and previous[0] != preferred_identifier:
+                self._by_preferred_identifier.pop(previous[0], None)
+            self._by_preferred_identifier[preferred_identifier] = (metax_cr_id, modified)
+            self._by_identifier[metax_cr_id] = (preferred_identifier, modified)
+
+    def remove(self, metax_cr_id):
+        with self._lock:
+            previous = self._by_identifier.pop(metax_cr_id, None)
+            if previous is not None and self._by_preferred_identifier.get(previous[0], (None,))[0] == metax_cr_id:
+                del self._by_preferred_identifier[previous[0]]
+
+    def find_by_preferred_identifier(self, preferred_identifier):
+        """
+        :return: (metax_cr_id, modified) tuple, or None if no catalog record has the preferred identifier
+        """
+        return self._by_preferred_identifier.get(preferred_identifier)
+
+    def find_by_identifier(self, metax_cr_id):
+        """
+        :return: (preferred_identifier, modified) tuple, or None if the catalog record is not in the snapshot
+        """
+        return self._by_identifier.get(metax_cr_id)
+
+    def expired(self):
+        return self.max_age is not None and time.time() - self.loaded_at > self.max_age
@@ -6,9 +6,61 @@
 # :license: GNU Affero General Public License version 3
 
 from functionally import first
+from lxml import etree
 from pylons import config
 
-from .utils import convert_language
+from .utils import convert_language, memoized_field, RecordViewCache
+
+NAMESPACES = {'oai': "http://www.openarchives.org/OAI/2.0/",
+              'cmd': "http://www.clarin.eu/cmd/"}
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+
+def _xpath(query):
+    return etree.XPath(query, namespaces=NAMESPACES)
+
+
+# Compiled once. Apart from locating the CMD element, paths are relative to the element they are
+# evaluated on, so that they only visit the nodes along the path instead of the whole document.
+_CMD = _xpath('//oai:record/oai:metadata/cmd:CMD')
+_RESOURCE_INFO = _xpath('cmd:Components/cmd:resourceInfo')
+
+_ROLE = _xpath('cmd:role/text()')
+_ORGANIZATION_NAME = _xpath('cmd:organizationInfo/cmd:organizationName')
+_ORGANIZATION_NAME_TEXT = _xpath('cmd:organizationInfo/cmd:organizationName/text()')
+_ORGANIZATION_SHORT_NAME = _xpath('cmd:organizationInfo/cmd:organizationShortName/text()')
+_ORGANIZATION_EMAIL = _xpath('cmd:organizationInfo/cmd:communicationInfo/cmd:email/text()')
+_ORGANIZATION_TELEPHONE = _xpath('cmd:organizationInfo/cmd:communicationInfo/cmd:telephoneNumber/text()')
+_ORGANIZATION_URL = _xpath('cmd:organizationInfo/cmd:communicationInfo/cmd:url/text()')
+_PERSON_SURNAME = _xpath('cmd:personInfo/cmd:surname/text()')
+_PERSON_GIVEN_NAME = _xpath('cmd:personInfo/cmd:givenName/text()')
+_PERSON_EMAIL = _xpath('cmd:personInfo/cmd:communicationInfo/cmd:email/text()')
+_PERSON_TELEPHONE = _xpath('cmd:personInfo/cmd:communicationInfo/cmd:telephoneNumber/text()')
+_PERSON_URL = _xpath('cmd:personInfo/cmd:communicationInfo/cmd:url/text()')
+_PERSON_AFFILIATION = _xpath('cmd:personInfo/cmd:affiliation')
+
+# Relative to resourceInfo. corpusInfo is either a child of resourceInfo or wrapped in resourceComponentType.
+_CORPUS_MEDIA_TYPE = '(cmd:corpusInfo | cmd:resourceComponentType/cmd:corpusInfo)/cmd:corpusMediaType'
+_TEXT_LANGUAGES = _xpath(_CORPUS_MEDIA_TYPE + '/cmd:corpusTextInfo/cmd:languageInfo/cmd:languageId/text()')
+_AUDIO_LANGUAGES = _xpath(_CORPUS_MEDIA_TYPE + '/cmd:corpusAudioInfo/cmd:languageInfo/cmd:languageId/text()')
+_TEXT_TIME_COVERAGE = _xpath(_CORPUS_MEDIA_TYPE +
+                             '/cmd:corpusTextInfo/cmd:timeCoverageInfo/cmd:timeCoverage/text()')
+_AUDIO_TIME_COVERAGE = _xpath(_CORPUS_MEDIA_TYPE +
+                              '/cmd:corpusAudioInfo/cmd:timeCoverageInfo/cmd:timeCoverage/text()')
+_DESCRIPTIONS = _xpath('cmd:identificationInfo/cmd:description')
+_TITLES = _xpath('cmd:identificationInfo/cmd:resourceName')
+_IDENTIFIERS = _xpath('cmd:identificationInfo/cmd:identifier/text()')
+_URLS = _xpath('cmd:identificationInfo/cmd:url/text()')
+_METADATA_LAST_UPDATED = _xpath('cmd:metadataInfo/cmd:metadataLastDateUpdated/text()')
+_LICENCE = _xpath('cmd:distributionInfo/cmd:licenceInfo/cmd:licence/text()')
+_DISTRIBUTION_RIGHTS_HOLDER_PERSONS = _xpath('cmd:distributionInfo/cmd:licenceInfo/cmd:distributionRightsHolderPerson')
+_DISTRIBUTION_RIGHTS_HOLDER_ORGANIZATIONS = _xpath(
+    'cmd:distributionInfo/cmd:licenceInfo/cmd:distributionRightsHolderOrganization')
+_IPR_HOLDER_PERSONS = _xpath('cmd:distributionInfo/cmd:iprHolderPerson')
+_IPR_HOLDER_ORGANIZATIONS = _xpath('cmd:distributionInfo/cmd:iprHolderOrganization')
+_CONTACT_PERSONS = _xpath('cmd:contactPerson')
+
+_parse_helpers = RecordViewCache()
 
 
 class CmdiParseException(Exception):
@@ -16,23 +68,33 @@ class CmdiParseException(Exception):
     pass
 
 
+def get_cmdi_parse_helper(xml):
+    """ Get the parse helper of a CMDI record, so that the mapper and the refiner of the same
+    record share the located elements and the fields already extracted from them.
+
+    Records are recognized by identity: the lxml object the mapper was given must be the
+    same object that is passed to the refiner in context['source_data'].
+
+    :param xml: an lxml object, representing a CMDI record
+    :return: CmdiParseHelper
+    """
+    return _parse_helpers.get(xml, CmdiParseHelper)
+
+
 class CmdiParseHelper:
-    namespaces = {'oai': "http://www.openarchives.org/OAI/2.0/",
-                  'cmd': "http://www.clarin.eu/cmd/"}
+    namespaces = NAMESPACES
 
     def __init__(self, xml, provider=None):
         """ Initialize the helper for parsing the given xml.
 
         :param xml: an lxml object, representing a CMDI record
         """
-        cmd = first(xml.xpath('//oai:record/oai:metadata/cmd:CMD',
-                              namespaces=CmdiParseHelper.namespaces))
+        cmd = first(_CMD(xml))
         if cmd is None:
             raise CmdiParseException(
                 "Unexpected XML format: No CMD -element found")
 
-        resource_info = cmd.xpath(
-            "//cmd:Components/cmd:resourceInfo", namespaces=CmdiParseHelper.namespaces)[0]
+        resource_info = first(_RESOURCE_INFO(cmd))
         if resource_info is None:
             raise CmdiParseException(
                 "Unexpected XML format: No resourceInfo -element found")
@@ -41,6 +103,7 @@ class CmdiParseHelper:
         self.cmd = cmd
         self.resource_info = resource_info
         self.provider = provider or config.get('ckan.site_url')
+        self._fields = {}
 
     @staticmethod
     def _strip_first(elements):
@@ -56,45 +119,45 @@ class CmdiParseHelper:
         """ Select list of texts and strip results. Use text() suffix in Xpath `query`.
 
         :param root: parent element (lxml) where selection is made.
-        :param query: Xpath query used to get data
+        :param query: compiled Xpath query used to get data
         :return: list of strings
         """
-        return [unicode(text).strip() for text in root.xpath(query, namespaces=cls.namespaces)]
+        return [unicode(text).strip() for text in query(root)]
 
     @classmethod
     def _get_organizations(cls, root, xpath):
         """ Extract organization dictionaries from XML using given Xpath.
 
         :param root: parent element (lxml) where selection is done.
-        :param xpath: xpath selector used to get data
+        :param xpath: compiled xpath selector used to get data
         :return: list of organization dictionaries
         """
-        return [{'role': cls._strip_first(organization.xpath("cmd:role/text()", namespaces=cls.namespaces)),
-                 'name': cls._text_xpath(organization, "cmd:organizationInfo/cmd:organizationName/text()"),
-                 'lang': [lang.get('{http://www.w3.org/XML/1998/namespace}lang', 'und').strip() for lang in organization.xpath("cmd:organizationInfo/cmd:organizationName", namespaces=cls.namespaces)],
-                 'short_name': cls._strip_first(organization.xpath("cmd:organizationInfo/cmd:organizationShortName/text()", namespaces=cls.namespaces)),
-                 'email': cls._strip_first(organization.xpath("cmd:organizationInfo/cmd:communicationInfo/cmd:email/text()", namespaces=cls.namespaces)),
-                 'telephoneNumber': cls._strip_first(organization.xpath("cmd:organizationInfo/cmd:communicationInfo/cmd:telephoneNumber/text()", namespaces=cls.namespaces)),
-                 'url': cls._strip_first(organization.xpath("cmd:organizationInfo/cmd:communicationInfo/cmd:url/text()", namespaces=cls.namespaces))}
+        return [{'role': cls._strip_first(_ROLE(organization)),
+                 'name': cls._text_xpath(organization, _ORGANIZATION_NAME_TEXT),
+                 'lang': [lang.get(XML_LANG, 'und').strip() for lang in _ORGANIZATION_NAME(organization)],
+                 'short_name': cls._strip_first(_ORGANIZATION_SHORT_NAME(organization)),
+                 'email': cls._strip_first(_ORGANIZATION_EMAIL(organization)),
+                 'telephoneNumber': cls._strip_first(_ORGANIZATION_TELEPHONE(organization)),
+                 'url': cls._strip_first(_ORGANIZATION_URL(organization))}
 
-                for organization in root.xpath(xpath, namespaces=cls.namespaces)]
+                for organization in xpath(root)]
 
     @classmethod
     def _get_persons(cls, root, xpath):
         """ Extract person dictionary from XML using given Xpath.
 
         :param root: parent element (lxml) where selection is done
-        :param xpath: xpath selector used to get data
+        :param xpath: compiled xpath selector used to get data
         :return: list of person dictionaries
         """
-        return [{'role': cls._strip_first(person.xpath("cmd:role/text()", namespaces=cls.namespaces)),
-                 'surname': cls._strip_first(person.xpath("cmd:personInfo/cmd:surname/text()", namespaces=cls.namespaces)),
-                 'given_name': cls._strip_first(person.xpath("cmd:personInfo/cmd:givenName/text()", namespaces=cls.namespaces)),
-                 'email': cls._strip_first(person.xpath("cmd:personInfo/cmd:communicationInfo/cmd:email/text()", namespaces=cls.namespaces)),
-                 'telephoneNumber': cls._strip_first(person.xpath("cmd:personInfo/cmd:communicationInfo/cmd:telephoneNumber/text()", namespaces=cls.namespaces)),
-                 'url': cls._strip_first(person.xpath("cmd:personInfo/cmd:communicationInfo/cmd:url/text()", namespaces=cls.namespaces)),
-                 'organization': first(cls._get_organizations(person, "cmd:personInfo/cmd:affiliation"))}
-                for person in root.xpath(xpath, namespaces=cls.namespaces)]
+        return [{'role': cls._strip_first(_ROLE(person)),
+                 'surname': cls._strip_first(_PERSON_SURNAME(person)),
+                 'given_name': cls._strip_first(_PERSON_GIVEN_NAME(person)),
+                 'email': cls._strip_first(_PERSON_EMAIL(person)),
+                 'telephoneNumber': cls._strip_first(_PERSON_TELEPHONE(person)),
+                 'url': cls._strip_first(_PERSON_URL(person)),
+                 'organization': first(cls._get_organizations(person, _PERSON_AFFILIATION))}
+                for person in xpath(root)]
 
     @classmethod
     def _get_person_as_agent(cls, person):
@@ -157,15 +220,14 @@ class CmdiParseHelper:
 
         return ret_obj
 
+    @memoized_field
     def parse_dataset_languages(self):
         """ Find languages as defined in language info
 
         :return: list of languages
         """
-        text_langs = self._text_xpath(
-            self.cmd, "//cmd:corpusInfo/cmd:corpusMediaType/cmd:corpusTextInfo/cmd:languageInfo/cmd:languageId/text()") or []
-        audio_langs = self._text_xpath(
-            self.cmd, "//cmd:corpusInfo/cmd:corpusMediaType/cmd:corpusAudioInfo/cmd:languageInfo/cmd:languageId/text()") or []
+        text_langs = self._text_xpath(self.resource_info, _TEXT_LANGUAGES) or []
+        audio_langs = self._text_xpath(self.resource_info, _AUDIO_LANGUAGES) or []
 
         for lang in audio_langs:
             if lang not in text_langs:
@@ -193,9 +255,8 @@ class CmdiParseHelper:
                   { language1: additional_description, language2: additional_description}]
         """
         descriptions = {}
-        for desc in self.xml.xpath("//cmd:identificationInfo/cmd:description", namespaces=CmdiParseHelper.namespaces):
-            lang = desc.get(
-                '{http://www.w3.org/XML/1998/namespace}lang', 'und').strip()
+        for desc in _DESCRIPTIONS(self.resource_info):
+            lang = desc.get(XML_LANG, 'und').strip()
             descriptions[lang] = unicode(desc.text).strip()
         return descriptions
 
@@ -205,38 +266,32 @@ class CmdiParseHelper:
         :return: dictionary of titles in format { language: title }
         """
         titles = {}
-        for title in self.xml.xpath('//cmd:identificationInfo/cmd:resourceName', namespaces=CmdiParseHelper.namespaces):
-            lang = title.get(
-                '{http://www.w3.org/XML/1998/namespace}lang', 'und').strip()
+        for title in _TITLES(self.resource_info):
+            lang = title.get(XML_LANG, 'und').strip()
             titles[lang] = title.text.strip()
         return titles
 
     def parse_modified(self):
         """ Find date when metadata was last modified """
-        return first(self._text_xpath(self.resource_info, "//cmd:metadataInfo/cmd:metadataLastDateUpdated/text()"))
+        return first(self._text_xpath(self.resource_info, _METADATA_LAST_UPDATED))
 
     def parse_temporal_coverage(self):
         """ Find time coverage of the metadata """
-        tc = first(self._text_xpath(self.resource_info,
-                                    "//cmd:corpusInfo/cmd:corpusMediaType/cmd:corpusTextInfo/cmd:timeCoverageInfo/cmd"
-                                    ":timeCoverage/text()")) or \
-             first(self._text_xpath(self.resource_info,
-                                    "//cmd:corpusInfo/cmd:corpusMediaType/cmd:corpusAudioInfo/cmd:timeCoverageInfo/cmd"
-                                    ":timeCoverage/text()"))
+        tc = first(self._text_xpath(self.resource_info, _TEXT_TIME_COVERAGE)) or \
+             first(self._text_xpath(self.resource_info, _AUDIO_TIME_COVERAGE))
         return tc
 
+    @memoized_field
     def parse_license(self):
         """ Find the license for the metadata """
-        return first(self._text_xpath(
-            self.resource_info, "//cmd:distributionInfo/cmd:licenceInfo/cmd:licence/text()"))
+        return first(self._text_xpath(self.resource_info, _LICENCE))
 
     def parse_distributor(self):
         """ Get the distribution rights holder (person) as an agent.
 
         If there are multiple distributors, choose the first one.
         """
-        distributor_persons = self._get_persons(
-            self.resource_info, "//cmd:distributionInfo/cmd:licenceInfo/cmd:distributionRightsHolderPerson")
+        distributor_persons = self._get_persons(self.resource_info, _DISTRIBUTION_RIGHTS_HOLDER_PERSONS)
         return self._get_person_as_agent(distributor_persons[0]) if distributor_persons else None
 
     def parse_creators(self):
@@ -247,10 +302,8 @@ class CmdiParseHelper:
 
     def parse_owners(self):
         """ Get a list of the owners (people or organizations) as agents. """
-        creator_persons = self._get_persons(
-            self.resource_info, "//cmd:distributionInfo/cmd:iprHolderPerson")
-        creator_organizations = self._get_organizations(
-            self.resource_info, "//cmd:distributionInfo/cmd:iprHolderOrganization")
+        creator_persons = self._get_persons(self.resource_info, _IPR_HOLDER_PERSONS)
+        creator_organizations = self._get_organizations(self.resource_info, _IPR_HOLDER_ORGANIZATIONS)
         return [
             self._get_person_as_agent(person) for person in creator_persons
         ] + [
@@ -259,10 +312,8 @@ class CmdiParseHelper:
 
     def parse_curators(self):
         """ Get the curators (contacts) as agents. Curators may be people or organizations. """
-        contact_persons = self._get_persons(
-            self.resource_info, "//cmd:contactPerson")
-        contact_orgs = self._get_organizations(
-            self.resource_info, "//cmd:distributionInfo/cmd:licenceInfo/cmd:distributionRightsHolderOrganization")
+        contact_persons = self._get_persons(self.resource_info, _CONTACT_PERSONS)
+        contact_orgs = self._get_organizations(self.resource_info, _DISTRIBUTION_RIGHTS_HOLDER_ORGANIZATIONS)
         return [
             self._get_person_as_agent(person)
             for person in contact_persons
@@ -271,12 +322,12 @@ class CmdiParseHelper:
             for organization in contact_orgs
         ]
 
+    @memoized_field
     def parse_metadata_identifiers(self):
         """ Get the metadata identifiers. """
-        return self._text_xpath(
-            self.cmd, "//cmd:identificationInfo/cmd:identifier/text()")
+        return self._text_xpath(self.resource_info, _IDENTIFIERS)
 
+    @memoized_field
     def language_bank_fallback_identifier(self):
         """ Get the metadata identifiers. """
-        return self._text_xpath(
-            self.cmd, "//cmd:identificationInfo/cmd:url/text()")
\ No newline at end of file
+        return self._text_xpath(self.resource_info, _URLS)
\ No newline at end of file
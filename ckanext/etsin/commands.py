@@ -0,0 +1,45 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Paster commands of the Etsin harvester
+"""
+
+import sys
+
+from ckan.lib.cli import CkanCommand
+
+
+class EtsinCommand(CkanCommand):
+    """
+    Etsin harvester maintenance commands
+
+    Usage:
+
+      etsin clear-fingerprints
+        - Forget the fingerprints of the datasets sent to MetaX, so that every dataset is sent to MetaX
+          again on the next harvest. Use this e.g. after the catalog records have been removed from MetaX.
+    """
+
+    summary = __doc__.split('\n')[1]
+    usage = __doc__
+    max_args = 1
+    min_args = 1
+
+    def command(self):
+        self._load_config()
+        cmd = self.args[0]
+        if cmd == 'clear-fingerprints':
+            self.clear_fingerprints()
+        else:
+            print('Command {0} not recognized'.format(cmd))
+            sys.exit(1)
+
+    def clear_fingerprints(self):
+        from ckanext.etsin.fingerprints import get_fingerprint_store
+        get_fingerprint_store().clear()
+        print('Fingerprints cleared')
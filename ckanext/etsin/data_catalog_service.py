@@ -7,13 +7,116 @@
 
 import os
 import requests
-from requests import exceptions, put, post, head
+from requests import exceptions
 import json
 from pylons import config
 import logging
+import threading
+
+from ckanext.etsin.metax_client import get_metax_client
 
 log = logging.getLogger(__name__)
 
+RESOURCES_PATH = os.path.dirname(os.path.realpath(__file__)) + '/resources/'
+HARVEST_SOURCE_DATA_CATALOG_FILENAMES = {
+    'syke': 'syke_data_catalog.json',
+    'kielipankki': 'kielipankki_data_catalog.json',
+    'fsd': 'fsd_data_catalog.json',
+}
+
+
+class ReadOnlyDict(dict):
+    """
+    Dictionary that refuses modifications. Used for sharing parsed data catalogs between callers.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Data catalog is read-only, copy it before modifying")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return ReadOnlyDict((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class DataCatalogRegistry(object):
+    """
+    Parses each data catalog json file in resources once and hands out read-only views of it.
+    A file is parsed again when its modification time changes.
+    """
+
+    def __init__(self, resources_path=RESOURCES_PATH):
+        self.resources_path = resources_path
+        self._catalogs = {}
+        self._lock = threading.Lock()
+
+    def get(self, data_catalog_json_filename):
+        """
+        :param data_catalog_json_filename: data catalog json filename in resources
+        :return: the data catalog as ReadOnlyDict, or None if the file does not exist or is not valid json
+        """
+        if not data_catalog_json_filename:
+            return None
+
+        file_path = self.resources_path + data_catalog_json_filename
+        try:
+            mtime = os.path.getmtime(file_path)
+        except OSError:
+            log.error("No data catalog file found in path " + file_path)
+            return None
+
+        cached = self._catalogs.get(data_catalog_json_filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with self._lock:
+            try:
+                with open(file_path, 'r') as f:
+                    catalog = _freeze(json.load(f))
+            except (IOError, ValueError) as e:
+                log.error("Unable to read data catalog file {0}: {1}".format(file_path, repr(e)))
+                return None
+            self._catalogs[data_catalog_json_filename] = (mtime, catalog)
+            return catalog
+
+    def get_identifier(self, data_catalog_json_filename):
+        """
+        :return: catalog_json.identifier of the data catalog or None
+        """
+        catalog = self.get(data_catalog_json_filename)
+        if catalog is None:
+            return None
+        return catalog.get('catalog_json', {}).get('identifier', None)
+
+    def validate(self, data_catalog_json_filenames=None):
+        """
+        Check that the data catalog files can be parsed and contain a data catalog identifier.
+
+        :param data_catalog_json_filenames: filenames to check, defaults to all harvest source data catalogs
+        :return: True if all files are ok
+        """
+        if data_catalog_json_filenames is None:
+            data_catalog_json_filenames = HARVEST_SOURCE_DATA_CATALOG_FILENAMES.values()
+
+        ok = True
+        for filename in data_catalog_json_filenames:
+            if not self.get_identifier(filename):
+                log.error("Data catalog file {0} is missing, invalid or does not contain identifier".format(filename))
+                ok = False
+        return ok
+
+    def clear(self):
+        with self._lock:
+            self._catalogs = {}
+
+
+data_catalogs = DataCatalogRegistry()
+
 
 class DataCatalogMetaxAPIService:
 
@@ -22,10 +125,7 @@ class DataCatalogMetaxAPIService:
     METAX_DATA_CATALOG_DETAIL_URL = METAX_DATA_CATALOG_API_POST_URL + '/{id}'
 
     def __init__(self):
-        self.api_user = config.get('metax.api_user')
-        self.api_password = config.get('metax.api_password')
-        from ckanext.etsin.utils import str_to_bool
-        self.verify_ssl = str_to_bool(config.get('metax.verify_ssl'))
+        self.client = get_metax_client()
 
     def create_data_catalog(self, data_catalog_json_filename):
         if not data_catalog_json_filename:
@@ -69,8 +169,7 @@ class DataCatalogMetaxAPIService:
             return True
         log.info("Checking if data catalog with identifier " + data_catalog_id + " already exists in Metax..")
         try:
-            r = head(self.METAX_DATA_CATALOG_DETAIL_URL.format(id=data_catalog_id), verify=self.verify_ssl,
-                     auth=(self.api_user, self.api_password))
+            r = self.client.head(self.METAX_DATA_CATALOG_DETAIL_URL.format(id=data_catalog_id))
             return r.status_code == requests.codes.ok
         except Exception:
             log.error("Checking existence failed for some reason most likely in Metax data catalog API. "
@@ -78,16 +177,10 @@ class DataCatalogMetaxAPIService:
         return True
 
     def _do_put_request(self, url, data):
-        return self._handle_request_response_with_raise(put(url,
-                                                            json=data,
-                                                            auth=(self.api_user, self.api_password),
-                                                            verify=self.verify_ssl))
+        return self._handle_request_response_with_raise(self.client.put(url, json=data))
 
     def _do_post_request(self, url, data):
-        return self._handle_request_response_with_raise(post(url,
-                                                             json=data,
-                                                             auth=(self.api_user, self.api_password),
-                                                             verify=self.verify_ssl))
+        return self._handle_request_response_with_raise(self.client.post(url, json=data))
 
     @staticmethod
     def _handle_request_response_with_raise(response):
@@ -101,24 +194,14 @@ class DataCatalogMetaxAPIService:
             log.error("No data catalog json filename given")
             return None
 
-        try:
-            file_path = os.path.dirname(os.path.realpath(__file__)) + '/resources/' + data_catalog_json_filename
-            with open(file_path, 'r') as f:
-                return json.load(f)['catalog_json'].get('identifier', None)
-        except IOError:
-            log.warning("No file exists in path {0} related to data catalog json filename {1}"
-                        .format(file_path, data_catalog_json_filename))
-            return None
+        return data_catalogs.get_identifier(data_catalog_json_filename)
 
     @staticmethod
     def get_data_catalog_from_file(data_catalog_json_filename):
-        try:
-            file_path = os.path.dirname(os.path.realpath(__file__)) + '/resources/' + data_catalog_json_filename
-            with open(file_path, 'r') as f:
-                return json.load(f)
-        except IOError:
-            log.error("No data catalog file found in path " + file_path)
-            return None
+        """
+        :return: read-only view of the data catalog, see DataCatalogRegistry
+        """
+        return data_catalogs.get(data_catalog_json_filename)
 
 
 def ensure_data_catalog_ok(harvest_source_name):
@@ -151,12 +234,22 @@ def ensure_data_catalog_ok(harvest_source_name):
 
 
 def get_data_catalog_filename_for_harvest_source(harvest_source_name):
-    if harvest_source_name == 'syke':
-        return 'syke_data_catalog.json'
-    elif harvest_source_name == 'kielipankki':
-        return 'kielipankki_data_catalog.json'
-    elif harvest_source_name == 'fsd':
-        return 'fsd_data_catalog.json'
-    else:
+    filename = HARVEST_SOURCE_DATA_CATALOG_FILENAMES.get(harvest_source_name)
+    if not filename:
         log.error("Unknown harvest source name, unable to do any data catalog related operations. Aborting")
-        return False
\ No newline at end of file
+        return False
+    return filename
+
+
+def get_data_catalog_id_for_harvest_source(harvest_source_name):
+    """
+    :return: identifier of the data catalog of the harvest source, or None
+    """
+    return data_catalogs.get_identifier(get_data_catalog_filename_for_harvest_source(harvest_source_name))
+
+
+def validate_data_catalogs():
+    """
+    Check all harvest source data catalog files. Called when the plugin is configured.
+    """
+    return data_catalogs.validate()
\ No newline at end of file
@@ -0,0 +1,97 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+View of a harvested DDI 2.5 codebook record shared by the DDI mapper and the FSD refiner
+"""
+
+from functionally import first
+from lxml import etree
+
+from .utils import memoized_field, RecordViewCache
+
+NAMESPACES = {'oai': "http://www.openarchives.org/OAI/2.0/",
+              'ddi': "ddi:codebook:2_5"}
+
+_CODEBOOK = etree.XPath('//oai:record/oai:metadata/ddi:codeBook', namespaces=NAMESPACES)
+
+_records = RecordViewCache()
+
+
+class DdiParseException(Exception):
+    """ Thrown when the harvested record is not a DDI codebook. """
+    pass
+
+
+def get_ddi_record(xml):
+    """ Get the view of a DDI record, so that the mapper and the refiner of the same record
+    search for the codebook only once and share the sections located in it.
+
+    :param xml: an lxml object, representing a DDI 2.5 record
+    :return: DdiRecord
+    """
+    return _records.get(xml, DdiRecord)
+
+
+class DdiRecord(object):
+    """
+    Located codeBook and stdyDscr elements of a DDI record, and memoized accessors for the
+    repeatable sections of stdyDscr. find and findall evaluate a path relative to each element
+    of a section, which gives the same elements in the same order as evaluating the full path
+    from stdyDscr.
+    """
+
+    def __init__(self, xml):
+        """
+        :param xml: an lxml object, representing a DDI 2.5 record
+        """
+        codebook = first(_CODEBOOK(xml))
+        if codebook is None:
+            raise DdiParseException("Unexpected XML format: No codeBook -element found")
+
+        self.xml = xml
+        self.codebook = codebook
+        self.stdy = codebook.find('ddi:stdyDscr', NAMESPACES)
+        self._fields = {}
+
+    @staticmethod
+    def findall(elements, path):
+        """
+        :param elements: list of elements, e.g. citations()
+        :param path: ElementPath relative to each element, using the ddi prefix
+        :return: list of matching elements
+        """
+        return [found for element in elements for found in element.findall(path, NAMESPACES)]
+
+    @classmethod
+    def find(cls, elements, path):
+        return first(cls.findall(elements, path))
+
+    @memoized_field
+    def citations(self):
+        """ stdyDscr/citation elements """
+        return self.stdy.findall('ddi:citation', NAMESPACES)
+
+    @memoized_field
+    def stdy_infos(self):
+        """ stdyDscr/stdyInfo elements """
+        return self.stdy.findall('ddi:stdyInfo', NAMESPACES)
+
+    @memoized_field
+    def sum_dscrs(self):
+        """ stdyDscr/stdyInfo/sumDscr elements """
+        return self.findall(self.stdy_infos(), 'ddi:sumDscr')
+
+    @memoized_field
+    def data_accs(self):
+        """ stdyDscr/dataAccs elements """
+        return self.stdy.findall('ddi:dataAccs', NAMESPACES)
+
+    @memoized_field
+    def file_names(self):
+        """ fileDscr/fileTxt/fileName elements of the codebook """
+        return self.codebook.findall('ddi:fileDscr/ddi:fileTxt/ddi:fileName', NAMESPACES)
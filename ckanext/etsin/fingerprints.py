@@ -0,0 +1,225 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Fingerprints of research datasets last sent to MetaX, used for skipping unchanged datasets
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from pylons import config
+
+from ckanext.etsin.utils import sanitize_for_json
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FINGERPRINT_MAX_AGE = 7 * 24 * 3600
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def fingerprint(research_dataset):
+    """
+    Canonical hash of a research dataset. Two datasets with the same content have the same
+    fingerprint regardless of dictionary key order or whether text is str or unicode.
+
+    :param research_dataset: MetaX research dataset dictionary
+    :return: hex digest string, or None if the dataset can not be serialized
+    """
+    try:
+        canonical = json.dumps(sanitize_for_json(research_dataset), sort_keys=True, separators=(',', ':'),
+                               ensure_ascii=True)
+    except (TypeError, ValueError) as e:
+        log.warning("Unable to fingerprint research dataset: {0}".format(repr(e)))
+        return None
+    return hashlib.sha256(canonical).hexdigest()
+
+
+class FingerprintStore(object):
+    """
+    In-memory store of the fingerprint and MetaX catalog record identifier of the research dataset
+    last successfully sent to MetaX, keyed by CKAN package id.
+
+    Fingerprints older than max_age seconds are treated as unknown, so that every dataset is sent to
+    MetaX again at least once per max_age even if it has not changed.
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._fingerprints = {}
+        self._preferred_identifiers = {}
+        self._lock = threading.Lock()
+
+    def _valid_since(self):
+        return time.time() - self.max_age if self.max_age is not None else None
+
+    def _get_valid(self, package_id):
+        stored = self._fingerprints.get(package_id)
+        valid_since = self._valid_since()
+        if stored is None or (valid_since is not None and stored[3] < valid_since):
+            return None
+        return stored
+
+    def get(self, package_id):
+        """
+        :return: (fingerprint, metax_cr_id) tuple or None
+        """
+        with self._lock:
+            stored = self._get_valid(package_id)
+            return stored[:2] if stored else None
+
+    def find_by_preferred_identifier(self, preferred_identifier):
+        """
+        :return: (package_id, fingerprint, metax_cr_id) tuple or None
+        """
+        with self._lock:
+            package_id = self._preferred_identifiers.get(preferred_identifier)
+            stored = self._get_valid(package_id) if package_id is not None else None
+            if stored is None:
+                return None
+            return (package_id,) + stored[:2]
+
+    def set(self, package_id, fingerprint, metax_cr_id, preferred_identifier=None):
+        """
+        Store fingerprint for a package. A preferred identifier belongs to one package at a time,
+        so other packages stored with the same preferred identifier are dropped.
+        """
+        if fingerprint is None:
+            return
+        with self._lock:
+            self._drop(package_id)
+            if preferred_identifier:
+                self._drop(self._preferred_identifiers.get(preferred_identifier))
+                self._preferred_identifiers[preferred_identifier] = package_id
+            self._fingerprints[package_id] = (fingerprint, metax_cr_id, preferred_identifier, time.time())
+
+    def delete(self, package_id):
+        with self._lock:
+            self._drop(package_id)
+
+    def clear(self):
+        """
+        Forget all fingerprints, e.g. after the MetaX target environment has been emptied.
+        """
+        with self._lock:
+            self._fingerprints = {}
+            self._preferred_identifiers = {}
+
+    def _drop(self, package_id):
+        stored = self._fingerprints.pop(package_id, None)
+        if stored and stored[2] and self._preferred_identifiers.get(stored[2]) == package_id:
+            del self._preferred_identifiers[stored[2]]
+
+    def is_unchanged(self, package_id, fingerprint):
+        if fingerprint is None:
+            return False
+        stored = self.get(package_id)
+        return stored is not None and stored[0] == fingerprint
+
+
+class SqliteFingerprintStore(FingerprintStore):
+    """
+    Fingerprint store persisted in a local SQLite file, so that unchanged datasets are
+    recognized across harvester restarts.
+    """
+
+    def __init__(self, db_path, max_age=None):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    package_id TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    metax_cr_id TEXT,
+                    preferred_identifier TEXT,
+                    updated REAL
+                )""")
+            self._connection.execute("""
+                CREATE INDEX IF NOT EXISTS fingerprints_preferred_identifier
+                ON fingerprints (preferred_identifier)""")
+
+    def get(self, package_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT fingerprint, metax_cr_id FROM fingerprints WHERE package_id = ? AND updated >= ?",
+                (package_id, self._valid_since() or 0)).fetchone()
+        return tuple(row) if row else None
+
+    def find_by_preferred_identifier(self, preferred_identifier):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT package_id, fingerprint, metax_cr_id FROM fingerprints "
+                "WHERE preferred_identifier = ? AND updated >= ?",
+                (preferred_identifier, self._valid_since() or 0)).fetchone()
+        return tuple(row) if row else None
+
+    def set(self, package_id, fingerprint, metax_cr_id, preferred_identifier=None):
+        if fingerprint is None:
+            return
+        with self._lock, self._connection:
+            if preferred_identifier:
+                self._connection.execute(
+                    "DELETE FROM fingerprints WHERE preferred_identifier = ? AND package_id != ?",
+                    (preferred_identifier, package_id))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO fingerprints "
+                "(package_id, fingerprint, metax_cr_id, preferred_identifier, updated) VALUES (?, ?, ?, ?, ?)",
+                (package_id, fingerprint, metax_cr_id, preferred_identifier, time.time()))
+
+    def delete(self, package_id):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM fingerprints WHERE package_id = ?", (package_id,))
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM fingerprints")
+
+    def close(self):
+        self._connection.close()
+
+
+def get_fingerprint_store():
+    """
+    Get the process-wide fingerprint store. If metax.fingerprint_db is configured, fingerprints
+    are persisted to that SQLite file. Otherwise they are kept in memory. Fingerprints expire after
+    metax.fingerprint_max_age seconds, which defaults to a week.
+
+    Persisted fingerprints can be forgotten with the paster command etsin clear-fingerprints,
+    e.g. after the MetaX target environment has been emptied or migrated.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                db_path = config.get('metax.fingerprint_db')
+                max_age = config.get('metax.fingerprint_max_age', DEFAULT_FINGERPRINT_MAX_AGE)
+                max_age = int(max_age) if max_age else None
+                if db_path:
+                    try:
+                        _store = SqliteFingerprintStore(db_path, max_age=max_age)
+                    except sqlite3.Error as e:
+                        log.error("Unable to open fingerprint database {0}: {1}. Keeping fingerprints in memory."
+                                  .format(db_path, repr(e)))
+                if _store is None:
+                    _store = FingerprintStore(max_age=max_age)
+    return _store
+
+
+def reset_fingerprint_store():
+    global _store
+    with _store_lock:
+        if isinstance(_store, SqliteFingerprintStore):
+            _store.close()
+        _store = None
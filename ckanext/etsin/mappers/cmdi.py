@@ -5,7 +5,7 @@
 # :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
 # :license: GNU Affero General Public License version 3
 
-from ckanext.etsin.cmdi_parse_helper import CmdiParseHelper
+from ckanext.etsin.cmdi_parse_helper import get_cmdi_parse_helper
 
 from ..utils import get_language_identifier, convert_language, get_string_as_valid_datetime_string
 
@@ -24,7 +24,7 @@ class CmdiMetaxMapper:
         :param xml: xml element (lxml)
         :return: dictionary
         """
-        cmdi = CmdiParseHelper(xml)
+        cmdi = get_cmdi_parse_helper(xml)
 
         languages = cmdi.parse_dataset_languages()
         language_list = [{'identifier': get_language_identifier(convert_language(lang))} for lang in languages]
@@ -11,23 +11,96 @@ Map Datacite 3.1 and 4.0 xml to Metax values
 
 # NOTE: This mapper should be fixed to work with the data model. Currently would break.
 
-from lxml import objectify
+from lxml import etree
 
 from ..metax_api import get_ref_data
-from ..utils import validate_6391, get_language_identifier, is_uri
+from ..utils import validate_6391, get_language_identifier, is_uri, convert_language
 
 import logging
 log = logging.getLogger(__name__)
 
+# DataCite resource element. Zenodo uses a default namespace and OpenAire prefixed elements,
+# in DataCite kernel 3 or 4 namespace, so the element is matched by its local name.
+_RESOURCE = etree.XPath("descendant-or-self::*[local-name()='resource']")
+
+_queries = {}
+
+
+class _DataCiteQueries(object):
+    '''
+    Compiled queries for the elements of a DataCite resource in one namespace.
+    Paths are relative to the resource element or to the element named in the attribute.
+    '''
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.identifier = self._xpath('identifier')
+        self.creators = self._xpath('creators/creator')
+        self.creator_name = self._xpath('creatorName')
+        self.contributors = self._xpath('contributors/contributor')
+        self.contributor_name = self._xpath('contributorName')
+        self.name_identifier = self._xpath('nameIdentifier')
+        self.affiliation = self._xpath('affiliation')
+        self.language = self._xpath('language')
+        self.titles = self._xpath('titles/title')
+        self.publisher = self._xpath('publisher')
+        self.publication_year = self._xpath('publicationYear')
+        self.subjects = self._xpath('subjects/subject')
+        self.dates = self._xpath('dates/date')
+        self.alternate_identifiers = self._xpath('alternateIdentifiers/alternateIdentifier')
+        self.related_identifiers = self._xpath('relatedIdentifiers/relatedIdentifier')
+        self.rights = self._xpath('rightsList/rights')
+        self.descriptions = self._xpath('descriptions/description')
+        self.geo_locations = self._xpath('geoLocations/geoLocation')
+        # geoLocation
+        self.point = self._xpath('geoLocationPoint')
+        self.box = self._xpath('geoLocationBox')
+        self.place = self._xpath('geoLocationPlace')
+        self.polygon = self._xpath('geoLocationPolygon')
+        # geoLocationPolygon
+        self.polygon_points = self._xpath('polygonPoint')
+        # geoLocationPoint and polygonPoint
+        self.longitude = self._xpath('pointLongitude')
+        self.latitude = self._xpath('pointLatitude')
+        # geoLocationBox
+        self.west = self._xpath('westBoundLongitude')
+        self.east = self._xpath('eastBoundLongitude')
+        self.north = self._xpath('northBoundLatitude')
+        self.south = self._xpath('southBoundLatitude')
+
+    def _xpath(self, path):
+        if not self.namespace:
+            return etree.XPath(path)
+        return etree.XPath('/'.join('dc:' + step for step in path.split('/')), namespaces={'dc': self.namespace})
+
+
+def _get_queries(resource):
+    namespace = etree.QName(resource).namespace
+    queries = _queries.get(namespace)
+    if queries is None:
+        queries = _queries.setdefault(namespace, _DataCiteQueries(namespace))
+    return queries
+
+
+def _first(query, element):
+    return next(iter(query(element)), None)
+
+
+def _first_text(query, element):
+    found = _first(query, element)
+    return found.text if found is not None else None
+
+
 # Mapper receives an LXML element and maps it to Metax format
 
 
 def datacite_mapper(xml):
 
-    from lxml import etree
-
-    # Strip element prefixes
-    xml = _strip_prefixes(xml)
+    resource = _first(_RESOURCE, xml)
+    if resource is None:
+        log.error("No DataCite resource element found")
+        return {}
+    q = _get_queries(resource)
 
     # Start with an empty slate
     package_dict = {}
@@ -35,8 +108,8 @@ def datacite_mapper(xml):
     # Map identifier
     # According to DataCite 4.0 schema, IdentifierType should always be "DOI",
     # but OpenAire seems to use URLs as well
-    identifier = xml.find('.//identifier')
-    identifier_type = xml.find('.//identifier').get('identifierType')
+    identifier = _first(q.identifier, resource)
+    identifier_type = identifier.get('identifierType')
     if identifier_type == "URL":
         package_dict['preferred_identifier'] = identifier.text
     elif identifier_type == "DOI":
@@ -47,20 +120,20 @@ def datacite_mapper(xml):
 
     # Map creators
     package_dict['creator'] = []
-    for creator in xml.findall('.//creator'):
-        person = _get_person(creator)
+    for creator in q.creators(resource):
+        person = _get_person(creator, q)
         if not person:
             continue
         package_dict['creator'].append(person)
 
     # Map language
-    language = xml.find('.//identifier')
-    if language is not None:
+    language = _first_text(q.language, resource)
+    if language:
         # Language should be either ISO 639-1 or IETF BCP 47. The first two
         # characters of IETF BCP 47 should be same as ISO 639-1 code.
         if validate_6391(language[0:2]):
-            language = get_language_identifier(language[0:2])
-            package_dict['language'] = language
+            language = language[0:2]
+            package_dict['language'] = [{'identifier': get_language_identifier(convert_language(language))}]
         else:
             language = "und"
     else:
@@ -70,33 +143,33 @@ def datacite_mapper(xml):
 
     # Map title
     # In case of multiple primary titles, pick only the first one
-    for title in xml.findall('.//title'):
-        title_type = xml.find('.//title').get('titleType')
+    for title in q.titles(resource):
+        title_type = title.get('titleType')
         if not title_type:
             # Title is primary when there's no titleType
             package_dict['title'] = {language: title.text}
             break
 
     # Map publisher
-    publisher = xml.find('.//publisher').text
+    publisher = _first_text(q.publisher, resource)
     package_dict['publisher'] = []
     if publisher:
         package_dict['publisher'].append({'name': publisher})
 
     # Map publication year
-    publication_year = xml.find('.//publicationYear').text
+    publication_year = _first_text(q.publication_year, resource)
     package_dict['issued'] = publication_year
 
     # Map subject
     package_dict['keyword'] = []
     package_dict['theme'] = []
-    for subject in xml.findall('.//subject'):
+    for subject in q.subjects(resource):
         subject_scheme = subject.get('subjectScheme')
         scheme_URI = subject.get('schemeURI')
         value_URI = subject.get('valueURI')
         if subject_scheme is None and scheme_URI is None:
             package_dict['keyword'].append(subject.text)
-        elif subject_scheme == "YSO" or "finto.fi/yso" in scheme_URI:
+        elif subject_scheme == "YSO" or "finto.fi/yso" in (scheme_URI or ''):
             if value_URI is not None:
                 package_dict['theme'].append({'identifier': value_URI})
             elif is_uri(subject.text):
@@ -106,8 +179,8 @@ def datacite_mapper(xml):
     package_dict['contributor'] = []
     package_dict['curator'] = []
     package_dict['rights_holder'] = []
-    for contributor in xml.findall('.//contributor'):
-        contributor_type = contributor.find('.//contributorType').text
+    for contributor in q.contributors(resource):
+        contributor_type = contributor.get('contributorType')
         if contributor_type in ["DataCollector", "DataCurator", "DataManager", "Editor", "Producer", "ProjectLeader", "ProjectMember", "Researcher", "ResearchGroup", "Supervisor"]:
             metax_contributor_type = "contributor"
         elif contributor_type == "Distributor":
@@ -118,7 +191,7 @@ def datacite_mapper(xml):
             metax_contributor_type = "rights_holder"
         else:
             continue
-        person = _get_person(contributor)
+        person = _get_person(contributor, q)
         if not person:
             continue
         package_dict[metax_contributor_type].append(person)
@@ -137,7 +210,7 @@ def datacite_mapper(xml):
 
     # Map date
     package_dict['provenance'] = []
-    for date in xml.findall('.//date'):
+    for date in q.dates(resource):
         date_type = date.get('dateType')
         if date_type in ['todo: find correct reference data']:  # TODO
             package_dict['provenance'].append({
@@ -149,7 +222,7 @@ def datacite_mapper(xml):
 
     # Map alternate identifier
     package_dict['other_identifier'] = []
-    for alternate_identifier in xml.findall('.//alternateIdentifier'):
+    for alternate_identifier in q.alternate_identifiers(resource):
         alternate_identifier_type = alternate_identifier.get(
             'alternateIdentifierType')
         if alternate_identifier_type == "URL":
@@ -160,7 +233,7 @@ def datacite_mapper(xml):
 
     # Map related identifier
     package_dict['related_entity'] = []
-    for related_identifier in xml.findall('.//relatedIdentifier'):
+    for related_identifier in q.related_identifiers(resource):
         related_identifier_type = related_identifier.get('relatedIdentifierType')
         if related_identifier_type == "URL":
             relation_type = related_identifier.get('relationType')
@@ -170,13 +243,13 @@ def datacite_mapper(xml):
             })
 
     # Map version
-    version = xml.find('.//publicationYear')
+    version = _first(q.publication_year, resource)
     if version is not None:
         package_dict['version_info'] = version.text
 
     # Map rights
     package_dict['access_rights'] = []
-    for right in xml.findall('.//rights'):
+    for right in q.rights(resource):
         rights_URI = right.get('rightsURI')
 
         # Query reference data for identifier matching this URI
@@ -193,73 +266,85 @@ def datacite_mapper(xml):
 
     # Map description
     full_description = ""
-    for description in xml.findall('.//description'):
+    for description in q.descriptions(resource):
         full_description += description.get('descriptionType') + \
             ': ' + description.text + ' '
     package_dict['description'] = [{language: full_description}]
 
     # Map geolocation
     package_dict['location'] = []
-    for location in xml.findall('.//geoLocation'):
-        point = location.find('.//geoLocationPoint')
+    for location in q.geo_locations(resource):
+        point = _first(q.point, location)
         if point is not None:
-            longitude = point.find('.//pointLongitude').text
-            latitude = point.find('.//pointLatitude').text
-            package_dict['location'].append({
-                "as_wkt": "POINT (" + longitude + " " + latitude + ")"})
-        box = location.find('.//geoLocationBox')
+            coordinates = _get_point(point, q)
+            if coordinates:
+                package_dict['location'].append({"as_wkt": "POINT (" + coordinates + ")"})
+        box = _first(q.box, location)
         if box is not None:
-            west = point.find('.//westBoundLongitude').text
-            east = point.find('.//eastBoundLongitude').text
-            north = point.find('.//northBoundLatitude').text
-            south = point.find('.//soundBoundLatitude').text
-            package_dict['location'].append({
-                "as_wkt": "POLYGON ((" + west + " " + south + ", " + west + " " + north + ", " + east + " " + north + ", " + east + " " + south + ", " + west + " " + south + "))"})
-        place = location.find('.//geoLocationPlace')
+            bounds = _get_box(box, q)
+            if bounds:
+                west, east, north, south = bounds
+                package_dict['location'].append({
+                    "as_wkt": "POLYGON ((" + west + " " + south + ", " + west + " " + north + ", " + east + " " + north + ", " + east + " " + south + ", " + west + " " + south + "))"})
+        place = _first(q.place, location)
         if place is not None:
             package_dict['location'].append({"geographic_name": place.text})
-        polygon = location.find('.//geoLocationPolygon')
+        polygon = _first(q.polygon, location)
         if polygon is not None:
-            polygon_string = "POLYGON (("
-            for point in xml.findall('.//polygonPoint'):
-                longitude = point.find('.//pointLongitude').text
-                latitude = point.find('.//pointLatitude').text
-                polygon_string += longitude + " " + latitude + ", "
-            polygon_string[-2:] = "))"  # replace last ", "
+            points = [_get_point(point, q) for point in q.polygon_points(polygon)]
+            if points and all(points):
+                package_dict['location'].append({"as_wkt": "POLYGON ((" + ", ".join(points) + "))"})
 
     return {
         "research_dataset": package_dict}
 
 
-def _strip_prefixes(xml):
-    root = xml.getroottree()
-
-    # Zenodo uses {namespace}element
-    for elem in root.getiterator():
-        if not hasattr(elem.tag, 'find'):  # pass comments
-            continue
-
-        i = elem.tag.find('}')
-        if i >= 0:
-            elem.tag = elem.tag[i + 1:]
+def _get_point(point, q):
+    '''
+    Input: DataCite geoLocationPoint or polygonPoint element and the queries for its namespace.
+    Returns "longitude latitude", or None if the point has no coordinates. DataCite 4 has
+    the coordinates in pointLongitude and pointLatitude, DataCite 3 as "latitude longitude" text.
+    '''
+    longitude = _first_text(q.longitude, point)
+    latitude = _first_text(q.latitude, point)
+    if longitude is None or latitude is None:
+        coordinates = (point.text or '').split()
+        if len(coordinates) != 2:
+            return None
+        latitude, longitude = coordinates
+    return longitude.strip() + " " + latitude.strip()
 
-    # OpenAire uses namespace:element
-    objectify.deannotate(root, cleanup_namespaces=True)
 
-    return xml
+def _get_box(box, q):
+    '''
+    Input: DataCite geoLocationBox element and the queries for its namespace.
+    Returns (west, east, north, south) tuple, or None if the box has no coordinates. DataCite 4 has
+    the bounds in elements of their own, DataCite 3 as "south west north east" text.
+    '''
+    bounds = [_first_text(query, box) for query in (q.west, q.east, q.north, q.south)]
+    if None in bounds:
+        coordinates = (box.text or '').split()
+        if len(coordinates) != 4:
+            return None
+        south, west, north, east = coordinates
+        bounds = [west, east, north, south]
+    return tuple(bound.strip() for bound in bounds)
 
 
-def _get_person(person):
+def _get_person(person, q):
     '''
-    Input: LXML element that contains either DataCite creator or contributor.
+    Input: LXML element that contains either DataCite creator or contributor,
+    and the queries for its namespace.
     '''
     person_dict = {'@type': 'Person'}
-    name = person.find('.//creatorName')
+    name = _first(q.creator_name, person)
     if name is None:
-        name = person.find('.//contributorName')
+        name = _first(q.contributor_name, person)
+    if name is None:
+        return {}
     family_name = name.get('familyName')
     given_name = name.get('givenName')
-    if name is not None and name.text:
+    if name.text:
         person_dict['name'] = name.text
     elif family_name:
         person_dict['name'] = family_name
@@ -269,19 +354,18 @@ def _get_person(person):
         person_dict['name'] = given_name
     else:
         return {}
-    if person.find('.//nameIdentifier') is not None:
-        identifier = person.find('.//nameIdentifier')
+    identifier = _first(q.name_identifier, person)
+    if identifier is not None:
         identifier_scheme = identifier.get('nameIdentifierScheme')
         # TODO: There are some more schemes we want to map. Waiting for the
         # list.
-        if identifier is not None and identifier_scheme == "URL":
+        if identifier_scheme == "URL":
             person_dict['identifier'] = identifier.text
 
-    if person.find('.//affiliation') is not None:
-        affiliation = person.find('.//affiliation').text
-        if affiliation is not None:
-            person_dict['member_of'] = {
-                "@type": 'Organization',
-                "name": {"und": affiliation}
-            }
+    affiliation = _first_text(q.affiliation, person)
+    if affiliation is not None:
+        person_dict['member_of'] = {
+            "@type": 'Organization',
+            "name": {"und": affiliation}
+        }
     return person_dict
@@ -9,6 +9,7 @@
 
 from functionally import first
 
+from ..ddi_record import get_ddi_record, NAMESPACES as namespaces
 from ..metax_api import get_ref_data
 from ..utils import get_tag_lang, get_string_as_valid_datetime_string
 
@@ -23,22 +24,21 @@ def ddi25_mapper(xml):
     :return: dictionary
     """
 
-    namespaces = {'oai': "http://www.openarchives.org/OAI/2.0/",
-                  'ddi': "ddi:codebook:2_5"}
-
-    cb = first(xml.xpath('//oai:record/oai:metadata/ddi:codeBook', namespaces=namespaces))
-    stdy = cb.find('ddi:stdyDscr', namespaces)
+    ddi = get_ddi_record(xml)
+    citations = ddi.citations()
+    stdy_infos = ddi.stdy_infos()
+    sum_dscrs = ddi.sum_dscrs()
 
     # Preferred identifier
     pref_id = None
-    id_nos = stdy.findall('ddi:citation/ddi:titlStmt/ddi:IDNo', namespaces)
+    id_nos = ddi.findall(citations, 'ddi:titlStmt/ddi:IDNo')
     id_no = first(filter(lambda x: x.get('agency') == 'URN', id_nos))
     if id_no is not None:
         pref_id = id_no.text
 
     # Title
     title = {}
-    titl = stdy.findall('ddi:citation/ddi:titlStmt/ddi:titl', namespaces)
+    titl = ddi.findall(citations, 'ddi:titlStmt/ddi:titl')
     if len(titl):
         for t in titl:
             title[get_tag_lang(t)] = t.text
@@ -47,7 +47,7 @@ def ddi25_mapper(xml):
     # Assume that 'AuthEnty' tags for different language 'citations' are in same order
     creators = []
     try:
-        for i, citation in enumerate(stdy.findall('ddi:citation', namespaces)):
+        for i, citation in enumerate(citations):
             for j, author in enumerate(citation.xpath(
                     'ddi:rspStmt/ddi:AuthEnty|ddi:rspStmt/ddi:othId',
                     namespaces=namespaces)):
@@ -82,14 +82,14 @@ def ddi25_mapper(xml):
 
     # Modified
     modified = None
-    ver_stmt = stdy.find('ddi:citation/ddi:verStmt/ddi:version', namespaces)
+    ver_stmt = ddi.find(citations, 'ddi:verStmt/ddi:version')
     if ver_stmt is not None and ver_stmt.get('date'):
         modified = get_string_as_valid_datetime_string(ver_stmt.get('date'), '01-01')
 
     # Description
     description = {}
     try:
-        for abstract in stdy.findall('ddi:stdyInfo/ddi:abstract', namespaces):
+        for abstract in ddi.findall(stdy_infos, 'ddi:abstract'):
             description[get_tag_lang(abstract)] = unicode(abstract.text).strip()
     except Exception as e:
         log.error('Error parsing "description": {0}: {1}'.format(e.__class__.__name__, e))
@@ -97,15 +97,15 @@ def ddi25_mapper(xml):
 
     # Keywords
     keywords = []
-    for kw in stdy.findall('ddi:stdyInfo/ddi:subject/ddi:keyword', namespaces):
+    for kw in ddi.findall(stdy_infos, 'ddi:subject/ddi:keyword'):
         keywords.append(kw.text.strip())
     vocab = 'CESSDA Topic Classification'
-    for cterm in stdy.findall("ddi:stdyInfo/ddi:subject/ddi:topcClas[@vocab='{0}']".format(vocab), namespaces):
+    for cterm in ddi.findall(stdy_infos, "ddi:subject/ddi:topcClas[@vocab='{0}']".format(vocab)):
         keywords.append(cterm.text.strip())
 
     # Field of science
     codes = set()
-    for fos in stdy.findall("ddi:stdyInfo/ddi:subject/ddi:topcClas[@vocab='OKM']", namespaces):
+    for fos in ddi.findall(stdy_infos, "ddi:subject/ddi:topcClas[@vocab='OKM']"):
         field = 'label.' + get_tag_lang(fos)
         codes.add(get_ref_data('field_of_science', field, fos.text.strip(), 'code'))
     field_of_science = [{'identifier': c} for c in codes ]
@@ -123,20 +123,20 @@ def ddi25_mapper(xml):
                             "fi": "Julkaisijan kotisivu"},
                         "identifier": ""}
     }
-    for dist in stdy.findall('ddi:citation/ddi:distStmt', namespaces):
+    for dist in ddi.findall(citations, 'ddi:distStmt'):
         distr = dist.find('ddi:distrbtr', namespaces)
         publisher['name'][get_tag_lang(distr)] = distr.text.strip()
         publisher['homepage']['identifier'] = distr.get('URI')
 
     # Temporal coverage
-    tpath = "ddi:stdyInfo/ddi:sumDscr/ddi:{tag}[@event='{ev}']"
-    tstart = stdy.find(tpath.format(tag='timePrd', ev='start'), namespaces) or\
-        stdy.find(tpath.format(tag='collDate', ev='start'), namespaces)
-    tend = stdy.find(tpath.format(tag='timePrd', ev='end'), namespaces) or\
-        stdy.find(tpath.format(tag='collDate', ev='end'), namespaces)
+    tpath = "ddi:{tag}[@event='{ev}']"
+    tstart = ddi.find(sum_dscrs, tpath.format(tag='timePrd', ev='start')) or\
+        ddi.find(sum_dscrs, tpath.format(tag='collDate', ev='start'))
+    tend = ddi.find(sum_dscrs, tpath.format(tag='timePrd', ev='end')) or\
+        ddi.find(sum_dscrs, tpath.format(tag='collDate', ev='end'))
     if tstart is None and tend is None:
-        tstart = stdy.find(tpath.format(tag='timePrd', ev='single'), namespaces) or\
-                 stdy.find(tpath.format(tag='collDate', ev='single'), namespaces)
+        tstart = ddi.find(sum_dscrs, tpath.format(tag='timePrd', ev='single')) or\
+                 ddi.find(sum_dscrs, tpath.format(tag='collDate', ev='single'))
         tend = tstart
     elif tstart is None or tend is None:
         log.error('No temporal coverage or only start or end date in dataset!')
@@ -158,7 +158,7 @@ def ddi25_mapper(xml):
 
     # Provenance
     universe = {}
-    univ = stdy.findall("ddi:stdyInfo/ddi:sumDscr/ddi:universe", namespaces)
+    univ = ddi.findall(sum_dscrs, "ddi:universe")
     for u in univ:
         if u.text:
             universe[get_tag_lang(u)] = u.text.strip()
@@ -171,7 +171,7 @@ def ddi25_mapper(xml):
         provenance[0]['temporal'] = temporal_coverage_obj_1
 
     # Production
-    prod = stdy.find('ddi:citation/ddi:prodStmt/ddi:prodDate', namespaces)
+    prod = ddi.find(citations, 'ddi:prodStmt/ddi:prodDate')
     if prod is not None:
         temporal_coverage_obj_2 = {}
 
@@ -193,9 +193,9 @@ def ddi25_mapper(xml):
     # Geographical coverage
     spatial = [{}]
     lang_attr = '{http://www.w3.org/XML/1998/namespace}lang'
-    lang_path = "ddi:stdyInfo/ddi:sumDscr/ddi:nation[@{la}='{lt}']"
-    nat_fi = stdy.find(lang_path.format(la=lang_attr, lt='fi'), namespaces)
-    nat_en = stdy.find(lang_path.format(la=lang_attr, lt='en'), namespaces)
+    lang_path = "ddi:nation[@{la}='{lt}']"
+    nat_fi = ddi.find(sum_dscrs, lang_path.format(la=lang_attr, lt='fi'))
+    nat_en = ddi.find(sum_dscrs, lang_path.format(la=lang_attr, lt='en'))
     if nat_en is not None:
         spatial = [{'geographic_name': nat_en.text.strip()}]
     if nat_fi is not None:
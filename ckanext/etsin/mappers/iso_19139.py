@@ -9,7 +9,6 @@
 Map ISO 19139 dicts to Metax values
 """
 
-from iso639 import languages
 from ..utils import get_language_identifier,\
                     convert_language_to_6391,\
                     convert_bbox_to_polygon, \
@@ -20,6 +19,34 @@ import logging
 
 log = logging.getLogger(__name__)
 
+# Fields of science of the first topic category of a dataset
+TOPIC_CATEGORY_FIELDS_OF_SCIENCE = {
+    'environment': ('ta1172',),
+    'planningCadastre': ('ta212',),
+    'transportation': ('ta212',),
+    'economy': ('ta5',),
+    'biota': ('ta1181', 'ta1183'),
+    'utilitiesCommunication': ('ta218', 'ta213'),
+    'geoscientificInformation': ('ta1171',),
+    'climatologyMeteorologyAtmosphere': ('ta1171',),
+    'farming': ('ta412', 'ta4111'),
+    'inlandWaters': ('ta1171',),
+    'health': ('ta316', 'ta3142'),
+    'society': ('ta5',),
+}
+
+# Responsible organisation roles mapped to agent list fields, in the order the agents are added.
+# Processors and users are mapped together as contributors, in document order.
+CONTRIBUTOR_ROLES = ('processor', 'user')
+AGENT_ROLES = (
+    ('author', 'creator'),
+    ('originator', 'creator'),
+    ('pointOfContact', 'curator'),
+    ('custodian', 'curator'),
+    ('owner', 'rights_holder'),
+    ('contributor', 'contributor'),
+)
+
 
 def iso_19139_mapper(context, data_dict):
     # Start with an empty slate
@@ -30,20 +57,13 @@ def iso_19139_mapper(context, data_dict):
 
     iso_values = data_dict['iso_values']
 
-    # Set guid to context for refiner use
+    # Set guid to context for refiner use, and the harvest object for resolving its harvest source
     context['guid'] = data_dict['harvest_object'].guid
+    context['harvest_object'] = data_dict['harvest_object']
 
     # Find out metadata language
-    # Use und, if language code not given or isn't valid ISO 639-3
-    try:
-        lang = languages.get(part3=iso_values['metadata-language']).part3
-        meta_lang = convert_language_to_6391(lang)
-    except Exception:
-        meta_lang = 'und'
-
-    # Ensure meta_lang exists
-    if not meta_lang:
-        meta_lang = 'und'
+    # Use und, if language code not given, isn't valid ISO 639-3 or has no ISO 639-1 code
+    meta_lang = convert_language_to_6391(iso_values.get('metadata-language')) or 'und'
 
     # Find title
     try:
@@ -70,97 +90,23 @@ def iso_19139_mapper(context, data_dict):
     try:
         if len(iso_values['topic-category']):
             topic_cat = iso_values['topic-category'][0]
-            if topic_cat == 'environment':
-                package_dict['field_of_science'] = [{'identifier': 'ta1172'}]
-            elif topic_cat == 'planningCadastre':
-                package_dict['field_of_science'] = [{'identifier': 'ta212'}]
-            elif topic_cat == 'transportation':
-                package_dict['field_of_science'] = [{'identifier': 'ta212'}]
-            elif topic_cat == 'economy':
-                package_dict['field_of_science'] = [{'identifier': 'ta5'}]
-            elif topic_cat == 'biota':
-                package_dict['field_of_science'] = [{'identifier': 'ta1181'}, {'identifier': 'ta1183'}]
-            elif topic_cat == 'utilitiesCommunication':
-                package_dict['field_of_science'] = [{'identifier': 'ta218'}, {'identifier': 'ta213'}]
-            elif topic_cat == 'geoscientificInformation':
-                package_dict['field_of_science'] = [{'identifier': 'ta1171'}]
-            elif topic_cat == 'climatologyMeteorologyAtmosphere':
-                package_dict['field_of_science'] = [{'identifier': 'ta1171'}]
-            elif topic_cat == 'farming':
-                package_dict['field_of_science'] = [{'identifier': 'ta412'}, {'identifier': 'ta4111'}]
-            elif topic_cat == 'inlandWaters':
-                package_dict['field_of_science'] = [{'identifier': 'ta1171'}]
-            elif topic_cat == 'health':
-                package_dict['field_of_science'] = [{'identifier': 'ta316'}, {'identifier': 'ta3142'}]
-            elif topic_cat == 'society':
-                package_dict['field_of_science'] = [{'identifier': 'ta5'}]
-            else:
-                package_dict['field_of_science'] = []
+            package_dict['field_of_science'] = [{'identifier': identifier} for identifier in
+                                                TOPIC_CATEGORY_FIELDS_OF_SCIENCE.get(topic_cat, ())]
     except KeyError:
         package_dict['field_of_science'] = []
 
-    # Dataset creators
-    try:
-        authors = (org for org in iso_values['responsible-organisation'] if 'author' in org['role'])
-        for author in authors:
-            _set_agent_details_to_package_dict_field(package_dict, 'creator', author, True, meta_lang)
-
-        originators = (org for org in iso_values['responsible-organisation'] if 'originator' in org['role'])
-        for originator in originators:
-            _set_agent_details_to_package_dict_field(package_dict, 'creator', originator, True, meta_lang)
-    except KeyError:
-        pass
-
-    # Dataset curator
-    try:
-        pocs = (org for org in iso_values['responsible-organisation'] if 'pointOfContact' in org['role'])
-        for poc in pocs:
-            _set_agent_details_to_package_dict_field(package_dict, 'curator', poc, True, meta_lang)
-
-        custodians = (org for org in iso_values['responsible-organisation'] if 'custodian' in org['role'])
-        for custodian in custodians:
-            _set_agent_details_to_package_dict_field(package_dict, 'curator', custodian, True, meta_lang)
-    except KeyError:
-        pass
-
-    # Dataset publisher / distributor
-    try:
-        distributors = (org for org in iso_values['responsible-organisation'] if 'distributor' in org['role'])
-        for distributor in distributors:
-            _set_agent_details_to_package_dict_field(package_dict, 'publisher', distributor, False, meta_lang)
-            # Only one publisher can be set in target data model
-            break
-    except KeyError:
-        pass
-
-    # If publisher has not been set, try another role for dataset publisher
-    if 'publisher' not in package_dict:
-        try:
-            publishers = (org for org in iso_values['responsible-organisation'] if 'publisher' in org['role'])
-            for publisher in publishers:
-                _set_agent_details_to_package_dict_field(package_dict, 'publisher', publisher, False, meta_lang)
-                # Only one publisher can be set in target data model
-                break
-        except KeyError:
-            pass
-
-    # Dataset rights holder
-    try:
-        owners = (org for org in iso_values['responsible-organisation'] if 'owner' in org['role'])
-        for owner in owners:
-            _set_agent_details_to_package_dict_field(package_dict, 'rights_holder', owner, True, meta_lang)
-    except KeyError:
-        pass
+    orgs_by_role = _index_organisations_by_role(iso_values.get('responsible-organisation', []))
 
-    # Dataset contributor
-    try:
-        contributors = (org for org in iso_values['responsible-organisation'] if 'processor' in org['role'] or
-                        'user' in org['role'])
-        for contributor in contributors:
-            _set_agent_details_to_package_dict_field(package_dict, 'contributor', contributor, True, meta_lang)
-    except KeyError:
-        pass
+    # Dataset creators, curator, rights holder and contributor
+    for role, field in AGENT_ROLES:
+        for org in orgs_by_role.get(role, []):
+            _set_agent_details_to_package_dict_field(package_dict, field, org, True, meta_lang)
 
+    # Dataset publisher / distributor. If there is no distributor, try another role for dataset publisher.
+    # Only one publisher can be set in target data model
+    publishers = orgs_by_role.get('distributor') or orgs_by_role.get('publisher')
+    if publishers:
+        _set_agent_details_to_package_dict_field(package_dict, 'publisher', publishers[0], False, meta_lang)
 
     # modified: Last known time when a research dataset or metadata about the research dataset
     # has been significantly modified.
@@ -260,6 +206,25 @@ def iso_19139_mapper(context, data_dict):
     return package_dict
 
 
+def _index_organisations_by_role(organisations):
+    """
+    Group responsible organisations by role in a single pass, keeping document order within each role.
+    An organisation with several roles is listed under each of them, but only once as a contributor.
+
+    :param organisations: list of responsible organisation dicts from iso_values
+    :return: dict of role -> list of organisation dicts
+    """
+    index = {}
+    for org in organisations:
+        roles = org.get('role') or []
+        if isinstance(roles, basestring):
+            roles = [roles]
+        keys = set('contributor' if role in CONTRIBUTOR_ROLES else role for role in roles)
+        for key in keys:
+            index.setdefault(key, []).append(org)
+    return index
+
+
 def _set_agent_details_to_package_dict_field(package_dict, field, agent, is_array, meta_lang):
     try:
         # Assuming that if individual-name exists in source data, the type is Person. Otherwise type is Organization.
@@ -0,0 +1,94 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+In-memory indexes of the identifier mapping CSV files used by refiners
+"""
+
+import csv
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class MappingTable(object):
+    """
+    Mapping file with two or more columns, indexed by the value of the first column.
+    The file is read once and read again only when its modification time changes.
+    If the first column has duplicate values, the first row wins.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._rows = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _reload_if_changed(self):
+        mtime = os.path.getmtime(self.file_path)
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            rows = {}
+            with open(self.file_path, 'rb') as f:
+                for row in csv.reader(f, delimiter=','):
+                    if row:
+                        rows.setdefault(row[0], row)
+            self._rows = rows
+            self._mtime = mtime
+            log.debug("Loaded {0} rows from mapping file {1}".format(len(rows), self.file_path))
+
+    def lookup(self, key):
+        """
+        :param key: value of the first column
+        :return: the whole row as a list, or None if key is not found
+        """
+        self._reload_if_changed()
+        return self._rows.get(key)
+
+    def exists(self, key):
+        self._reload_if_changed()
+        return key in self._rows
+
+    def __len__(self):
+        self._reload_if_changed()
+        return len(self._rows)
+
+
+class MappingTableRegistry(object):
+    """
+    Process-wide collection of MappingTables, one per mapping file path.
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def get(self, file_path):
+        file_path = os.path.abspath(file_path)
+        table = self._tables.get(file_path)
+        if table is None:
+            with self._lock:
+                table = self._tables.setdefault(file_path, MappingTable(file_path))
+        return table
+
+    def lookup(self, file_path, key):
+        return self.get(file_path).lookup(key)
+
+    def exists(self, file_path, key):
+        return self.get(file_path).exists(key)
+
+    def clear(self):
+        with self._lock:
+            self._tables = {}
+
+
+mapping_tables = MappingTableRegistry()
@@ -8,20 +8,38 @@
 import requests
 from requests import HTTPError, exceptions
 import json
+import threading
 from pylons import config
 import logging
 
+from ckanext.etsin.catalog_snapshot import CatalogRecordSnapshot, DEFAULT_SNAPSHOT_MAX_AGE, \
+                                           DEFAULT_SNAPSHOT_PAGE_SIZE
+from ckanext.etsin.metax_client import get_metax_client
+from ckanext.etsin.reference_data import ReferenceDataCache, ReferenceDataSnapshot, \
+                                         DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL
 from ckanext.etsin.utils import str_to_bool
 
 log = logging.getLogger(__name__)
 
-TIMEOUT = 30
 METAX_BASE_URL = 'https://{0}'.format(config.get('metax.host'))
 METAX_DATASETS_BASE_URL = METAX_BASE_URL + '/rest/datasets'
 METAX_REFERENCE_DATA_URL = METAX_BASE_URL + '/es/reference_data/_search?size=1'
-VERIFY_SSL = str_to_bool(config.get('metax.verify_ssl'))
+METAX_REFERENCE_DATA_SEARCH_URL = METAX_BASE_URL + '/es/reference_data/_search'
 HEADERS = {'Content-Type': 'application/json'}
 
+# Reasons for MetaX refusing to write a catalog record, see get_write_error_reason
+CONFLICT = 'conflict'
+REJECTED = 'rejected'
+
+REF_DATA_SNAPSHOT_TOPICS = ['access_type', 'field_of_science', 'license', 'location']
+REF_DATA_SNAPSHOT_PAGE_SIZE = 1000
+
+_ref_data_cache = None
+_ref_data_snapshot = None
+
+_catalog_record_snapshots = {}
+_catalog_record_snapshots_lock = threading.Lock()
+
 def json_or_empty(response):
     response_json = ""
     try:
@@ -37,11 +55,8 @@ def get_catalog_record_identifier_using_preferred_identifier(metax_pref_id):
     :param metax_pref_id: MetaX catalog record preferred identifier
     :return: catalog record identifier
     """
-    r = requests.get(METAX_DATASETS_BASE_URL + '?preferred_identifier={0}'.format(metax_pref_id),
-                     headers={'Accept': 'application/json'},
-                     auth=(config.get('metax.api_user'), config.get('metax.api_password')),
-                     verify=VERIFY_SSL,
-                     timeout=TIMEOUT)
+    r = get_metax_client().get(METAX_DATASETS_BASE_URL + '?preferred_identifier={0}'.format(metax_pref_id),
+                               headers={'Accept': 'application/json'})
     try:
         r.raise_for_status()
     except HTTPError as e:
@@ -58,11 +73,8 @@ def get_catalog_record_research_dataset_modified_using_preferred_identifier(meta
     :param metax_pref_id: MetaX catalog record preferred identifier
     :return: catalog record research_dataset.modified
     """
-    r = requests.get(METAX_DATASETS_BASE_URL + '?preferred_identifier={0}'.format(metax_pref_id),
-                     headers={'Accept': 'application/json'},
-                     auth=(config.get('metax.api_user'), config.get('metax.api_password')),
-                     verify=VERIFY_SSL,
-                     timeout=TIMEOUT)
+    r = get_metax_client().get(METAX_DATASETS_BASE_URL + '?preferred_identifier={0}'.format(metax_pref_id),
+                               headers={'Accept': 'application/json'})
     try:
         r.raise_for_status()
     except HTTPError as e:
@@ -73,19 +85,26 @@ def get_catalog_record_research_dataset_modified_using_preferred_identifier(meta
     return json.loads(r.text)['research_dataset']['modified']
 
 
+def _payload(cr_json):
+    """
+    Catalog records may be given either as dictionaries or as already encoded json, see
+    utils.encode_metax_payload. Encoded json is sent as is without serializing it again.
+    """
+    if isinstance(cr_json, basestring):
+        return {'data': cr_json}
+    return {'json': cr_json}
+
+
 def create_catalog_record(cr_json):
     """
     Create a catalog record in MetaX.
 
-    :param cr_json: MetaX catalog record json
+    :param cr_json: MetaX catalog record json, as a dictionary or encoded json
     :return: catalog record identifier of the created catalog record.
     """
-    r = requests.post(METAX_DATASETS_BASE_URL,
-                      headers={'Content-Type': 'application/json'},
-                      json=cr_json,
-                      auth=(config.get('metax.api_user'), config.get('metax.api_password')),
-                      verify=VERIFY_SSL,
-                      timeout=TIMEOUT)
+    r = get_metax_client().post(METAX_DATASETS_BASE_URL,
+                                headers={'Content-Type': 'application/json'},
+                                **_payload(cr_json))
     try:
         r.raise_for_status()
     except HTTPError as e:
@@ -100,14 +119,11 @@ def update_catalog_record(metax_cr_id, cr_json):
     Update existing catalog record in MetaX
 
     :param metax_cr_id: MetaX catalog record identifier
-    :param cr_json: MetaX catalog record json
-    """
-    r = requests.put(METAX_DATASETS_BASE_URL + '/{id}'.format(id=metax_cr_id),
-                     headers={'Content-Type': 'application/json'},
-                     json=cr_json,
-                     auth=(config.get('metax.api_user'), config.get('metax.api_password')),
-                     verify=VERIFY_SSL,
-                     timeout=TIMEOUT)
+    :param cr_json: MetaX catalog record json, as a dictionary or encoded json
+    """
+    r = get_metax_client().put(METAX_DATASETS_BASE_URL + '/{id}'.format(id=metax_cr_id),
+                               headers={'Content-Type': 'application/json'},
+                               **_payload(cr_json))
     try:
         r.raise_for_status()
     except HTTPError as e:
@@ -117,16 +133,95 @@ def update_catalog_record(metax_cr_id, cr_json):
         raise
 
 
+def get_write_error_reason(error):
+    """
+    Tell why MetaX refused to create or update a catalog record.
+
+    :param error: HTTPError raised by create_catalog_record or update_catalog_record
+    :return: CONFLICT if a catalog record having the same preferred identifier already exists, REJECTED if MetaX
+             refused the content of the catalog record, so that sending it again would fail the same way, or None
+             for other errors, such as server errors, after which the catalog record may or may not exist
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    if response.status_code == requests.codes.conflict:
+        return CONFLICT
+    if response.status_code != requests.codes.bad_request:
+        return None
+    return get_errors_reason(json_or_empty(response))
+
+
+def get_errors_reason(errors):
+    """
+    :param errors: errors of a catalog record MetaX refused to write, from a response body or a failed bulk item
+    :return: CONFLICT if the errors say that a catalog record having the same preferred identifier already exists,
+             otherwise REJECTED
+    """
+    for message in _error_messages(errors):
+        if 'preferred_identifier' in message and 'already exists' in message:
+            return CONFLICT
+    return REJECTED
+
+
+def _error_messages(errors):
+    if isinstance(errors, basestring):
+        yield errors
+    elif isinstance(errors, dict):
+        for value in errors.values():
+            for message in _error_messages(value):
+                yield message
+    elif isinstance(errors, list):
+        for value in errors:
+            for message in _error_messages(value):
+                yield message
+
+
+def create_catalog_records(cr_list):
+    """
+    Create several catalog records in MetaX with one request.
+
+    :param cr_list: list of MetaX catalog record dictionaries
+    :return: (success, failed) tuple of lists as returned by MetaX: success items contain the created record
+             in 'object', failed items contain the sent record in 'object' and the reasons in 'errors'
+    """
+    return _bulk_write(get_metax_client().post, cr_list)
+
+
+def update_catalog_records(cr_list):
+    """
+    Update several existing catalog records in MetaX with one request. Each record must contain its identifier.
+
+    :param cr_list: list of MetaX catalog record dictionaries
+    :return: (success, failed) tuple of lists, see create_catalog_records
+    """
+    return _bulk_write(get_metax_client().put, cr_list)
+
+
+def _bulk_write(method, cr_list):
+    r = method(METAX_DATASETS_BASE_URL, headers={'Content-Type': 'application/json'}, **_payload(cr_list))
+    # MetaX responds with 400 when every record of the list failed, the reasons are still in the response body
+    if r.status_code != requests.codes.bad_request:
+        try:
+            r.raise_for_status()
+        except HTTPError:
+            log.error('Response text: %s', r.text)
+            raise
+    body = json_or_empty(r)
+    if not isinstance(body, dict) or ('success' not in body and 'failed' not in body):
+        log.error('Unexpected bulk response from MetaX: %s', r.text)
+        r.raise_for_status()
+        raise HTTPError('Unexpected bulk response from MetaX', response=r)
+    return body.get('success', []), body.get('failed', [])
+
+
 def delete_catalog_record(metax_cr_id):
     """
     Delete a catalog record from MetaX.
 
     :param metax_cr_id: MetaX catalog record identifier
     """
-    r = requests.delete(METAX_DATASETS_BASE_URL + '/{id}'.format(id=metax_cr_id),
-                        auth=(config.get('metax.api_user'), config.get('metax.api_password')),
-                        verify=VERIFY_SSL,
-                        timeout=TIMEOUT)
+    r = get_metax_client().delete(METAX_DATASETS_BASE_URL + '/{id}'.format(id=metax_cr_id))
     try:
         r.raise_for_status()
     except HTTPError as e:
@@ -142,13 +237,122 @@ def check_catalog_record_exists(metax_cr_id):
     :param metax_cr_id: MetaX catalog record identifier
     :return: True/False
     """
-    r = requests.head(METAX_DATASETS_BASE_URL + '/{id}'.format(id=metax_cr_id),
-                      verify=VERIFY_SSL)
+    r = get_metax_client().head(METAX_DATASETS_BASE_URL + '/{id}'.format(id=metax_cr_id))
     return r.status_code == requests.codes.ok
 
 
+def get_catalog_record_modified(metax_cr_id):
+    """
+    Find out with a single request whether a catalog record exists in MetaX and what its
+    research_dataset.modified value is. Only research_dataset.modified is requested, see
+    load_catalog_record_snapshot_from_metax.
+
+    :param metax_cr_id: MetaX catalog record identifier
+    :return: (exists, modified) tuple, where modified is None if the record does not exist or has no modified value
+    """
+    r = get_metax_client().get(METAX_DATASETS_BASE_URL + '/{id}'.format(id=metax_cr_id),
+                               params={'fields': 'research_dataset', 'research_dataset_fields': 'modified'},
+                               headers={'Accept': 'application/json'})
+    if r.status_code != requests.codes.ok:
+        return False, None
+    try:
+        return True, json.loads(r.text).get('research_dataset', {}).get('modified', None)
+    except ValueError:
+        log.error('Unable to parse catalog record {id}: \nresponse={text}'.format(id=metax_cr_id, text=r.text))
+        return True, None
+
+
+def get_catalog_record_snapshot(data_catalog_id):
+    """
+    Get the snapshot of the catalog records of a data catalog, if catalog record snapshots are enabled
+    with metax.catalog_snapshot. The snapshot is loaded from MetaX on first use and reloaded after
+    metax.catalog_snapshot_max_age seconds, so in practice once per harvest job.
+
+    If loading fails, an empty snapshot is used until it expires, so that lookups go to MetaX one
+    record at a time as without a snapshot.
+
+    :param data_catalog_id: MetaX data catalog identifier
+    :return: CatalogRecordSnapshot or None
+    """
+    if not data_catalog_id or not str_to_bool(config.get('metax.catalog_snapshot', 'false')):
+        return None
+    with _catalog_record_snapshots_lock:
+        snapshot = _catalog_record_snapshots.get(data_catalog_id)
+        if snapshot is None or snapshot.expired():
+            max_age = int(config.get('metax.catalog_snapshot_max_age', DEFAULT_SNAPSHOT_MAX_AGE))
+            try:
+                snapshot = load_catalog_record_snapshot_from_metax(
+                    data_catalog_id,
+                    page_size=int(config.get('metax.catalog_snapshot_page_size', DEFAULT_SNAPSHOT_PAGE_SIZE)),
+                    max_age=max_age)
+            except (exceptions.RequestException, ValueError, KeyError) as e:
+                log.error("Unable to load catalog records of data catalog {0} from MetaX: {1}".format(
+                    data_catalog_id, repr(e)))
+                snapshot = CatalogRecordSnapshot(data_catalog_id, max_age=max_age)
+            _catalog_record_snapshots[data_catalog_id] = snapshot
+        return snapshot
+
+
+def set_catalog_record_snapshot(snapshot):
+    """
+    Use given snapshot for the catalog records of its data catalog, e.g. one loaded at the start of a harvest job.
+
+    :param snapshot: CatalogRecordSnapshot
+    """
+    with _catalog_record_snapshots_lock:
+        _catalog_record_snapshots[snapshot.data_catalog_id] = snapshot
+
+
+def clear_catalog_record_snapshots():
+    """
+    Forget all catalog record snapshots, e.g. at the end of a harvest job.
+    """
+    with _catalog_record_snapshots_lock:
+        _catalog_record_snapshots.clear()
+
+
+def load_catalog_record_snapshot_from_metax(data_catalog_id, page_size=DEFAULT_SNAPSHOT_PAGE_SIZE, max_age=None):
+    """
+    Page through the catalog records of a data catalog and build a snapshot of their preferred identifiers,
+    catalog record identifiers and modified values.
+
+    :param data_catalog_id: MetaX data catalog identifier
+    :param page_size: number of catalog records to fetch per request
+    :param max_age: seconds after which get_catalog_record_snapshot reloads the snapshot
+    :return: CatalogRecordSnapshot
+    """
+    snapshot = CatalogRecordSnapshot(data_catalog_id, max_age=max_age)
+    offset = 0
+    while True:
+        # fields only selects top-level fields, research_dataset.preferred_identifier is not supported there.
+        # research_dataset_fields limits research_dataset to the two keys needed; MetaX versions without it
+        # ignore it and return the whole research_dataset.
+        r = get_metax_client().get(METAX_DATASETS_BASE_URL,
+                                   params={'data_catalog': data_catalog_id,
+                                           'fields': 'identifier,research_dataset',
+                                           'research_dataset_fields': 'preferred_identifier,modified',
+                                           'limit': page_size,
+                                           'offset': offset},
+                                   headers={'Accept': 'application/json'})
+        r.raise_for_status()
+        page = json.loads(r.text)
+        records = page['results'] if isinstance(page, dict) else page
+        for record in records:
+            snapshot.add(record)
+        offset += len(records)
+        if len(records) < page_size or (isinstance(page, dict) and not page.get('next')):
+            break
+
+    log.info("Loaded {0} catalog records of data catalog {1} from MetaX".format(len(snapshot), data_catalog_id))
+    return snapshot
+
+
 def get_ref_data(topic, field, term, result_field):
-    """ Query MetaX Elastic search API for all kinds of reference data
+    """ Query MetaX Elastic search API for all kinds of reference data.
+    If a reference data snapshot covering the topic is in use, values equal to the term are found
+    from it without querying MetaX, see get_ref_data_snapshot. Other lookups are queried from MetaX,
+    unless the snapshot is offline, and their results, including lookups without a match, are cached
+    in process, see get_ref_data_cache.
 
     :param topic: as one of listed <host>/es/reference_data?pretty eg. 'licese'
     :type topic: string
@@ -158,6 +362,139 @@ def get_ref_data(topic, field, term, result_field):
     :type term: string
     :return:
     """
+    snapshot = get_ref_data_snapshot()
+    if snapshot.covers(topic):
+        value = snapshot.lookup(topic, field, term, result_field)
+        if value is not None or snapshot.offline:
+            return value
+    try:
+        return get_ref_data_cache().get((topic, field, term, result_field),
+                                        lambda: _query_ref_data(topic, field, term, result_field))
+    except (exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+        # Failed queries are not cached, so the term is queried again on the next lookup
+        log.error("Reference data query of {0} {1}={2} failed: {3}".format(topic, field, term, repr(e)))
+        return None
+
+
+def get_ref_data_cache():
+    """
+    Get the process-wide reference data cache. Size and time to live (in seconds) of the cache
+    can be configured with metax.ref_data_cache_size and metax.ref_data_cache_ttl.
+
+    :return: ReferenceDataCache
+    """
+    global _ref_data_cache
+    if _ref_data_cache is None:
+        _ref_data_cache = ReferenceDataCache(
+            max_size=int(config.get('metax.ref_data_cache_size', DEFAULT_CACHE_SIZE)),
+            ttl=int(config.get('metax.ref_data_cache_ttl', DEFAULT_CACHE_TTL)))
+    return _ref_data_cache
+
+
+def invalidate_ref_data_cache(topic=None, field=None, term=None, result_field=None):
+    """
+    Drop a single cached reference data lookup, or the whole cache if no arguments are given.
+    """
+    if topic is None:
+        get_ref_data_cache().invalidate()
+    else:
+        get_ref_data_cache().invalidate((topic, field, term, result_field))
+
+
+def get_ref_data_snapshot():
+    """
+    Get the reference data snapshot used by get_ref_data. The snapshot is loaded on first use:
+
+    metax.ref_data_snapshot_file: load the snapshot from a JSON dump file
+    metax.ref_data_snapshot_preload: if true, load the snapshot from MetaX. The snapshot is reloaded
+        after metax.ref_data_snapshot_max_age seconds (defaults to metax.ref_data_cache_ttl).
+
+    If neither is configured, an empty snapshot covering no topics is used.
+
+    :return: ReferenceDataSnapshot
+    """
+    global _ref_data_snapshot
+    if _ref_data_snapshot is None or _ref_data_snapshot.expired():
+        _ref_data_snapshot = _load_configured_ref_data_snapshot()
+    return _ref_data_snapshot
+
+
+def set_ref_data_snapshot(snapshot):
+    """
+    Use given snapshot for reference data lookups, e.g. one loaded at the start of a harvest job.
+    Giving None makes get_ref_data_snapshot load the configured snapshot again.
+
+    :param snapshot: ReferenceDataSnapshot or None
+    """
+    global _ref_data_snapshot
+    _ref_data_snapshot = snapshot
+
+
+def load_ref_data_snapshot_from_metax(topics=None, page_size=REF_DATA_SNAPSHOT_PAGE_SIZE, max_age=None):
+    """
+    Page through MetaX reference data index and build a snapshot of the given topics.
+    Topics that could not be loaded completely are left out of the snapshot, so that
+    their lookups keep going to MetaX.
+
+    :param topics: list of reference data topics, defaults to metax.ref_data_snapshot_topics
+    :param page_size: number of documents to fetch per request
+    :param max_age: seconds after which get_ref_data_snapshot reloads the snapshot
+    :return: ReferenceDataSnapshot
+    """
+    if topics is None:
+        topics = config.get('metax.ref_data_snapshot_topics', '').split() or REF_DATA_SNAPSHOT_TOPICS
+
+    documents = []
+    loaded_topics = []
+    for topic in topics:
+        try:
+            documents.extend(_fetch_ref_data_topic(topic, page_size))
+            loaded_topics.append(topic)
+        except (exceptions.RequestException, ValueError, KeyError) as e:
+            log.error("Unable to load reference data topic {0} from MetaX: {1}".format(topic, repr(e)))
+
+    log.info("Loaded {0} reference data documents of topics {1} from MetaX".format(len(documents), loaded_topics))
+    return ReferenceDataSnapshot(documents, topics=loaded_topics, max_age=max_age)
+
+
+def _fetch_ref_data_topic(topic, page_size):
+    documents = []
+    while True:
+        query = json.dumps({
+            "query": {
+                "match": {
+                    "type": topic
+                }
+            },
+            "from": len(documents),
+            "size": page_size
+        })
+        r = get_metax_client().get(METAX_REFERENCE_DATA_SEARCH_URL, data=query, headers=HEADERS)
+        r.raise_for_status()
+        hits = json.loads(r.text)['hits']['hits']
+        documents.extend(hit['_source'] for hit in hits)
+        if len(hits) < page_size:
+            return [document for document in documents if document.get('type') == topic]
+
+
+def _load_configured_ref_data_snapshot():
+    snapshot_file = config.get('metax.ref_data_snapshot_file')
+    if snapshot_file:
+        try:
+            snapshot = ReferenceDataSnapshot.from_file(snapshot_file)
+            log.info("Loaded reference data snapshot of topics {0} from {1}".format(list(snapshot.topics),
+                                                                                  snapshot_file))
+            return snapshot
+        except (IOError, ValueError, KeyError) as e:
+            log.error("Unable to load reference data snapshot from {0}: {1}".format(snapshot_file, repr(e)))
+    elif str_to_bool(config.get('metax.ref_data_snapshot_preload', 'false')):
+        return load_ref_data_snapshot_from_metax(
+            max_age=int(config.get('metax.ref_data_snapshot_max_age',
+                                   config.get('metax.ref_data_cache_ttl', DEFAULT_CACHE_TTL))))
+    return ReferenceDataSnapshot(topics=[])
+
+
+def _query_ref_data(topic, field, term, result_field):
     query = json.dumps({
         "query": {
             "bool": {
@@ -176,10 +513,9 @@ def get_ref_data(topic, field, term, result_field):
             }
         }
     })
-    response = requests.get(METAX_REFERENCE_DATA_URL, data=query, verify=VERIFY_SSL, headers=HEADERS)
-    results = json.loads(response.text)
-    try:
-        result = results['hits']['hits'][0]['_source'][result_field]
-        return result
-    except:
+    response = get_metax_client().get(METAX_REFERENCE_DATA_URL, data=query, headers=HEADERS)
+    response.raise_for_status()
+    hits = json.loads(response.text)['hits']['hits']
+    if not hits:
         return None
+    return hits[0]['_source'].get(result_field)
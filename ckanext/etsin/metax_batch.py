@@ -0,0 +1,216 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Buffering of MetaX catalog record writes into bulk create and update requests
+"""
+
+import logging
+import threading
+import time
+import uuid
+
+from requests import exceptions
+
+import ckanext.etsin.metax_api as metax_api
+
+log = logging.getLogger(__name__)
+
+CREATE = 'create'
+UPDATE = 'update'
+
+
+class PendingWrite(object):
+    """
+    A catalog record waiting to be written to MetaX, and the CKAN package it belongs to.
+    """
+
+    def __init__(self, operation, package_id, catalog_record, callback):
+        self.operation = operation
+        self.package_id = package_id
+        self.catalog_record = catalog_record
+        self.callback = callback
+
+    @property
+    def preferred_identifier(self):
+        return self.catalog_record.get('research_dataset', {}).get('preferred_identifier')
+
+    @property
+    def metax_cr_id(self):
+        return self.catalog_record.get('identifier')
+
+
+class WriteResult(object):
+    """
+    Outcome of a PendingWrite. metax_cr_id is set on success, errors on failure.
+    """
+
+    def __init__(self, write, metax_cr_id=None, errors=None):
+        self.write = write
+        self.package_id = write.package_id
+        self.metax_cr_id = metax_cr_id
+        self.errors = errors
+
+    @property
+    def ok(self):
+        return self.metax_cr_id is not None and not self.errors
+
+
+class LocalMetaxWriter(object):
+    """
+    In-memory stand-in for the MetaX bulk endpoints, for tests and benchmarks.
+    Records without preferred_identifier in research_dataset fail like they would in MetaX.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.requests = 0
+
+    def create_catalog_records(self, cr_list):
+        self.requests += 1
+        success, failed = [], []
+        for cr in cr_list:
+            if not cr.get('research_dataset', {}).get('preferred_identifier'):
+                failed.append({'object': cr, 'errors': {'research_dataset': ['preferred_identifier is required']}})
+                continue
+            created = dict(cr, identifier=unicode(uuid.uuid4()))
+            self.records[created['identifier']] = created
+            success.append({'object': created})
+        return success, failed
+
+    def update_catalog_records(self, cr_list):
+        self.requests += 1
+        success, failed = [], []
+        for cr in cr_list:
+            if cr.get('identifier') not in self.records:
+                failed.append({'object': cr, 'errors': {'detail': ['Not found.']}})
+                continue
+            self.records[cr['identifier']] = cr
+            success.append({'object': cr})
+        return success, failed
+
+
+class MetaxWriteBatch(object):
+    """
+    Buffers catalog record creates and updates and writes them to MetaX with bulk requests of
+    at most chunk_size records. Each record's callback is called with its WriteResult when it
+    has been written, on the thread that flushes the batch.
+
+    Writes of the same preferred identifier are never in the same bulk request: adding a record
+    whose preferred identifier is already pending flushes the batch first.
+    """
+
+    def __init__(self, chunk_size, max_wait=None, writer=metax_api):
+        """
+        :param chunk_size: number of records per bulk request, the batch is flushed when it is full
+        :param max_wait: seconds after which pending writes are flushed on the next add, None for no limit
+        :param writer: object with create_catalog_records and update_catalog_records, defaults to metax_api
+        """
+        self.chunk_size = max(1, chunk_size)
+        self.max_wait = max_wait
+        self.writer = writer
+        self._pending = []
+        self._preferred_identifiers = set()
+        self._oldest = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add_create(self, package_id, catalog_record, callback):
+        self._add(PendingWrite(CREATE, package_id, catalog_record, callback))
+
+    def add_update(self, package_id, catalog_record, callback):
+        self._add(PendingWrite(UPDATE, package_id, catalog_record, callback))
+
+    def _add(self, write):
+        with self._lock:
+            if write.preferred_identifier in self._preferred_identifiers or self._waited_too_long():
+                self.flush()
+            self._pending.append(write)
+            self._preferred_identifiers.add(write.preferred_identifier)
+            if self._oldest is None:
+                self._oldest = time.time()
+            if len(self._pending) >= self.chunk_size:
+                self.flush()
+
+    def _waited_too_long(self):
+        return self.max_wait is not None and self._oldest is not None and time.time() - self._oldest > self.max_wait
+
+    def flush_if_due(self):
+        with self._lock:
+            if self._waited_too_long():
+                self.flush()
+
+    def flush(self):
+        """
+        Write all pending records to MetaX and call their callbacks.
+
+        :return: list of WriteResults
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._preferred_identifiers = set()
+            self._oldest = None
+
+        results = []
+        for operation in (CREATE, UPDATE):
+            writes = [w for w in pending if w.operation == operation]
+            for i in range(0, len(writes), self.chunk_size):
+                results.extend(self._write_chunk(operation, writes[i:i + self.chunk_size]))
+
+        for result in results:
+            try:
+                result.write.callback(result)
+            except Exception as e:
+                log.error("Handling MetaX write result of CKAN package {0} failed: {1}"
+                          .format(result.package_id, repr(e)))
+        return results
+
+    def _write_chunk(self, operation, writes):
+        log.info("Sending {0} catalog records to MetaX in one {1} request".format(len(writes), operation))
+        try:
+            if operation == CREATE:
+                success, failed = self.writer.create_catalog_records([w.catalog_record for w in writes])
+            else:
+                success, failed = self.writer.update_catalog_records([w.catalog_record for w in writes])
+        except (exceptions.RequestException, ValueError) as e:
+            log.error("Bulk {0} of catalog records failed: {1}".format(operation, repr(e)))
+            return [WriteResult(w, errors={'request': [repr(e)]}) for w in writes]
+
+        return _match_results(operation, writes, success, failed)
+
+
+def _result_key(operation, catalog_record):
+    if operation == CREATE:
+        return catalog_record.get('research_dataset', {}).get('preferred_identifier')
+    return catalog_record.get('identifier')
+
+
+def _match_results(operation, writes, success, failed):
+    """
+    Map bulk response items back to the writes they belong to. Creates are matched by
+    preferred identifier and updates by catalog record identifier.
+    """
+    created = {}
+    for item in success:
+        cr = item.get('object', {})
+        created[_result_key(operation, cr)] = cr.get('identifier')
+    errors = {}
+    for item in failed:
+        errors[_result_key(operation, item.get('object', {}))] = item.get('errors') or {'detail': ['Failed']}
+
+    results = []
+    for w in writes:
+        key = _result_key(operation, w.catalog_record)
+        if key in errors:
+            results.append(WriteResult(w, errors=errors[key]))
+        elif created.get(key):
+            results.append(WriteResult(w, metax_cr_id=created[key]))
+        else:
+            results.append(WriteResult(w, errors={'detail': ['Record missing from MetaX bulk response']}))
+    return results
@@ -0,0 +1,150 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Process-wide HTTP client for MetaX
+"""
+
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from pylons import config
+
+log = logging.getLogger(__name__)
+
+TIMEOUT = 30
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (502, 503, 504)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _int_from_config(key, default):
+    value = config.get(key)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        log.error("Unable to convert {0}={1} to integer. Using default value {2}.".format(key, value, default))
+        return default
+
+
+def _float_from_config(key, default):
+    value = config.get(key)
+    if value is None or value == '':
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        log.error("Unable to convert {0}={1} to float. Using default value {2}.".format(key, value, default))
+        return default
+
+
+class MetaxClient(object):
+    """
+    Keeps one pooled keep-alive requests.Session for all MetaX traffic, so that consecutive
+    requests to MetaX reuse already opened connections instead of doing a new TCP and TLS handshake.
+
+    Configuration options (all optional):
+
+    metax.pool_connections: number of per-host connection pools to keep
+    metax.pool_maxsize: maximum number of connections kept open per host
+    metax.pool_block: if true, never open more than metax.pool_maxsize connections per host
+    metax.max_retries: how many times failed connections and 502/503/504 responses are retried
+    metax.backoff_factor: backoff factor between retries in seconds
+    metax.timeout: request timeout in seconds
+    """
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, pool_block=None, max_retries=None,
+                 backoff_factor=None, timeout=None):
+        from ckanext.etsin.utils import str_to_bool
+
+        self.timeout = timeout or _int_from_config('metax.timeout', TIMEOUT)
+        self.verify_ssl = str_to_bool(config.get('metax.verify_ssl'))
+
+        if pool_connections is None:
+            pool_connections = _int_from_config('metax.pool_connections', DEFAULT_POOL_CONNECTIONS)
+        if pool_maxsize is None:
+            pool_maxsize = _int_from_config('metax.pool_maxsize', DEFAULT_POOL_MAXSIZE)
+        if pool_block is None:
+            pool_block = str_to_bool(config.get('metax.pool_block', 'false'))
+        if max_retries is None:
+            max_retries = _int_from_config('metax.max_retries', DEFAULT_MAX_RETRIES)
+        if backoff_factor is None:
+            backoff_factor = _float_from_config('metax.backoff_factor', DEFAULT_BACKOFF_FACTOR)
+
+        # Only idempotent methods are retried on read errors and error statuses, so POSTs
+        # are never sent twice. Connection errors are retried for all methods.
+        retry = Retry(total=max_retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUS_CODES,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              pool_block=pool_block,
+                              max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.auth = (config.get('metax.api_user'), config.get('metax.api_password'))
+        self.session.verify = self.verify_ssl
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def get_metax_client():
+    """
+    Get the process-wide MetaX client. The client is created on first use.
+
+    :return: MetaxClient
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MetaxClient()
+    return _client
+
+
+def reset_metax_client():
+    """
+    Close the process-wide MetaX client. A new one is created on next get_metax_client call.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
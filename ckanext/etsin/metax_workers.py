@@ -0,0 +1,138 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Worker threads for running MetaX requests of several harvest objects concurrently
+"""
+
+import logging
+import threading
+from Queue import Queue, Empty
+
+log = logging.getLogger(__name__)
+
+# Returned by _handle_next when no task has finished
+_NOTHING = object()
+
+
+class MetaxWorkerPool(object):
+    """
+    Runs MetaX requests on worker threads while the harvester goes on with the next harvest objects.
+
+    Tasks submitted with the same key, e.g. the same preferred identifier, are run by the same worker
+    in the order they were submitted. Callbacks are never run on the worker threads but on the thread
+    calling submit, drain or join, so that CKAN database writes stay on the thread owning the session.
+
+    At most max_in_flight tasks are submitted and not yet handled by their callbacks. When the limit is
+    reached submit blocks, handling finished tasks, until there is room again.
+    """
+
+    def __init__(self, workers, max_in_flight=None):
+        """
+        :param workers: number of worker threads
+        :param max_in_flight: maximum number of unfinished tasks, defaults to twice the number of workers
+        """
+        self.workers = max(1, workers)
+        self.max_in_flight = max(1, max_in_flight or 2 * self.workers)
+        self._in_flight = 0
+        self._queues = []
+        self._threads = []
+        self._done = Queue()
+        self._results = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                tasks = Queue()
+                thread = threading.Thread(target=self._work, args=(tasks,), name='metax-worker-{0}'.format(i))
+                thread.daemon = True
+                thread.start()
+                self._queues.append(tasks)
+                self._threads.append(thread)
+
+    def _work(self, tasks):
+        while True:
+            item = tasks.get()
+            if item is None:
+                return
+            task, callback = item
+            try:
+                result = task()
+            except Exception as e:
+                log.error("MetaX worker task failed: {0}".format(repr(e)))
+                self._done.put((None, None))
+                continue
+            self._done.put((callback, result))
+
+    def __len__(self):
+        return self._in_flight
+
+    def submit(self, key, task, callback):
+        """
+        Run task on a worker thread and later callback(result) on this thread.
+
+        :param key: tasks with equal keys are run one at a time in submission order
+        :param task: function without arguments doing the MetaX requests
+        :param callback: function called with the return value of task
+        """
+        self._start()
+        while self._in_flight >= self.max_in_flight:
+            self._handle_next(block=True)
+        self._in_flight += 1
+        self._queues[hash(key) % self.workers].put((task, callback))
+
+    def _handle_next(self, block):
+        try:
+            callback, result = self._done.get(block=block)
+        except Empty:
+            return _NOTHING
+        self._in_flight -= 1
+        if callback is not None:
+            self._results.append(result)
+            try:
+                callback(result)
+            except Exception as e:
+                log.error("Handling result of a MetaX worker task failed: {0}".format(repr(e)))
+        return result
+
+    def _take_results(self):
+        results, self._results = self._results, []
+        return results
+
+    def drain(self):
+        """
+        Run callbacks of the tasks that have finished, without waiting for the others.
+
+        :return: list of results of the tasks handled since the previous drain or join
+        """
+        while self._in_flight > 0:
+            if self._handle_next(block=False) is _NOTHING:
+                break
+        return self._take_results()
+
+    def join(self):
+        """
+        Wait until all submitted tasks have finished and their callbacks have been run.
+
+        :return: list of results of the tasks handled since the previous drain or join
+        """
+        while self._in_flight > 0:
+            self._handle_next(block=True)
+        return self._take_results()
+
+    def close(self):
+        self.join()
+        with self._lock:
+            for tasks in self._queues:
+                tasks.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._queues = []
+            self._threads = []
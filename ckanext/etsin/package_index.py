@@ -0,0 +1,54 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+In-memory index of the CKAN package id to package name, i.e. MetaX catalog record identifier,
+of the packages of a harvest source
+"""
+
+import threading
+import time
+
+DEFAULT_INDEX_MAX_AGE = 3600
+
+
+class PackageNameIndex(object):
+    """
+    Package names of a harvest source, loaded from the CKAN database with one query per harvest job and kept
+    up to date as the harvest actions create, rename and delete packages. Packages missing from the index may
+    have been created outside the harvest actions, so callers should look a miss up from the database.
+    """
+
+    def __init__(self, names=(), max_age=None):
+        """
+        :param names: (package id, package name) pairs, or a dict
+        :param max_age: seconds after which the index is considered expired, None for never
+        """
+        self.loaded_at = time.time()
+        self.max_age = max_age
+        self._names = dict(names)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def get(self, package_id):
+        """
+        :return: package name, or None if the package is not in the index
+        """
+        return self._names.get(package_id)
+
+    def set(self, package_id, name):
+        with self._lock:
+            self._names[package_id] = name
+
+    def remove(self, package_id):
+        with self._lock:
+            self._names.pop(package_id, None)
+
+    def expired(self):
+        return self.max_age is not None and time.time() - self.loaded_at > self.max_age
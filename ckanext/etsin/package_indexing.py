@@ -0,0 +1,87 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Indexing of harvested CKAN packages to the search index in chunks
+"""
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class PackageIndexBatch(object):
+    """
+    Collects the CKAN packages the harvest actions have written and hands them to an index function
+    chunk_size packages at a time, so that they can be indexed with one search index commit.
+
+    The packages are committed by the harvester after the harvest action has returned, so adding a package
+    never indexes it. Pending packages are indexed by flush_if_due on a later harvest action, once there is
+    a full chunk of them or the oldest has waited longer than max_wait, and by flush at the end of a job.
+
+    The harvest packages only link a CKAN package id to a MetaX catalog record identifier, so nothing is lost
+    if the packages of a failed chunk are left out of the search index until the next harvest job.
+    """
+
+    def __init__(self, chunk_size, index, max_wait=None):
+        """
+        :param chunk_size: number of packages per search index commit
+        :param index: function called with the ids of the packages to index
+        :param max_wait: seconds after which pending packages are indexed on the next flush_if_due,
+                         None for no limit
+        """
+        self.chunk_size = max(1, chunk_size)
+        self.index = index
+        self.max_wait = max_wait
+        self._pending = []
+        self._oldest = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, package_id):
+        """
+        Note that package_id has been written and is to be indexed once it has been committed.
+        """
+        with self._lock:
+            if package_id not in self._pending:
+                self._pending.append(package_id)
+            if self._oldest is None:
+                self._oldest = time.time()
+
+    def _waited_too_long(self):
+        return self.max_wait is not None and self._oldest is not None and time.time() - self._oldest > self.max_wait
+
+    def flush_if_due(self):
+        """
+        Index the pending packages if there is a full chunk of them or they have waited longer than max_wait.
+        Call only when the pending packages have been committed.
+        """
+        with self._lock:
+            if len(self._pending) >= self.chunk_size or self._waited_too_long():
+                self.flush()
+
+    def flush(self):
+        """
+        Index the pending packages. Call only when they have been committed.
+
+        :return: ids of the indexed packages
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._oldest = None
+
+        for i in range(0, len(pending), self.chunk_size):
+            chunk = pending[i:i + self.chunk_size]
+            try:
+                self.index(chunk)
+            except Exception as e:
+                log.error("Indexing {0} harvested packages failed: {1}".format(len(chunk), repr(e)))
+        return pending
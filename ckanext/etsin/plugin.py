@@ -14,6 +14,7 @@ from ckanext.oaipmh.interfaces import IOAIPMHHarvester
 from ckanext.spatial.interfaces import ISpatialHarvester
 
 from ckanext.etsin import actions
+from ckanext.etsin.data_catalog_service import validate_data_catalogs
 from ckanext.etsin.mappers import cmdi
 from ckanext.etsin.mappers import datacite
 from ckanext.etsin.mappers import iso_19139
@@ -24,6 +25,7 @@ log = logging.getLogger(__name__)
 
 class EtsinPlugin(plugins.SingletonPlugin):
     plugins.implements(plugins.IActions)
+    plugins.implements(plugins.IConfigurable)
     plugins.implements(plugins.IConfigurer)
     plugins.implements(ISpatialHarvester)
     plugins.implements(IOAIPMHHarvester)
@@ -38,6 +40,12 @@ class EtsinPlugin(plugins.SingletonPlugin):
             'package_update': actions.package_update,
         }
 
+    # IConfigurable
+
+    def configure(self, config):
+        if not validate_data_catalogs():
+            log.error("Some harvest source data catalog files are invalid. Harvesting those sources will fail.")
+
     # IConfigurer
 
     def update_config(self, config_):
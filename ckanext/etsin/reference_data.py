@@ -0,0 +1,188 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+In-process caching and snapshots of MetaX reference data
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 3600
+
+# Stored in place of a result when MetaX reference data had no match for the query
+_MISS = object()
+
+class ReferenceDataCache(object):
+    """
+    Bounded LRU cache with a time to live for reference data lookups. Keys are
+    (topic, field, term, result_field) tuples. Lookups that had no match in MetaX
+    are cached as well, so that the same unknown term is not queried again and again.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        Get a cached value for key. If there is no valid cached value, call loader()
+        and cache whatever it returns, including None. If loader raises, nothing is cached.
+
+        :param key: (topic, field, term, result_field) tuple
+        :param loader: function without arguments returning the value for key
+        :return: cached or loaded value
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and (self.ttl is None or entry[0] > now):
+                self._entries[key] = entry
+                self.hits += 1
+                return None if entry[1] is _MISS else entry[1]
+            self.misses += 1
+
+        # Loader is called outside the lock so that slow MetaX queries do not block other threads
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        expires = self._clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, _MISS if value is None else value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """
+        Drop key from the cache, or everything if no key is given.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _normalize(value):
+    return u' '.join(unicode(value).lower().split())
+
+
+def _iter_field_values(document, prefix=''):
+    """
+    Yield (field, value) pairs of all string values of a reference data document.
+    Nested fields are joined with a period, e.g. ('label.fi', u'Suomi').
+    """
+    for key, value in document.items():
+        field = prefix + key
+        if isinstance(value, dict):
+            for item in _iter_field_values(value, field + '.'):
+                yield item
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, basestring):
+                    yield field, item
+        elif isinstance(value, basestring):
+            yield field, value
+
+
+class ReferenceDataSnapshot(object):
+    """
+    In-memory copy of MetaX reference data, indexed per topic and per field, so that
+    reference data lookups can be answered without querying MetaX at all.
+
+    The snapshot only finds values equal to the term, compared case-insensitively and with
+    whitespace normalized. metax_api.get_ref_data queries MetaX with full-text match queries,
+    so a term the snapshot does not find may still match in MetaX. Such lookups are left to
+    MetaX, unless the snapshot is offline, i.e. loaded from a file in place of MetaX.
+    If several documents have the same value in a field, the first one wins.
+    """
+
+    def __init__(self, documents=(), topics=None, max_age=None, offline=False):
+        """
+        :param documents: reference data documents (the _source part of reference_data index hits)
+        :param topics: topics the documents fully cover. Defaults to all topics found in documents.
+        :param max_age: seconds after which the snapshot is considered expired, None for never
+        :param offline: whether lookups the snapshot has no match for are not to be queried from MetaX
+        """
+        self._index = {}
+        self._documents = []
+        self.topics = set(topics or [])
+        self.loaded_at = time.time()
+        self.max_age = max_age
+        self.offline = offline
+        for document in documents:
+            self.add(document)
+        if topics is None:
+            self.topics = set(self._index.keys())
+
+    def add(self, document):
+        topic = document.get('type')
+        if not topic:
+            return
+        self._documents.append(document)
+        fields = self._index.setdefault(topic, {})
+        for field, value in _iter_field_values(document):
+            fields.setdefault(field, {}).setdefault(_normalize(value), document)
+
+    def covers(self, topic):
+        return topic in self.topics
+
+    def expired(self):
+        return self.max_age is not None and time.time() - self.loaded_at > self.max_age
+
+    def lookup(self, topic, field, term, result_field):
+        """
+        Find result_field of the reference data entry of given topic whose field equals term.
+
+        :return: value of result_field or None if there is no match
+        """
+        if term is None:
+            return None
+        document = self._index.get(topic, {}).get(field, {}).get(_normalize(term))
+        if document is None:
+            return None
+        return document.get(result_field)
+
+    def documents(self):
+        return list(self._documents)
+
+    @classmethod
+    def from_file(cls, file_path):
+        """
+        Load a snapshot from a JSON file containing either a list of reference data documents
+        or an Elasticsearch search response from the reference_data index.
+        """
+        with open(file_path, 'r') as f:
+            content = json.load(f)
+        if isinstance(content, dict):
+            content = [hit['_source'] for hit in content.get('hits', {}).get('hits', [])]
+        return cls(content, offline=True)
+
+    def to_file(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(self._documents, f)
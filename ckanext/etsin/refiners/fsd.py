@@ -10,10 +10,10 @@
 """
 Refine FSD data_dict
 """
-from functionally import first
 import os
 import re
 
+from ..ddi_record import get_ddi_record
 from ..utils import (convert_language,
                      get_language_identifier,
                      get_tag_lang,
@@ -30,8 +30,6 @@ def fsd_refiner(context, data_dict):
     :param context: Dictionary with an lxml-field
     :param data_dict: Dataset dictionary in MetaX format
     """
-    namespaces = {'oai': "http://www.openarchives.org/OAI/2.0/",
-                  'ddi': "ddi:codebook:2_5"}
     ACCESS_RIGHTS = [{
         'match': r"The dataset is \(A\)",
         'license': 'other-open',
@@ -50,12 +48,11 @@ def fsd_refiner(context, data_dict):
 
     package_dict = data_dict
     xml = context.get('source_data')
-    cb = first(xml.xpath('//oai:record/oai:metadata/ddi:codeBook',
-                         namespaces=namespaces))
+    # Reuse the record view of the DDI mapper for the lxml object passed in from it
+    ddi = get_ddi_record(xml)
 
     # Language
-    languages = [get_tag_lang(fn) for fn in cb.findall(
-        'ddi:fileDscr/ddi:fileTxt/ddi:fileName', namespaces)]
+    languages = [get_tag_lang(fn) for fn in ddi.file_names()]
 
     language_list = [{'identifier': get_language_identifier(
         convert_language(lang))} for lang in languages]
@@ -66,8 +63,7 @@ def fsd_refiner(context, data_dict):
     if 'access_rights' not in package_dict:
         package_dict['access_rights'] = {}
     restriction = {}
-    for res in cb.findall('ddi:stdyDscr/ddi:dataAccs/ddi:useStmt/ddi:restrctn',
-                          namespaces):
+    for res in ddi.findall(ddi.data_accs(), 'ddi:useStmt/ddi:restrctn'):
         restriction[get_tag_lang(res)] = res.text.strip()
     if len(restriction.get('en', '')):
         for ar in ACCESS_RIGHTS:
@@ -89,8 +85,7 @@ def fsd_refiner(context, data_dict):
             log.error('Unknown licence in dataset')
 
     conditions = {}
-    for cond in cb.findall('ddi:stdyDscr/ddi:dataAccs/ddi:useStmt/ddi:conditions',
-                           namespaces):
+    for cond in ddi.findall(ddi.data_accs(), 'ddi:useStmt/ddi:conditions'):
         conditions[get_tag_lang(cond)] = cond.text.strip()
     if len(conditions):
         package_dict['access_rights']['description'] = conditions
@@ -9,7 +9,7 @@
 Refine Kielipankki data_dict
 """
 import os
-from ckanext.etsin.cmdi_parse_helper import CmdiParseHelper
+from ckanext.etsin.cmdi_parse_helper import get_cmdi_parse_helper
 from ckanext.etsin.utils import set_existing_kata_identifier_to_other_identifier
 from ckanext.etsin.exceptions import DatasetFieldsMissingError
 
@@ -105,8 +105,8 @@ def kielipankki_refiner(context, data_dict):
     package_dict = data_dict
     xml = context.get('source_data')
 
-    # Read lxml object passed in from CMDI mapper
-    cmdi = CmdiParseHelper(xml)
+    # Reuse the parse helper of the CMDI mapper for the lxml object passed in from it
+    cmdi = get_cmdi_parse_helper(xml)
 
     package_dict['access_rights'] = {}
     # License
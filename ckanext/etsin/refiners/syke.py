@@ -10,8 +10,7 @@ import os
 
 from ckanext.etsin.data_catalog_service import DataCatalogMetaxAPIService as DCS
 from ckanext.etsin.exceptions import DatasetFieldsMissingError
-from ckanext.etsin.utils import search_pid_exists_in_mapping_file, \
-                                set_existing_kata_identifier_to_preferred_identifier, \
+from ckanext.etsin.utils import get_kata_identifier_from_mapping_file, \
                                 set_urn_pid_to_other_identifier
 
 log = logging.getLogger(__name__)
@@ -28,18 +27,18 @@ def syke_refiner(context, package_dict):
     # Special rule, which is to be removed when syke gets their own resolvable identifiers to their datasets:
     # Do not harvest datasets which do / did not exist in old etsin and set existing kata identifier to dataset
     # preferred_identifier field
-    if not search_pid_exists_in_mapping_file(mapping_file_path, harvest_object_guid):
+    kata_identifier = get_kata_identifier_from_mapping_file(mapping_file_path, harvest_object_guid)
+    if not kata_identifier:
         log.warning("Harvest object guid {0} not found from the mapping file. Skipping harvesting for now..".
                     format(harvest_object_guid))
         return None
 
-    set_existing_kata_identifier_to_preferred_identifier(mapping_file_path, harvest_object_guid, package_dict)
+    package_dict['preferred_identifier'] = kata_identifier
     set_urn_pid_to_other_identifier(harvest_object_guid, package_dict)
 
-    data_catalog = DCS.get_data_catalog_from_file('syke_data_catalog.json')['catalog_json']
-
     # If Field of science was not set in mapper, fallback here to syke data catalog fos
     if 'field_of_science' not in package_dict or not len(package_dict.get('field_of_science')):
+        data_catalog = DCS.get_data_catalog_from_file('syke_data_catalog.json')['catalog_json']
         field_of_science = data_catalog['field_of_science'][0]
         package_dict['field_of_science'] = [{'identifier': field_of_science['identifier']}]
 
@@ -0,0 +1,233 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""
+Offline throughput benchmark of the mappers and refiners over the test fixtures.
+
+Every fixture record is parsed, mapped and refined as many times as there are records in the
+corpus, each time as a new harvest object. MetaX reference data queries are stubbed, so no
+network access is needed. The mappers are called the same way as the plugin's
+get_oaipmh_package_dict and get_package_dict call them.
+
+Usage, from the repository root:
+
+    python -m ckanext.etsin.tests.benchmark --records 2000 --output benchmark.json
+    python -m ckanext.etsin.tests.benchmark --baseline benchmark.json
+
+With --baseline the results are compared to an earlier run, and the exit status is 1 if the
+throughput of any source has dropped more than the tolerance.
+"""
+
+import argparse
+import copy
+import json
+import logging
+import math
+import platform
+import resource
+import sys
+import time
+
+from lxml import etree
+from mock import patch
+
+from ckanext.etsin.mappers.cmdi import cmdi_mapper
+from ckanext.etsin.mappers.datacite import datacite_mapper
+from ckanext.etsin.mappers.ddi25 import ddi25_mapper
+from ckanext.etsin.mappers.iso_19139 import iso_19139_mapper
+from ckanext.etsin.refine import refine
+
+from . import helpers
+from .iso19139_test_dicts import get_iso_values_dict_1
+
+log = logging.getLogger(__name__)
+
+# Harvest object guid of the ISO 19139 record, which the Syke refiner finds in its mapping file
+SYKE_GUID = '{51C9D60D-6D41-44BD-9136-C4933510DB2D}'
+
+# Mappers of the OAI-PMH metadata formats, as chosen by EtsinPlugin.get_oaipmh_package_dict
+OAIPMH_MAPPERS = {
+    'cmdi0571': cmdi_mapper,
+    'oai_datacite': datacite_mapper,
+    'oai_ddi25': ddi25_mapper,
+}
+
+# Fixtures of the OAI-PMH sources: (harvest source name, OAI-PMH metadata format, fixture file)
+OAIPMH_SOURCES = (
+    ('kielipankki', 'cmdi0571', 'kielipankki_cmdi/cmdi_record_example.xml'),
+    ('fsd', 'oai_ddi25', 'ddi25/ddi25_1.xml'),
+    ('datacite', 'oai_datacite', 'datacite/datacite1.xml'),
+)
+
+# Sources without a refiner of their own are only mapped
+REFINED_SOURCES = ('kielipankki', 'fsd', 'syke')
+
+PERCENTILES = (50, 90, 99)
+
+
+def _stub_ref_data(topic, field, term, result_field):
+    """ Answer reference data queries without MetaX """
+    return u'{0}:{1}'.format(topic, term)
+
+
+class _HarvestObject(object):
+
+    def __init__(self, guid):
+        self.guid = guid
+
+
+def _percentile(sorted_values, percent):
+    """ Nearest-rank percentile of a sorted list """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(0, min(rank, len(sorted_values)) - 1)]
+
+
+def _stage_summary(durations):
+    durations = sorted(durations)
+    summary = dict(('p{0}_ms'.format(p), round(_percentile(durations, p) * 1000, 4)) for p in PERCENTILES)
+    summary['max_ms'] = round(durations[-1] * 1000, 4)
+    summary['total_s'] = round(sum(durations), 4)
+    return summary
+
+
+def _peak_rss_kb():
+    """ Peak resident set size of the process so far, in kilobytes on Linux """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class _StageTimer(object):
+
+    def __init__(self):
+        self.durations = {}
+
+    def run(self, stage, function, *args):
+        start = time.time()
+        value = function(*args)
+        self.durations.setdefault(stage, []).append(time.time() - start)
+        return value
+
+
+def _oaipmh_record(timer, source_name, md_format, content):
+    xml = timer.run('parse', etree.fromstring, content)
+    package_dict = timer.run('map', OAIPMH_MAPPERS[md_format], xml)
+    if source_name in REFINED_SOURCES:
+        context = {'harvest_source_name': source_name, 'source_data': xml}
+        timer.run('refine', refine, context, package_dict)
+
+
+def _iso_19139_record(timer, data_dict):
+    # ckanext-spatial gives the mapper the values it has parsed, each harvest object its own
+    data_dict = timer.run('copy', copy.deepcopy, data_dict)
+    context = {'harvest_source_name': 'syke'}
+    package_dict = timer.run('map', iso_19139_mapper, context, data_dict)
+    timer.run('refine', refine, context, package_dict)
+
+
+def _run_source(records, handle_record, *args):
+    timer = _StageTimer()
+    rss_before = _peak_rss_kb()
+    start = time.time()
+    for i in range(records):
+        handle_record(timer, *args)
+    elapsed = time.time() - start
+    return {
+        'records': records,
+        'elapsed_s': round(elapsed, 4),
+        'records_per_second': round(records / elapsed, 2) if elapsed else None,
+        'stages': dict((stage, _stage_summary(durations)) for stage, durations in timer.durations.items()),
+        'peak_rss_kb': _peak_rss_kb(),
+        'peak_rss_growth_kb': _peak_rss_kb() - rss_before,
+    }
+
+
+def run_benchmark(records):
+    """
+    Map and refine records copies of every fixture record.
+
+    :param records: number of records per source
+    :return: dict of results, suitable for saving as JSON
+    """
+    results = {}
+    with patch('ckanext.etsin.mappers.ddi25.get_ref_data', side_effect=_stub_ref_data), \
+            patch('ckanext.etsin.mappers.datacite.get_ref_data', side_effect=_stub_ref_data):
+        for source_name, md_format, fixture in OAIPMH_SOURCES:
+            content = helpers._get_file_as_string(fixture)
+            results[source_name] = _run_source(records, _oaipmh_record, source_name, md_format, content)
+            results[source_name]['format'] = md_format
+
+        data_dict = get_iso_values_dict_1()
+        data_dict['harvest_object'] = _HarvestObject(SYKE_GUID)
+        results['syke'] = _run_source(records, _iso_19139_record, data_dict)
+        results['syke']['format'] = 'iso19139'
+
+    return {
+        'records_per_source': records,
+        'python': platform.python_version(),
+        'lxml': '.'.join(str(part) for part in etree.LXML_VERSION),
+        'sources': results,
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    :return: list of messages about sources whose throughput dropped more than tolerance
+    """
+    regressions = []
+    for source_name, result in sorted(results['sources'].items()):
+        expected = baseline.get('sources', {}).get(source_name, {}).get('records_per_second')
+        measured = result['records_per_second']
+        if not expected or measured is None:
+            continue
+        if measured < expected * (1 - tolerance):
+            regressions.append("{0}: {1} records/s, baseline {2} records/s".format(source_name, measured, expected))
+    return regressions
+
+
+def _print_results(results):
+    for source_name, result in sorted(results['sources'].items()):
+        print("{0} ({1}): {2} records/s, peak RSS {3} kB".format(
+            source_name, result['format'], result['records_per_second'], result['peak_rss_kb']))
+        for stage in ('parse', 'copy', 'map', 'refine'):
+            if stage in result['stages']:
+                summary = result['stages'][stage]
+                print("  {0:<7}".format(stage) + ", ".join(
+                    "p{0} {1} ms".format(p, summary['p{0}_ms'.format(p)]) for p in PERCENTILES))
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Benchmark the Etsin mappers and refiners offline")
+    arg_parser.add_argument('--records', type=int, default=1000, help="records per source")
+    arg_parser.add_argument('--output', help="file to save the results to as JSON")
+    arg_parser.add_argument('--baseline', help="JSON results of an earlier run to compare to")
+    arg_parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="allowed relative drop in records/s compared to the baseline")
+    args = arg_parser.parse_args(argv)
+
+    # Mapping problems of the replicated fixtures are the same for every record
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results = run_benchmark(args.records)
+    _print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print("Slower than baseline: " + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,15 +6,608 @@
 # :license: GNU Affero General Public License version 3
 
 import ckanext.etsin.actions as actions
+import ckanext.etsin.metax_api as metax_api
+from ckanext.etsin.catalog_snapshot import CatalogRecordSnapshot
+from ckanext.etsin.fingerprints import fingerprint, get_fingerprint_store, reset_fingerprint_store
 from ckanext.etsin.mappers.cmdi import cmdi_mapper
+from ckanext.etsin.package_index import PackageNameIndex
 from ckan import model
 
+import json
+import time
 import unittest
 from unittest import TestCase
 from nose.tools import ok_, eq_
 from mock import Mock, patch
+from requests import HTTPError
 import helpers
 
+PREF_ID = 'urn:nbn:fi:csc-test-1'
+DATA_CATALOG_ID = 'urn:nbn:fi:att:data-catalog-test'
+
+
+def _response(status_code, body=None):
+    response = Mock(status_code=status_code, text=json.dumps(body))
+    response.json.return_value = body
+    if status_code >= 400:
+        response.raise_for_status.side_effect = HTTPError('{0} Error'.format(status_code), response=response)
+    return response
+
+
+class FakeMetax(object):
+    """
+    Answers the catalog record requests metax_api sends to MetaX from an in-memory dict of catalog records.
+    Records whose preferred identifier is in rejected fail validation. If post_error is set, single creates
+    fail with that status.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.rejected = set()
+        self.post_error = None
+        self.requests = []
+
+    def add(self, metax_cr_id, pref_id, modified=None):
+        self.records[metax_cr_id] = {'identifier': metax_cr_id,
+                                     'research_dataset': {'preferred_identifier': pref_id, 'modified': modified}}
+
+    def find(self, pref_id):
+        for record in self.records.values():
+            if record['research_dataset']['preferred_identifier'] == pref_id:
+                return record
+        return None
+
+    def _path(self, method, url):
+        path = url[len(metax_api.METAX_DATASETS_BASE_URL):]
+        self.requests.append((method, path))
+        return path
+
+    def get(self, url, **kwargs):
+        path = self._path('GET', url)
+        if path.startswith('?preferred_identifier='):
+            record = self.find(path.split('=', 1)[1])
+        else:
+            record = self.records.get(path.lstrip('/'))
+        return _response(200, record) if record else _response(404, {'detail': 'Not found.'})
+
+    def head(self, url, **kwargs):
+        return _response(200 if self.records.get(self._path('HEAD', url).lstrip('/')) else 404)
+
+    def post(self, url, **kwargs):
+        self._path('POST', url)
+        payload = self._payload(kwargs)
+        if not isinstance(payload, list):
+            if self.post_error:
+                return _response(self.post_error, {'detail': 'Error'})
+            record, errors = self._create(payload)
+            return _response(400, errors) if errors else _response(201, record)
+        success, failed = [], []
+        for record in payload:
+            record, errors = self._create(record)
+            if errors:
+                failed.append({'object': record, 'errors': errors})
+            else:
+                success.append({'object': record})
+        return _response(201 if success else 400, {'success': success, 'failed': failed})
+
+    def _create(self, record):
+        pref_id = record['research_dataset']['preferred_identifier']
+        if pref_id in self.rejected:
+            return record, {'research_dataset': {'title': ['This field is required.']}}
+        if self.find(pref_id):
+            return record, {'research_dataset': ['A catalog record with this research_dataset ->> '
+                                                 'preferred_identifier already exists in this data catalog.']}
+        record['identifier'] = 'cr{0}'.format(len(self.records) + 1)
+        self.records[record['identifier']] = record
+        return record, None
+
+    def put(self, url, **kwargs):
+        metax_cr_id = self._path('PUT', url).lstrip('/')
+        payload = self._payload(kwargs)
+        if not isinstance(payload, list):
+            if metax_cr_id not in self.records:
+                return _response(404, {'detail': 'Not found.'})
+            record, errors = self._update(payload)
+            return _response(400, errors) if errors else _response(200, record)
+        success, failed = [], []
+        for record in payload:
+            record, errors = self._update(record)
+            if errors:
+                failed.append({'object': record, 'errors': errors})
+            else:
+                success.append({'object': record})
+        return _response(200 if success else 400, {'success': success, 'failed': failed})
+
+    def _update(self, record):
+        if record['research_dataset']['preferred_identifier'] in self.rejected:
+            return record, {'research_dataset': {'title': ['This field is required.']}}
+        self.records[record['identifier']] = record
+        return record, None
+
+    def delete(self, url, **kwargs):
+        self.records.pop(self._path('DELETE', url).lstrip('/'), None)
+        return _response(204)
+
+    @staticmethod
+    def _payload(kwargs):
+        return json.loads(kwargs['data']) if 'data' in kwargs else kwargs['json']
+
+
+class HarvestActionTestCase(TestCase):
+    """
+    Calls the harvest actions as the harvest user with MetaX answered by FakeMetax, the CKAN package actions
+    mocked and the package names of the harvest source kept in memory.
+    """
+
+    def setUp(self):
+        reset_fingerprint_store()
+        self.metax = FakeMetax()
+        self.snapshot = None
+        self.package_names = PackageNameIndex()
+        self.context = {'user': 'harvest', 'harvest_source_name': 'test'}
+        self.ckan_create = Mock(side_effect=lambda context, data_dict: dict(data_dict))
+        self.ckan_update = Mock(side_effect=lambda context, data_dict: dict(data_dict))
+        self.ckan_delete = Mock(side_effect=lambda context, data_dict: dict(data_dict))
+        patches = [
+            patch('ckanext.etsin.metax_api.get_metax_client', return_value=self.metax),
+            patch('ckanext.etsin.actions.refine', side_effect=lambda context, package_dict: package_dict),
+            patch('ckanext.etsin.utils.get_data_catalog_id_for_harvest_source', return_value=DATA_CATALOG_ID),
+            patch('ckanext.etsin.actions._get_catalog_record_snapshot', side_effect=lambda context: self.snapshot),
+            patch('ckanext.etsin.actions._get_package_name_index', side_effect=lambda context: self.package_names),
+            patch('ckan.logic.action.create.package_create', self.ckan_create),
+            patch('ckan.logic.action.update.package_update', self.ckan_update),
+            patch('ckan.logic.action.delete.package_delete', self.ckan_delete),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        reset_fingerprint_store()
+
+    def _dataset(self, **fields):
+        dataset = {'preferred_identifier': PREF_ID, 'modified': '2018-01-01T00:00:00', 'title': {'fi': 'Testi'}}
+        dataset.update(fields)
+        return dataset
+
+    def _existing_package(self, package_id, metax_cr_id, dataset):
+        """ A package harvested earlier, whose dataset was last sent to MetaX as metax_cr_id """
+        self.package_names.set(package_id, metax_cr_id)
+        get_fingerprint_store().set(package_id, fingerprint(dataset), metax_cr_id, dataset['preferred_identifier'])
+
+    def _ckan_names(self, ckan_action):
+        return [c[0][1]['name'] for c in ckan_action.call_args_list]
+
+
+class TestPackageCreate(HarvestActionTestCase):
+
+    def testFingerprintedCatalogRecordConfirmedBySnapshot(self):
+        """ Test that the CR of an unchanged fingerprinted dataset is reused without requests if the snapshot has it """
+        dataset = self._dataset()
+        get_fingerprint_store().set('old', fingerprint(dataset), 'cr1', PREF_ID)
+        self.snapshot = CatalogRecordSnapshot(DATA_CATALOG_ID)
+        self.snapshot.set(PREF_ID, 'cr1', None)
+        actions.package_create(self.context, dataset)
+        eq_(self.metax.requests, [])
+        eq_(self._ckan_names(self.ckan_create), ['cr1'])
+
+    def testFingerprintedCatalogRecordExistenceChecked(self):
+        """ Test that without a snapshot the fingerprinted CR is reused once MetaX confirms it exists """
+        dataset = self._dataset()
+        get_fingerprint_store().set('old', fingerprint(dataset), 'cr1', PREF_ID)
+        self.metax.add('cr1', PREF_ID)
+        actions.package_create(self.context, dataset)
+        eq_(self.metax.requests, [('HEAD', '/cr1')])
+        eq_(self._ckan_names(self.ckan_create), ['cr1'])
+
+    def testFingerprintedCatalogRecordMissingFromMetax(self):
+        """ Test that a dataset is created again if its fingerprinted CR has been deleted from MetaX """
+        dataset = self._dataset()
+        get_fingerprint_store().set('old', fingerprint(dataset), 'cr1', PREF_ID)
+        actions.package_create(self.context, dataset)
+        created = self.metax.find(PREF_ID)
+        ok_(created)
+        eq_(self._ckan_names(self.ckan_create), [created['identifier']])
+        eq_(get_fingerprint_store().get('old'), None)
+
+    def testFingerprintNotStoredIfPackageNotCreated(self):
+        """ Test that a dataset whose CKAN package could not be written is sent to MetaX again next time """
+        self.ckan_create.side_effect = Exception('create failed')
+        self.ckan_update.side_effect = Exception('update failed')
+        eq_(actions.package_create(self.context, self._dataset()), False)
+        ok_(self.metax.find(PREF_ID))
+        eq_(get_fingerprint_store().find_by_preferred_identifier(PREF_ID), None)
+
+
+class TestCreateCatalogRecord(HarvestActionTestCase):
+    """ Tests for how package_create handles each answer of MetaX to creating a CR """
+
+    def testCreated(self):
+        actions.package_create(self.context, self._dataset())
+        eq_(self.metax.requests, [('POST', '')])
+        eq_(self._ckan_names(self.ckan_create), [self.metax.find(PREF_ID)['identifier']])
+
+    def testConflictUpdatesExistingCatalogRecord(self):
+        """ Test that a CR whose preferred identifier is taken is PUT into the existing CR """
+        self.metax.add('cr7', PREF_ID)
+        actions.package_create(self.context, self._dataset())
+        eq_(self.metax.requests, [('POST', ''), ('GET', '?preferred_identifier=' + PREF_ID), ('PUT', '/cr7')])
+        eq_(self._ckan_names(self.ckan_create), ['cr7'])
+
+    def testConflictWithKnownIdentifier(self):
+        """ Test that the CR identifier is not looked up from MetaX when the fingerprint store knows it """
+        self.metax.add('cr7', PREF_ID)
+        get_fingerprint_store().set('old', 'changed since', 'cr7', PREF_ID)
+        actions.package_create(self.context, self._dataset())
+        eq_(self.metax.requests, [('POST', ''), ('PUT', '/cr7')])
+        eq_(self._ckan_names(self.ckan_create), ['cr7'])
+
+    def testIdentifierInSnapshot(self):
+        """ Test that a CR the snapshot already has is PUT right away, without trying to create it """
+        self.metax.add('cr7', PREF_ID)
+        self.snapshot = CatalogRecordSnapshot(DATA_CATALOG_ID)
+        self.snapshot.set(PREF_ID, 'cr7', None)
+        actions.package_create(self.context, self._dataset())
+        eq_(self.metax.requests, [('PUT', '/cr7')])
+        eq_(self._ckan_names(self.ckan_create), ['cr7'])
+
+    def testRejectedIsNotSentAgain(self):
+        """ Test that a CR rejected for its content is dropped without sending it again as an update """
+        self.metax.rejected.add(PREF_ID)
+        eq_(actions.package_create(self.context, self._dataset()), False)
+        eq_(self.metax.requests, [('POST', '')])
+        ok_(not self.ckan_create.called)
+        eq_(get_fingerprint_store().find_by_preferred_identifier(PREF_ID), None)
+
+    def testOtherErrorFallsBackToUpdate(self):
+        """ Test that a failed create of a CR that turns out to exist is PUT into the existing CR """
+        self.metax.post_error = 500
+        self.metax.add('cr7', PREF_ID)
+        actions.package_create(self.context, self._dataset())
+        eq_(self.metax.requests, [('POST', ''), ('GET', '?preferred_identifier=' + PREF_ID), ('PUT', '/cr7')])
+        eq_(self._ckan_names(self.ckan_create), ['cr7'])
+
+    def testOtherErrorWithoutExistingCatalogRecord(self):
+        self.metax.post_error = 503
+        eq_(actions.package_create(self.context, self._dataset()), False)
+        eq_(self.metax.requests, [('POST', ''), ('GET', '?preferred_identifier=' + PREF_ID)])
+        ok_(not self.ckan_create.called)
+
+    def testStaleIdentifierLookedUpAgain(self):
+        """ Test that a known CR identifier MetaX no longer has is looked up again after the PUT fails with 404 """
+        self.metax.add('cr7', PREF_ID)
+        self.snapshot = CatalogRecordSnapshot(DATA_CATALOG_ID)
+        self.snapshot.set(PREF_ID, 'cr1', None)
+        actions.package_create(self.context, self._dataset())
+        eq_(self.metax.requests, [('PUT', '/cr1'), ('GET', '?preferred_identifier=' + PREF_ID), ('PUT', '/cr7')])
+        eq_(self._ckan_names(self.ckan_create), ['cr7'])
+        eq_(self.snapshot.find_by_preferred_identifier(PREF_ID)[0], 'cr7')
+        eq_(self.snapshot.find_by_identifier('cr1'), None)
+
+
+class TestDeferredCreate(HarvestActionTestCase):
+    """ Tests for package_create with MetaX writes batched """
+
+    write_config = {'metax.batch_size': '10'}
+
+    def setUp(self):
+        super(TestDeferredCreate, self).setUp()
+        self.context['harvest_object'] = Mock(id='object1', harvest_job_id='job1')
+        self.harvest_object = Mock(id='object1', state='COMPLETE', current=True)
+        self.last_object = Mock(return_value=False)
+        self.session_add = Mock()
+        patches = [
+            patch.dict(actions.config, self.write_config),
+            patch('ckanext.etsin.actions._is_last_harvest_object', self.last_object),
+            patch('ckanext.harvest.model.HarvestObject.get', return_value=self.harvest_object),
+            patch('ckan.model.Session.add', self.session_add, create=True),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        actions._metax_write_batch = None
+        actions._metax_worker_pool = None
+        self.addCleanup(self._reset_writes)
+
+    def _reset_writes(self):
+        if actions._metax_worker_pool is not None:
+            actions._metax_worker_pool.close()
+        actions._metax_write_batch = None
+        actions._metax_worker_pool = None
+
+    def testDeferredCreateFlushedAndRenamed(self):
+        """ Test that a package created before its CR is renamed to the CR identifier when the batch is flushed """
+        package_id = actions.package_create(self.context, self._dataset())['id']
+        eq_(self._ckan_names(self.ckan_create), [package_id])
+        ok_(not self.ckan_update.called)
+        actions.flush_metax_writes()
+        created = self.metax.find(PREF_ID)
+        eq_(self.metax.requests, [('POST', '')])
+        eq_(self._ckan_names(self.ckan_update), [created['identifier']])
+        eq_(self.package_names.get(package_id), created['identifier'])
+        eq_(get_fingerprint_store().get(package_id), (fingerprint(self._dataset()), created['identifier']))
+
+    def testDeferredCreateRolledBack(self):
+        """ Test that a package created before its CR is deleted if MetaX rejects the CR """
+        self.metax.rejected.add(PREF_ID)
+        package_id = actions.package_create(self.context, self._dataset())['id']
+        actions.flush_metax_writes()
+        eq_(self.metax.requests, [('POST', '')])
+        eq_(self.ckan_delete.call_args[0][1], {'id': package_id})
+        ok_(not self.ckan_update.called)
+        eq_(self.package_names.get(package_id), None)
+        eq_(get_fingerprint_store().get(package_id), None)
+
+    def testRolledBackHarvestObjectImportedAgain(self):
+        """ Test that the harvest object of a rolled back package is reported failed and left for the next job """
+        self.metax.rejected.add(PREF_ID)
+        actions.package_create(self.context, self._dataset())
+        ok_(not self.session_add.called)
+        actions.flush_metax_writes()
+        eq_(self.harvest_object.state, 'ERROR')
+        eq_(self.harvest_object.current, False)
+        error = self.session_add.call_args[0][0]
+        eq_((error.object, error.stage), (self.harvest_object, 'Import'))
+
+    def testFailedUpdateReported(self):
+        """ Test that the harvest object of a dataset whose deferred CR update fails is reported failed """
+        dataset = self._dataset()
+        self._existing_package('pkg1', 'cr1', dataset)
+        self.metax.add('cr1', PREF_ID)
+        self.metax.rejected.add(PREF_ID)
+        actions.package_update(self.context, dict(dataset, id='pkg1', modified='2018-02-01T00:00:00'))
+        actions.flush_metax_writes()
+        eq_(self.metax.requests[-1][0], 'PUT')
+        eq_((self.harvest_object.state, self.harvest_object.current), ('ERROR', True))
+        eq_(self.session_add.call_args[0][0].stage, 'Import')
+
+    def testCreatedHarvestObjectLeftImported(self):
+        actions.package_create(self.context, self._dataset())
+        actions.flush_metax_writes()
+        eq_((self.harvest_object.state, self.harvest_object.current), ('COMPLETE', True))
+        ok_(not self.session_add.called)
+
+    def testDeferredCreateOfExistingCatalogRecord(self):
+        """ Test that a package whose CR already exists is renamed to the existing CR after updating it """
+        self.metax.add('cr9', PREF_ID)
+        package_id = actions.package_create(self.context, self._dataset())['id']
+        actions.flush_metax_writes()
+        eq_(self.metax.requests, [('POST', ''), ('GET', '?preferred_identifier=' + PREF_ID), ('PUT', '/cr9')])
+        eq_(self._ckan_names(self.ckan_update), ['cr9'])
+        eq_(self.package_names.get(package_id), 'cr9')
+
+    def testFlushedByLastHarvestObject(self):
+        """ Test that pending writes are finished before the action for the last harvest object of a job returns """
+        self.last_object.return_value = True
+        package_id = actions.package_create(self.context, self._dataset())['id']
+        created = self.metax.find(PREF_ID)
+        ok_(created)
+        eq_(self.package_names.get(package_id), created['identifier'])
+        ok_(not actions._has_pending_writes())
+
+    def testNotDeferredWithoutHarvestObject(self):
+        """ Test that a CR is created right away when there is no harvest object to flush the pending writes """
+        del self.context['harvest_object']
+        actions.package_create(self.context, self._dataset())
+        eq_(self._ckan_names(self.ckan_create), [self.metax.find(PREF_ID)['identifier']])
+        ok_(not actions._has_pending_writes())
+
+
+class TestDeferredCreateOnWorkers(TestDeferredCreate):
+    """ Tests for package_create with MetaX writes run on the worker pool """
+
+    write_config = {'metax.workers': '2'}
+
+    def testCallbacksRunByLaterAction(self):
+        """ Test that a finished create is handled by the next harvest action without waiting for the job end """
+        package_id = actions.package_create(self.context, self._dataset())['id']
+        pool = actions.get_metax_worker_pool()
+        for i in range(100):
+            if not pool._done.empty():
+                break
+            time.sleep(0.01)
+        ok_(not self.ckan_update.called)
+        actions.package_create(self.context, self._dataset(preferred_identifier='urn:nbn:fi:csc-test-2'))
+        eq_(self.package_names.get(package_id), self.metax.find(PREF_ID)['identifier'])
+        actions.flush_metax_writes()
+        eq_(len(pool), 0)
+
+
+class TestIsHarvestUser(TestCase):
+
+    def setUp(self):
+        actions._forget_harvest_user(None, None, None)
+        self.addCleanup(actions._forget_harvest_user, None, None, None)
+        self.get_user = Mock(return_value=Mock(id='harvest-user-id'))
+        user_patch = patch('ckan.model.User.get', self.get_user)
+        user_patch.start()
+        self.addCleanup(user_patch.stop)
+
+    def testUserName(self):
+        """ Test that the harvest user name is recognized without querying the user table """
+        ok_(actions._is_harvest_user({'user': 'harvest'}))
+        ok_(not self.get_user.called)
+
+    def testUserIdCached(self):
+        """ Test that the id of the harvest user is looked up once """
+        ok_(actions._is_harvest_user({'user': 'harvest-user-id'}))
+        ok_(not actions._is_harvest_user({'user': 'other-user-id'}))
+        eq_(self.get_user.call_count, 1)
+        self.get_user.assert_called_with('harvest')
+
+    def testUserChangeForgetsId(self):
+        """ Test that the harvest user is looked up again after a user has been inserted, updated or deleted """
+        actions._is_harvest_user({'user': 'harvest-user-id'})
+        self.get_user.return_value = Mock(id='new-harvest-user-id')
+        actions._forget_harvest_user(None, None, Mock())
+        ok_(actions._is_harvest_user({'user': 'new-harvest-user-id'}))
+        ok_(not actions._is_harvest_user({'user': 'harvest-user-id'}))
+        eq_(self.get_user.call_count, 2)
+
+    def testWithoutUser(self):
+        ok_(not actions._is_harvest_user({}))
+        ok_(not actions._is_harvest_user({'user': None}))
+        ok_(not self.get_user.called)
+
+    def testUnknownUser(self):
+        """ Test that without a harvest user no user is the harvest user, and the user table is queried once """
+        self.get_user.return_value = None
+        ok_(not actions._is_harvest_user({'user': 'someone'}))
+        ok_(not actions._is_harvest_user({'user': 'someone-else'}))
+        eq_(self.get_user.call_count, 1)
+
+
+class TestLastHarvestObject(TestCase):
+
+    def _is_last(self, waiting):
+        query = Mock()
+        query.filter.return_value = query
+        query.first.return_value = waiting
+        with patch('ckan.model.Session.query', return_value=query):
+            return actions._is_last_harvest_object({'harvest_object': Mock(id='object1', harvest_job_id='job1')})
+
+    def testOtherObjectsWaiting(self):
+        eq_(self._is_last(('object2',)), False)
+
+    def testNoOtherObjectsWaiting(self):
+        eq_(self._is_last(None), True)
+
+    def testWithoutHarvestObject(self):
+        eq_(actions._is_last_harvest_object({}), True)
+
+
+class TestPackageCommitsAndIndexing(HarvestActionTestCase):
+    """ Tests for leaving package commits to the harvester and indexing packages in chunks """
+
+    def setUp(self):
+        super(TestPackageCommitsAndIndexing, self).setUp()
+        self.context['harvest_object'] = Mock(id='object1', harvest_job_id='job1')
+        self.commit = Mock()
+        self.indexed = []
+        patches = [
+            patch.dict(actions.config, {'metax.defer_package_commits': 'true', 'metax.package_index_batch_size': '2',
+                                        'ckan.search.automatic_indexing': 'false'}),
+            patch('ckan.model.repo.commit', self.commit),
+            patch('ckanext.etsin.actions._is_last_harvest_object', return_value=False),
+            patch('ckanext.etsin.actions._index_packages', side_effect=lambda ids: self.indexed.append(list(ids))),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        actions._package_index_batch = None
+        self.addCleanup(setattr, actions, '_package_index_batch', None)
+
+    def _create(self, n):
+        return actions.package_create(self.context, self._dataset(preferred_identifier='urn:nbn:fi:csc-test-%d' % n))
+
+    def testPackageCommittedWithHarvestObject(self):
+        """ Test that a harvested package is not committed by itself but by the harvester with its harvest object """
+        self._create(1)
+        ok_(self.ckan_create.call_args[0][0]['defer_commit'])
+        ok_(not self.commit.called)
+
+    def testPackageCommittedByItselfByDefault(self):
+        """ Test that without metax.defer_package_commits CKAN commits the package as usual """
+        actions.config['metax.defer_package_commits'] = 'false'
+        self._create(1)
+        ok_('defer_commit' not in self.ckan_create.call_args[0][0])
+
+    def testPackagesIndexedInChunks(self):
+        """ Test that packages are indexed a chunk at a time on later actions, and the rest at the end of the job """
+        ids = [self._create(n)['id'] for n in range(1, 4)]
+        eq_(self.indexed, [ids[:2]])
+        actions.flush_metax_writes()
+        eq_(self.indexed, [ids[:2], ids[2:]])
+
+    def testNoIndexingWithAutomaticIndexing(self):
+        """ Test that packages are left for CKAN to index when automatic indexing is enabled """
+        actions.config['ckan.search.automatic_indexing'] = 'true'
+        self._create(1)
+        actions.flush_metax_writes()
+        eq_(self.indexed, [])
+        eq_(actions.get_package_index_batch(), None)
+
+    def testDeferredCreatesCommittedAtJobEnd(self):
+        """ Test that packages written by the job end flush are committed before they are indexed """
+        actions.config['metax.batch_size'] = '10'
+        actions._metax_write_batch = None
+        self.addCleanup(setattr, actions, '_metax_write_batch', None)
+        self.commit.side_effect = lambda: self.indexed.append('commit')
+        package_id = self._create(1)['id']
+        ok_(not self.commit.called)
+        actions.flush_metax_writes()
+        eq_(self.indexed, ['commit', [package_id]])
+
+
+class TestPackageUpdate(HarvestActionTestCase):
+
+    def testUnchangedDatasetConfirmedBySnapshot(self):
+        """ Test that an unchanged dataset whose CR is in the catalog record snapshot is skipped without requests """
+        dataset = self._dataset()
+        self._existing_package('pkg1', 'cr1', dataset)
+        self.metax.add('cr1', PREF_ID)
+        self.snapshot = CatalogRecordSnapshot(DATA_CATALOG_ID)
+        self.snapshot.set(PREF_ID, 'cr1', 'changed since')
+        eq_(actions.package_update(self.context, dict(dataset, id='pkg1')), False)
+        eq_(self.metax.requests, [])
+        ok_(not self.ckan_update.called)
+
+    def testUnchangedDatasetExistenceChecked(self):
+        """ Test that without a snapshot an unchanged dataset is skipped after one request confirming its CR """
+        dataset = self._dataset()
+        self._existing_package('pkg1', 'cr1', dataset)
+        self.metax.add('cr1', PREF_ID, modified='changed since')
+        eq_(actions.package_update(self.context, dict(dataset, id='pkg1')), False)
+        eq_(self.metax.requests, [('GET', '/cr1')])
+
+    def testUnchangedDatasetRecreatedWhenMissingFromMetax(self):
+        """ Test that an unchanged dataset whose CR has been deleted from MetaX is created again """
+        dataset = self._dataset()
+        self._existing_package('pkg1', 'cr1', dataset)
+        actions.package_update(self.context, dict(dataset, id='pkg1'))
+        created = self.metax.find(PREF_ID)
+        ok_(created)
+        eq_(self._ckan_names(self.ckan_update), [created['identifier']])
+        eq_(get_fingerprint_store().get('pkg1'), (fingerprint(dataset), created['identifier']))
+
+
+class TestLoadPackageNames(TestCase):
+    """ Tests for resolving the harvest source whose package names are loaded """
+
+    def setUp(self):
+        self.names = [('pkg1', 'cr1')]
+        self.session = Mock()
+        source_query = self.session.query.return_value.filter.return_value.filter.return_value
+        source_query.first.return_value = Mock(id='source-by-name')
+        names_query = self.session.query.return_value.join.return_value.filter.return_value.filter.return_value
+        names_query.distinct.return_value.all.return_value = self.names
+        session_patch = patch('ckan.model.Session', self.session)
+        session_patch.start()
+        self.addCleanup(session_patch.stop)
+
+    def testSourceFromHarvestObject(self):
+        """ Test that the harvest source of the harvest object is used without looking the source up by name """
+        context = {'harvest_source_name': 'Source title', 'harvest_object': Mock(harvest_source_id='source1')}
+        eq_(actions._get_harvest_source_id(context), 'source1')
+        eq_(actions._load_package_names(context), self.names)
+        eq_(self.session.query.call_count, 1)
+
+    def testSourceFromHarvestJob(self):
+        context = {'harvest_source_name': 'Source title', 'harvest_job': Mock(source_id='source2')}
+        eq_(actions._get_harvest_source_id(context), 'source2')
+        ok_(not self.session.query.called)
+
+    def testSourceByName(self):
+        eq_(actions._get_harvest_source_id({'harvest_source_name': 'syke'}), 'source-by-name')
+
+    def testUnresolvedSource(self):
+        """ Test that an unresolved harvest source is logged and package names are then looked up one at a time """
+        self.session.query.return_value.filter.return_value.filter.return_value.first.return_value = None
+        with patch('ckanext.etsin.actions.log') as mock_log:
+            eq_(actions._load_package_names({'harvest_source_name': 'Source title'}), [])
+            ok_(mock_log.warning.called)
+        eq_(self.session.query.call_count, 1)
+
 
 class TestActions(TestCase):
     """ Tests for actions.py """
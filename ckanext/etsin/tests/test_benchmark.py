@@ -0,0 +1,43 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for benchmark.py"""
+import unittest
+from unittest import TestCase
+
+from nose.tools import eq_, ok_
+
+from .benchmark import run_benchmark, compare_to_baseline, _percentile
+
+
+class TestBenchmark(TestCase):
+
+    def testRunsOffline(self):
+        results = run_benchmark(3)
+        eq_(sorted(results['sources']), ['datacite', 'fsd', 'kielipankki', 'syke'])
+        for source_name, result in results['sources'].items():
+            eq_(result['records'], 3)
+            ok_('map' in result['stages'], source_name)
+        ok_('refine' not in results['sources']['datacite']['stages'])
+        ok_('refine' in results['sources']['fsd']['stages'])
+
+    def testPercentile(self):
+        values = range(1, 101)
+        eq_(_percentile(values, 50), 50)
+        eq_(_percentile(values, 99), 99)
+        eq_(_percentile([7], 90), 7)
+
+    def testCompareToBaseline(self):
+        results = {'sources': {'fsd': {'records_per_second': 70.0}, 'syke': {'records_per_second': 100.0}}}
+        baseline = {'sources': {'fsd': {'records_per_second': 100.0}, 'syke': {'records_per_second': 110.0}}}
+        eq_(len(compare_to_baseline(results, baseline, 0.2)), 1)
+        eq_(compare_to_baseline(results, baseline, 0.5), [])
+        eq_(compare_to_baseline(results, {}, 0.2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
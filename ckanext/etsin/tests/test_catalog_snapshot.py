@@ -0,0 +1,56 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for catalog_snapshot.py"""
+import unittest
+from unittest import TestCase
+
+from nose.tools import ok_, eq_
+
+from ckanext.etsin.catalog_snapshot import CatalogRecordSnapshot
+
+
+class TestCatalogRecordSnapshot(TestCase):
+
+    RECORDS = [
+        {'identifier': 'cr1', 'research_dataset': {'preferred_identifier': 'urn:1', 'modified': '2017-01-01'}},
+        {'identifier': 'cr2', 'research_dataset': {'preferred_identifier': 'urn:2'}},
+        {'identifier': 'cr3'},
+    ]
+
+    def testLookups(self):
+        snapshot = CatalogRecordSnapshot('dc', self.RECORDS)
+        eq_(len(snapshot), 2)
+        eq_(snapshot.find_by_preferred_identifier('urn:1'), ('cr1', '2017-01-01'))
+        eq_(snapshot.find_by_preferred_identifier('urn:2'), ('cr2', None))
+        eq_(snapshot.find_by_identifier('cr1'), ('urn:1', '2017-01-01'))
+        eq_(snapshot.find_by_identifier('cr3'), None)
+        eq_(snapshot.find_by_preferred_identifier('urn:3'), None)
+
+    def testOwnWritesAreRemembered(self):
+        snapshot = CatalogRecordSnapshot('dc', self.RECORDS)
+        snapshot.set('urn:1', 'cr1', '2018-01-01')
+        eq_(snapshot.find_by_identifier('cr1'), ('urn:1', '2018-01-01'))
+        snapshot.set('urn:3', 'cr3', None)
+        eq_(snapshot.find_by_preferred_identifier('urn:3'), ('cr3', None))
+        snapshot.remove('cr1')
+        eq_(snapshot.find_by_preferred_identifier('urn:1'), None)
+        eq_(snapshot.find_by_identifier('cr1'), None)
+
+    def testChangedPreferredIdentifier(self):
+        snapshot = CatalogRecordSnapshot('dc', self.RECORDS)
+        snapshot.set('urn:1b', 'cr1', None)
+        eq_(snapshot.find_by_preferred_identifier('urn:1'), None)
+        eq_(snapshot.find_by_preferred_identifier('urn:1b'), ('cr1', None))
+
+    def testExpiry(self):
+        ok_(not CatalogRecordSnapshot('dc').expired())
+        ok_(CatalogRecordSnapshot('dc', max_age=-1).expired())
+
+
+if __name__ == '__main__':
+    unittest.main()
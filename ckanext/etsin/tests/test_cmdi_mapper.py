@@ -5,6 +5,9 @@
 # :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
 # :license: GNU Affero General Public License version 3
 
+from lxml import etree
+
+from ckanext.etsin.cmdi_parse_helper import CmdiParseHelper, get_cmdi_parse_helper
 from ckanext.etsin.mappers.cmdi import cmdi_mapper
 import pprint
 import unittest
@@ -115,6 +118,33 @@ class TestCmdiMapper(TestCase):
         } in self.metax_dict['curator']
 
 
+class TestCmdiParseHelperSharing(TestCase):
+
+    def testSameRecordSharesHelper(self):
+        xml = _get_file_as_lxml('kielipankki_cmdi/cmdi_record_example.xml')
+        helper = get_cmdi_parse_helper(xml)
+        assert get_cmdi_parse_helper(xml) is helper
+        other = _get_file_as_lxml('kielipankki_cmdi/cmdi_record_example.xml')
+        assert get_cmdi_parse_helper(other) is not helper
+
+    def testExtractedFieldsAreMemoized(self):
+        helper = get_cmdi_parse_helper(_get_file_as_lxml('kielipankki_cmdi/cmdi_record_example.xml'))
+        identifiers = helper.parse_metadata_identifiers()
+        identifiers.append('modified by caller')
+        assert helper.parse_metadata_identifiers() == identifiers[:-1]
+        assert 'parse_metadata_identifiers' in helper._fields
+
+    def testCorpusInfoInResourceComponentType(self):
+        xml = _get_file_as_lxml('kielipankki_cmdi/cmdi_record_example.xml')
+        languages = get_cmdi_parse_helper(xml).parse_dataset_languages()
+        resource_info = get_cmdi_parse_helper(xml).resource_info
+        corpus_info = resource_info.find('cmd:corpusInfo', namespaces=CmdiParseHelper.namespaces)
+        wrapper = etree.SubElement(resource_info, '{http://www.clarin.eu/cmd/}resourceComponentType')
+        wrapper.append(corpus_info)
+        assert languages
+        assert CmdiParseHelper(xml).parse_dataset_languages() == languages
+
+
 if __name__ == '__main__':
     import logging
     logging.basicConfig(level=logging.DEBUG)
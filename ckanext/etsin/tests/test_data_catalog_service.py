@@ -0,0 +1,76 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for data_catalog_service.py"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+from mock import patch
+from nose.tools import ok_, eq_
+
+from ckanext.etsin.data_catalog_service import DataCatalogRegistry, data_catalogs, \
+    get_data_catalog_id_for_harvest_source
+
+
+class TestDataCatalogRegistry(TestCase):
+
+    def setUp(self):
+        self.resources_path = tempfile.mkdtemp() + '/'
+        self.registry = DataCatalogRegistry(self.resources_path)
+        self._write('test_data_catalog.json', {'catalog_json': {'identifier': 'urn:catalog:1', 'title': ['a']}})
+
+    def tearDown(self):
+        shutil.rmtree(self.resources_path)
+
+    def _write(self, filename, content, mtime=None):
+        file_path = self.resources_path + filename
+        with open(file_path, 'w') as f:
+            f.write(content if isinstance(content, str) else json.dumps(content))
+        if mtime:
+            os.utime(file_path, (mtime, mtime))
+
+    def testCatalogIsParsedOnce(self):
+        with patch('json.load', side_effect=json.load) as mock_load:
+            catalog = self.registry.get('test_data_catalog.json')
+            ok_(self.registry.get('test_data_catalog.json') is catalog)
+            eq_(mock_load.call_count, 1)
+        eq_(self.registry.get_identifier('test_data_catalog.json'), 'urn:catalog:1')
+
+    def testCatalogIsReadOnly(self):
+        catalog = self.registry.get('test_data_catalog.json')
+        with self.assertRaises(TypeError):
+            catalog['catalog_json']['identifier'] = 'changed'
+        eq_(json.loads(json.dumps(catalog))['catalog_json']['title'], ['a'])
+
+    def testReloadOnModification(self):
+        file_path = self.resources_path + 'test_data_catalog.json'
+        self.registry.get('test_data_catalog.json')
+        self._write('test_data_catalog.json', {'catalog_json': {'identifier': 'urn:catalog:2'}},
+                    mtime=os.path.getmtime(file_path) + 10)
+        eq_(self.registry.get_identifier('test_data_catalog.json'), 'urn:catalog:2')
+
+    def testValidate(self):
+        self._write('broken_data_catalog.json', '{"catalog_json": ')
+        self._write('no_id_data_catalog.json', {'catalog_json': {}})
+        ok_(self.registry.validate(['test_data_catalog.json']))
+        ok_(not self.registry.validate(['test_data_catalog.json', 'broken_data_catalog.json']))
+        ok_(not self.registry.validate(['no_id_data_catalog.json']))
+        ok_(not self.registry.validate(['missing_data_catalog.json']))
+
+    def testHarvestSourceCatalogs(self):
+        ok_(data_catalogs.validate())
+        eq_(get_data_catalog_id_for_harvest_source('fsd'),
+            data_catalogs.get('fsd_data_catalog.json')['catalog_json']['identifier'])
+        eq_(get_data_catalog_id_for_harvest_source('unknown'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,13 +7,14 @@
 
 """Tests for mappers/datacite.py."""
 
-from nose.tools import eq_
+from lxml import etree
+from nose.tools import eq_, ok_
 from unittest import TestCase
 
 from ckanext.etsin.mappers.datacite import datacite_mapper
 from ckanext.harvest.model import HarvestObject
 
-from .helpers import _get_file_as_lxml
+from .helpers import _get_file_as_lxml, _get_file_as_string
 
 
 class TestMappersDataCite(TestCase):
@@ -103,3 +104,68 @@ class TestMappersDataCite(TestCase):
     # TODO: current test file doesn't have location
     def testLocation(self):
         pass
+
+    def testSourceTreeUnchanged(self):
+        xml = _get_file_as_lxml('datacite/datacite1.xml')
+        before = etree.tostring(xml)
+        datacite_mapper(xml)
+        eq_(etree.tostring(xml), before)
+
+    def testDefaultNamespace(self):
+        # Zenodo uses the DataCite namespace as the default namespace instead of a prefix
+        xml = etree.fromstring(_get_file_as_string('datacite/datacite1.xml')
+                               .replace('xmlns:datacite=', 'xmlns=').replace('datacite:', ''))
+        eq_(datacite_mapper(xml), self.metax_dict)
+
+
+class TestMappersDataCite4(TestCase):
+
+    @classmethod
+    def setup_class(cls):
+        cls.metax_dict = datacite_mapper(
+            _get_file_as_lxml('datacite/datacite2.xml'))['research_dataset']
+
+    def testPreferredIdentifier(self):
+        eq_(self.metax_dict['preferred_identifier'], 'https://dx.doi.org/10.5281/zenodo.1234567')
+
+    def testCreator(self):
+        eq_(self.metax_dict['creator'], [{
+            '@type': 'Person',
+            'name': 'Virtanen, Maija',
+            'identifier': 'https://orcid.org/0000-0002-1825-0097',
+            'member_of': {'@type': 'Organization', 'name': {'und': 'University of Helsinki'}}}])
+
+    def testLanguage(self):
+        eq_(self.metax_dict['language'], [{'identifier': 'http://lexvo.org/id/iso639-3/eng'}])
+
+    def testTitle(self):
+        # The alternative title listed first is not the primary title
+        eq_(self.metax_dict['title'], {'en': 'Ice cover observations of Finnish lakes'})
+
+    def testDescription(self):
+        eq_(self.metax_dict['description'], [{'en': 'Abstract: Freezing and break-up dates of lakes. '}])
+
+    def testContributor(self):
+        eq_(self.metax_dict['curator'], [{'@type': 'Person', 'name': 'Korhonen, Matti'}])
+        eq_(self.metax_dict['contributor'], [{'@type': 'Person', 'name': 'Nieminen, Liisa'}])
+        eq_(self.metax_dict['rights_holder'], [{'@type': 'Person', 'name': 'Finnish Environment Institute'}])
+        eq_(self.metax_dict['publisher'], [{'name': 'Zenodo'}])
+
+    def testLocation(self):
+        eq_(self.metax_dict['location'], [
+            {'as_wkt': 'POINT (27.78 62.89)'},
+            {'geographic_name': 'Lake Kallavesi'},
+            {'as_wkt': 'POLYGON ((20.5 59.8, 20.5 70.1, 31.6 70.1, 31.6 59.8, 20.5 59.8))'},
+            {'as_wkt': 'POLYGON ((24.0 60.0, 25.0 60.0, 25.0 61.0, 24.0 60.0))'}])
+
+
+class TestMappersDataCite3Location(TestCase):
+
+    def testLocation(self):
+        # DataCite 3 has the coordinates as text, latitude first
+        metax_dict = datacite_mapper(_get_file_as_lxml('datacite/datacite3.xml'))['research_dataset']
+        eq_(metax_dict['location'], [
+            {'as_wkt': 'POINT (27.78 62.89)'},
+            {'as_wkt': 'POLYGON ((20.5 59.8, 20.5 70.1, 31.6 70.1, 31.6 59.8, 20.5 59.8))'}])
+        eq_(metax_dict['language'], [{'identifier': 'http://lexvo.org/id/iso639-3/fin'}])
+        eq_(metax_dict['title'], {'fi': 'Ice cover observations of Lake Kallavesi'})
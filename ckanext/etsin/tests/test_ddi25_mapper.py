@@ -11,6 +11,7 @@
 import pprint
 from unittest import TestCase
 
+from ckanext.etsin.ddi_record import get_ddi_record, DdiRecord
 from ckanext.etsin.mappers.ddi25 import ddi25_mapper
 
 from .helpers import _get_file_as_lxml
@@ -81,4 +82,25 @@ class TestMappersDDI25(TestCase):
 
     def testSpatialCoverage(self):
         assert self.metax_dict['spatial'][0]['geographic_name'] == 'Finland'
-        assert self.metax_dict['spatial'][0]['place_uri']['identifier'] == 'p94426'
\ No newline at end of file
+        assert self.metax_dict['spatial'][0]['place_uri']['identifier'] == 'p94426'
+
+class TestDdiRecordSharing(TestCase):
+
+    def testSameRecordSharesView(self):
+        xml = _get_file_as_lxml('ddi25/ddi25_1.xml')
+        ddi = get_ddi_record(xml)
+        assert get_ddi_record(xml) is ddi
+        assert get_ddi_record(_get_file_as_lxml('ddi25/ddi25_1.xml')) is not ddi
+
+    def testSectionsAreMemoized(self):
+        ddi = get_ddi_record(_get_file_as_lxml('ddi25/ddi25_1.xml'))
+        citations = ddi.citations()
+        citations.append('modified by caller')
+        assert ddi.citations() == citations[:-1]
+        assert 'citations' in ddi._fields
+
+    def testSectionPathsMatchFullPaths(self):
+        ddi = DdiRecord(_get_file_as_lxml('ddi25/ddi25_1.xml'))
+        full = ddi.stdy.findall('ddi:stdyInfo/ddi:sumDscr/ddi:nation', {'ddi': 'ddi:codebook:2_5'})
+        assert full
+        assert ddi.findall(ddi.sum_dscrs(), 'ddi:nation') == full
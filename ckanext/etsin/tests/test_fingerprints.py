@@ -0,0 +1,104 @@
+# coding=UTF8
+#
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for fingerprints.py"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+from nose.tools import ok_, eq_
+
+from ckanext.etsin.fingerprints import fingerprint, FingerprintStore, SqliteFingerprintStore
+
+
+class TestFingerprint(TestCase):
+
+    def testCanonical(self):
+        a = {'title': {'fi': 'Ty\xc3\xb6', 'en': 'Work'}, 'keyword': ('a', 'b')}
+        b = {'keyword': [u'a', u'b'], 'title': {u'en': u'Work', u'fi': u'Ty\xf6'}}
+        eq_(fingerprint(a), fingerprint(b))
+        ok_(fingerprint(a) != fingerprint({'title': {'fi': 'Ty\xc3\xb6'}, 'keyword': ['a', 'b']}))
+
+    def testUnserializable(self):
+        eq_(fingerprint({'title': object()}), None)
+
+
+class TestFingerprintStore(TestCase):
+
+    def _create_store(self, max_age=None):
+        return FingerprintStore(max_age=max_age)
+
+    def testStore(self):
+        store = self._create_store()
+        ok_(not store.is_unchanged('pkg', 'abc'))
+        store.set('pkg', 'abc', 'cr1')
+        ok_(store.is_unchanged('pkg', 'abc'))
+        ok_(not store.is_unchanged('pkg', 'def'))
+        eq_(store.get('pkg'), ('abc', 'cr1'))
+        store.delete('pkg')
+        eq_(store.get('pkg'), None)
+
+    def testMissingFingerprintIsNeverUnchanged(self):
+        store = self._create_store()
+        store.set('pkg', None, 'cr1')
+        ok_(not store.is_unchanged('pkg', None))
+
+    def testFindByPreferredIdentifier(self):
+        store = self._create_store()
+        store.set('pkg1', 'abc', 'cr1', 'urn:nbn:fi:fsd:T-FSD3092')
+        eq_(store.find_by_preferred_identifier('urn:nbn:fi:fsd:T-FSD3092'), ('pkg1', 'abc', 'cr1'))
+        # The preferred identifier moves to the package stored last
+        store.set('pkg2', 'def', 'cr1', 'urn:nbn:fi:fsd:T-FSD3092')
+        eq_(store.find_by_preferred_identifier('urn:nbn:fi:fsd:T-FSD3092'), ('pkg2', 'def', 'cr1'))
+        eq_(store.get('pkg1'), None)
+        store.delete('pkg2')
+        eq_(store.find_by_preferred_identifier('urn:nbn:fi:fsd:T-FSD3092'), None)
+
+    def testClear(self):
+        store = self._create_store()
+        store.set('pkg', 'abc', 'cr1', 'urn:1')
+        store.clear()
+        eq_(store.get('pkg'), None)
+        eq_(store.find_by_preferred_identifier('urn:1'), None)
+
+    def testMaxAge(self):
+        store = self._create_store(max_age=-1)
+        store.set('pkg', 'abc', 'cr1', 'urn:1')
+        eq_(store.get('pkg'), None)
+        eq_(store.find_by_preferred_identifier('urn:1'), None)
+        ok_(not store.is_unchanged('pkg', 'abc'))
+        store.max_age = 3600
+        eq_(store.get('pkg'), ('abc', 'cr1'))
+
+
+class TestSqliteFingerprintStore(TestFingerprintStore):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'fingerprints.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _create_store(self, max_age=None):
+        return SqliteFingerprintStore(self.db_path, max_age=max_age)
+
+    def testPersistence(self):
+        store = self._create_store()
+        store.set('pkg', 'abc', 'cr1', 'urn:1')
+        store.close()
+        store = self._create_store()
+        ok_(store.is_unchanged('pkg', 'abc'))
+        eq_(store.find_by_preferred_identifier('urn:1'), ('pkg', 'abc', 'cr1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -45,3 +45,21 @@ class TestMappersISO19139(TestCase):
         eq_('2001-01-01T23:59:59-00:00', dict['temporal'][0]['end_date'])
         eq_('2017-06-06T00:00:00-00:00', dict['modified'])
         self.assertDictEqual(dict['provenance'][0], {'description': {'fi': 'provenance'}})
+
+    def testOrganisationWithSeveralRoles(self):
+        data_dict = get_iso_values_dict_1()
+        data_dict['iso_values']['responsible-organisation'].append(
+            {'organisation-name': 'moni', 'role': ['user', 'processor', 'author', 'distributor']})
+        dict = iso_19139_mapper({}, data_dict)
+        moni = {'@type': 'Organization', 'name': {'fi': 'moni'}}
+        eq_(dict['contributor'], [{'@type': 'Organization', 'email': 'jotainmuuta@testi.fi',
+                                   'name': {'fi': 'jotainmuuta'}}, moni])
+        eq_(dict['creator'][0], moni)
+        eq_(dict['publisher']['name'], {'fi': 'jakelija'})
+
+    def testFieldOfScienceFromTopicCategory(self):
+        data_dict = get_iso_values_dict_1()
+        data_dict['iso_values']['topic-category'] = ['farming', 'economy']
+        eq_(iso_19139_mapper({}, data_dict)['field_of_science'], [{'identifier': 'ta412'}, {'identifier': 'ta4111'}])
+        data_dict['iso_values']['topic-category'] = ['oceans']
+        eq_(iso_19139_mapper({}, data_dict)['field_of_science'], [])
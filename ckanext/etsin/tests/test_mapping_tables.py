@@ -0,0 +1,66 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for mapping_tables.py"""
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+
+from nose.tools import ok_, eq_
+
+from ckanext.etsin.mapping_tables import MappingTable, MappingTableRegistry
+from ckanext.etsin.utils import get_kata_identifier_from_mapping_file, search_pid_exists_in_mapping_file
+
+FSD_MAPPING_FILE = os.path.join(os.path.dirname(__file__), '..', 'refiners', 'resources', 'fsd_pid_to_kata_urn.csv')
+
+
+class TestMappingTable(TestCase):
+
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        self._write('a,urn:1\nb,urn:2\na,urn:3\n\n')
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def _write(self, content, mtime=None):
+        with open(self.file_path, 'w') as f:
+            f.write(content)
+        if mtime:
+            os.utime(self.file_path, (mtime, mtime))
+
+    def testLookup(self):
+        table = MappingTable(self.file_path)
+        eq_(table.lookup('a'), ['a', 'urn:1'])
+        eq_(table.lookup('missing'), None)
+        ok_(table.exists('b'))
+        eq_(len(table), 2)
+
+    def testReloadOnModification(self):
+        table = MappingTable(self.file_path)
+        ok_(not table.exists('c'))
+        self._write('c,urn:4\n', mtime=os.path.getmtime(self.file_path) + 10)
+        ok_(table.exists('c'))
+        ok_(not table.exists('a'))
+
+    def testRegistrySharesTables(self):
+        registry = MappingTableRegistry()
+        ok_(registry.get(self.file_path) is registry.get(os.path.join(os.path.dirname(self.file_path), '.',
+                                                                      os.path.basename(self.file_path))))
+        eq_(registry.lookup(self.file_path, 'b'), ['b', 'urn:2'])
+
+    def testUtilsFunctions(self):
+        eq_(get_kata_identifier_from_mapping_file(FSD_MAPPING_FILE, 'urn:nbn:fi:fsd:T-FSD0115'),
+            'urn:nbn:fi:csc-kata20141222154603240273')
+        ok_(search_pid_exists_in_mapping_file(FSD_MAPPING_FILE, 'urn:nbn:fi:fsd:T-FSD0116'))
+        ok_(not search_pid_exists_in_mapping_file(FSD_MAPPING_FILE, 'urn:nbn:fi:fsd:T-FSD0000'))
+
+
+if __name__ == '__main__':
+    unittest.main()
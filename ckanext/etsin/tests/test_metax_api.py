@@ -7,18 +7,21 @@
 
 """Basic tests for checking that metax_api.py works"""
 import ckanext.etsin.metax_api as api
+from ckanext.etsin.reference_data import ReferenceDataSnapshot
 import unittest
 from unittest import TestCase
 
 from mock import Mock, patch
 from nose.tools import ok_, eq_
+from requests import HTTPError
 
 
 class TestMetaxAPI(TestCase):
 
     def testCreateDatasetSuccess(self):
         ''' Test that create_catalog_record returns identifier on successful get request '''
-        with patch('requests.post') as mock_post:
+        with patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+            mock_post = mock_client.return_value.post
             mock_post.return_value = Mock()
             mock_post.return_value.text = '{"identifier": "123"}'
             mock_post.return_value.json.return_value = {'identifier': '123'}
@@ -29,7 +32,8 @@ class TestMetaxAPI(TestCase):
 
     def testReplaceDatasetSuccess(self):
         ''' Test that update_catalog_record does a put request and checks for http errors '''
-        with patch('requests.put') as mock_put:
+        with patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+            mock_put = mock_client.return_value.put
             mock_put.return_value = Mock()
             api.update_catalog_record('123', {})
             ok_(mock_put.called)
@@ -37,12 +41,169 @@ class TestMetaxAPI(TestCase):
 
     def testDeleteDatasetSuccess(self):
         ''' Test that delete_catalog_record does a delete request and checks for http errors '''
-        with patch('requests.delete') as mock_delete:
+        with patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+            mock_delete = mock_client.return_value.delete
             mock_delete.return_value = Mock()
             api.delete_catalog_record('123')
             ok_(mock_delete.called)
             ok_(mock_delete.return_value.raise_for_status.called)
 
+    def testGetCatalogRecordModified(self):
+        ''' Test that existence and modified value are read with a single GET request '''
+        with patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+            mock_get = mock_client.return_value.get
+            mock_get.return_value.status_code = 200
+            mock_get.return_value.text = '{"research_dataset": {"modified": "2016-05-31T00:00:00-00:00"}}'
+            eq_(api.get_catalog_record_modified('123'), (True, '2016-05-31T00:00:00-00:00'))
+            eq_(mock_get.call_count, 1)
+            ok_(not mock_client.return_value.head.called)
+
+            mock_get.return_value.status_code = 404
+            eq_(api.get_catalog_record_modified('123'), (False, None))
+
+    def testBulkCreate(self):
+        ''' Test that create_catalog_records posts a list and returns successes and failures, also on status 400 '''
+        with patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+            mock_post = mock_client.return_value.post
+            mock_post.return_value.status_code = 400
+            mock_post.return_value.json.return_value = {'success': [], 'failed': [{'object': {}, 'errors': {'a': ['b']}}]}
+            success, failed = api.create_catalog_records([{}])
+            eq_(mock_post.call_count, 1)
+            eq_(success, [])
+            eq_(failed[0]['errors'], {'a': ['b']})
+            ok_(not mock_post.return_value.raise_for_status.called)
+
+    def testGetRefDataIsCached(self):
+        ''' Test that repeated get_ref_data lookups only query MetaX once '''
+        api.invalidate_ref_data_cache()
+        with patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+            mock_get = mock_client.return_value.get
+            mock_get.return_value.text = '{"hits": {"hits": [{"_source": {"code": "ta5"}}]}}'
+            eq_(api.get_ref_data('field_of_science', 'label.fi', 'Talous', 'code'), 'ta5')
+            eq_(api.get_ref_data('field_of_science', 'label.fi', 'Talous', 'code'), 'ta5')
+            eq_(mock_get.call_count, 1)
+        api.invalidate_ref_data_cache()
+
+    def testGetRefDataErrorIsNotCached(self):
+        ''' Test that an error response is not cached as a lookup without a match '''
+        api.invalidate_ref_data_cache()
+        with patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+            mock_get = mock_client.return_value.get
+            mock_get.return_value.text = '{"error": {"type": "search_phase_execution_exception"}, "status": 503}'
+            mock_get.return_value.raise_for_status.side_effect = HTTPError('503 Server Error')
+            eq_(api.get_ref_data('field_of_science', 'label.fi', 'Talous', 'code'), None)
+
+            mock_get.return_value.raise_for_status.side_effect = None
+            mock_get.return_value.text = '{"hits": {"hits": [{"_source": {"code": "ta5"}}]}}'
+            eq_(api.get_ref_data('field_of_science', 'label.fi', 'Talous', 'code'), 'ta5')
+            eq_(mock_get.call_count, 2)
+
+            mock_get.return_value.text = '{"hits": {"hits": []}}'
+            eq_(api.get_ref_data('field_of_science', 'label.fi', 'Kemia', 'code'), None)
+            eq_(api.get_ref_data('field_of_science', 'label.fi', 'Kemia', 'code'), None)
+            eq_(mock_get.call_count, 3)
+        api.invalidate_ref_data_cache()
+
+    def testGetRefDataFromSnapshot(self):
+        ''' Test that topics covered by a snapshot are looked up without querying MetaX '''
+        api.set_ref_data_snapshot(ReferenceDataSnapshot([
+            {'type': 'location', 'code': 'p94426', 'label': {'fi': 'Suomi'}}], offline=True))
+        try:
+            with patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+                eq_(api.get_ref_data('location', 'label.fi', 'Suomi', 'code'), 'p94426')
+                eq_(api.get_ref_data('location', 'label.fi', 'Ruotsi', 'code'), None)
+                ok_(not mock_client.return_value.get.called)
+        finally:
+            api.set_ref_data_snapshot(None)
+
+    def testGetRefDataSnapshotMissQueried(self):
+        ''' Test that a term the snapshot has no equal value for is queried from MetaX once '''
+        api.invalidate_ref_data_cache()
+        api.set_ref_data_snapshot(ReferenceDataSnapshot([
+            {'type': 'location', 'code': 'p94426', 'label': {'fi': 'Suomi'}}]))
+        try:
+            with patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+                mock_get = mock_client.return_value.get
+                mock_get.return_value.text = '{"hits": {"hits": []}}'
+                eq_(api.get_ref_data('location', 'label.fi', 'Suomi', 'code'), 'p94426')
+                eq_(api.get_ref_data('location', 'label.fi', 'Ruotsi', 'code'), None)
+                eq_(api.get_ref_data('location', 'label.fi', 'Ruotsi', 'code'), None)
+                eq_(mock_get.call_count, 1)
+        finally:
+            api.set_ref_data_snapshot(None)
+            api.invalidate_ref_data_cache()
+
+    def testLoadRefDataSnapshotPages(self):
+        ''' Test that snapshot loading pages through a topic and skips topics that fail '''
+        def page(text):
+            response = Mock()
+            response.text = text
+            return response
+        with patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+            mock_client.return_value.get.side_effect = [
+                page('{"hits": {"hits": [{"_source": {"type": "location", "code": "a", "label": {"fi": "A"}}},'
+                     '{"_source": {"type": "location", "code": "b", "label": {"fi": "B"}}}]}}'),
+                page('{"hits": {"hits": [{"_source": {"type": "location", "code": "c", "label": {"fi": "C"}}}]}}'),
+                page('not json')]
+            snapshot = api.load_ref_data_snapshot_from_metax(['location', 'license'], page_size=2)
+        eq_(snapshot.lookup('location', 'label.fi', 'C', 'code'), 'c')
+        ok_(snapshot.covers('location'))
+        ok_(not snapshot.covers('license'))
+
+    def testLoadCatalogRecordSnapshotPages(self):
+        ''' Test that the catalog record snapshot is loaded page by page '''
+        def page(text):
+            response = Mock()
+            response.text = text
+            return response
+        with patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+            mock_client.return_value.get.side_effect = [
+                page('{"next": "page2", "results": ['
+                     '{"identifier": "cr1", "research_dataset": {"preferred_identifier": "urn:1", "modified": "m1"}},'
+                     '{"identifier": "cr2", "research_dataset": {"preferred_identifier": "urn:2"}}]}'),
+                page('{"next": null, "results": ['
+                     '{"identifier": "cr3", "research_dataset": {"preferred_identifier": "urn:3"}}]}')]
+            snapshot = api.load_catalog_record_snapshot_from_metax('dc', page_size=2)
+            eq_(mock_client.return_value.get.call_count, 2)
+            params = mock_client.return_value.get.call_args[1]['params']
+            eq_(params['offset'], 2)
+            eq_(params['fields'], 'identifier,research_dataset')
+            eq_(params['research_dataset_fields'], 'preferred_identifier,modified')
+        eq_(len(snapshot), 3)
+        eq_(snapshot.find_by_preferred_identifier('urn:1'), ('cr1', 'm1'))
+
+    def testCatalogRecordSnapshotLoadFailure(self):
+        ''' Test that a failed snapshot load falls back to an empty snapshot, which is not reloaded right away '''
+        api.clear_catalog_record_snapshots()
+        try:
+            with patch.dict(api.config, {'metax.catalog_snapshot': 'true'}), \
+                    patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+                mock_client.return_value.get.return_value.text = 'not json'
+                snapshot = api.get_catalog_record_snapshot('dc')
+                eq_(len(snapshot), 0)
+                ok_(api.get_catalog_record_snapshot('dc') is snapshot)
+                eq_(mock_client.return_value.get.call_count, 1)
+            eq_(api.get_catalog_record_snapshot('dc'), None)
+        finally:
+            api.clear_catalog_record_snapshots()
+
+    def testWriteErrorReason(self):
+        ''' Test that a taken preferred identifier is told apart from content errors and other failures '''
+        def error(status_code, body=None):
+            response = Mock(status_code=status_code)
+            response.json.return_value = body
+            return HTTPError(response=response)
+
+        exists = {'research_dataset': ['A catalog record with this research_dataset ->> preferred_identifier '
+                                       'already exists in this data catalog.']}
+        eq_(api.get_write_error_reason(error(400, exists)), api.CONFLICT)
+        eq_(api.get_write_error_reason(error(409)), api.CONFLICT)
+        eq_(api.get_write_error_reason(error(400, {'research_dataset': {'title': ['This field is required.']}})),
+            api.REJECTED)
+        eq_(api.get_write_error_reason(error(500)), None)
+        eq_(api.get_write_error_reason(HTTPError()), None)
+        eq_(api.get_errors_reason(exists), api.CONFLICT)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,93 @@
+# coding=UTF8
+#
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for metax_batch.py"""
+import unittest
+from unittest import TestCase
+
+from mock import Mock
+from nose.tools import ok_, eq_
+from requests.exceptions import ConnectionError
+
+from ckanext.etsin.metax_batch import LocalMetaxWriter, MetaxWriteBatch
+
+
+def _cr(pref_id, identifier=None):
+    cr = {'research_dataset': {'preferred_identifier': pref_id}}
+    if identifier:
+        cr['identifier'] = identifier
+    return cr
+
+
+class TestMetaxWriteBatch(TestCase):
+
+    def setUp(self):
+        self.writer = LocalMetaxWriter()
+        self.results = []
+
+    def testFlushesFullChunks(self):
+        batch = MetaxWriteBatch(3, writer=self.writer)
+        for i in range(7):
+            batch.add_create('pkg%d' % i, _cr('pid%d' % i), self.results.append)
+        eq_(self.writer.requests, 2)
+        eq_(len(batch), 1)
+        batch.flush()
+        eq_(self.writer.requests, 3)
+        eq_([r.package_id for r in self.results], ['pkg%d' % i for i in range(7)])
+        ok_(all(r.ok for r in self.results))
+        eq_(len(set(r.metax_cr_id for r in self.results)), 7)
+
+    def testResultsMappedToPackages(self):
+        batch = MetaxWriteBatch(10, writer=self.writer)
+        batch.add_create('ok', _cr('pid1'), self.results.append)
+        batch.add_create('fails', _cr(None), self.results.append)
+        batch.add_update('missing', _cr('pid2', 'unknown'), self.results.append)
+        batch.flush()
+        results = dict((r.package_id, r) for r in self.results)
+        ok_(results['ok'].ok)
+        eq_(self.writer.records[results['ok'].metax_cr_id]['research_dataset']['preferred_identifier'], 'pid1')
+        ok_(not results['fails'].ok)
+        ok_(not results['missing'].ok)
+        eq_(self.writer.requests, 2)
+
+    def testSamePreferredIdentifierNotInSameRequest(self):
+        batch = MetaxWriteBatch(10, writer=self.writer)
+        batch.add_create('pkg1', _cr('pid1'), self.results.append)
+        batch.add_create('pkg2', _cr('pid1'), self.results.append)
+        eq_(self.writer.requests, 1)
+        eq_(len(batch), 1)
+
+    def testRequestFailure(self):
+        writer = Mock()
+        writer.create_catalog_records.side_effect = ConnectionError('down')
+        batch = MetaxWriteBatch(10, writer=writer)
+        batch.add_create('pkg1', _cr('pid1'), self.results.append)
+        batch.flush()
+        ok_(not self.results[0].ok)
+        ok_('request' in self.results[0].errors)
+
+    def testCallbackErrorDoesNotStopOthers(self):
+        def failing_callback(result):
+            raise ValueError('boom')
+        batch = MetaxWriteBatch(10, writer=self.writer)
+        batch.add_create('pkg1', _cr('pid1'), failing_callback)
+        batch.add_create('pkg2', _cr('pid2'), self.results.append)
+        eq_(len(batch.flush()), 2)
+        eq_(len(self.results), 1)
+
+    def testFlushIfDue(self):
+        batch = MetaxWriteBatch(10, max_wait=0, writer=self.writer)
+        batch.add_create('pkg1', _cr('pid1'), self.results.append)
+        batch._oldest -= 1
+        batch.flush_if_due()
+        eq_(len(self.results), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
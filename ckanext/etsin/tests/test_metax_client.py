@@ -0,0 +1,63 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for metax_client.py"""
+import unittest
+from unittest import TestCase
+
+from mock import patch
+from nose.tools import ok_, eq_
+
+import ckanext.etsin.metax_client as metax_client
+from ckanext.etsin.metax_client import MetaxClient, get_metax_client, reset_metax_client
+
+
+class TestMetaxClient(TestCase):
+
+    def tearDown(self):
+        reset_metax_client()
+
+    def testClientIsShared(self):
+        ''' Test that get_metax_client returns the same client until it is reset '''
+        client = get_metax_client()
+        ok_(client is get_metax_client())
+        reset_metax_client()
+        ok_(client is not get_metax_client())
+
+    def testPoolConfiguration(self):
+        ''' Test that the pool size and retry settings end up in the mounted adapter '''
+        client = MetaxClient(pool_connections=2, pool_maxsize=7, pool_block=True, max_retries=5, backoff_factor=1)
+        adapter = client.session.get_adapter('https://metax.example.com/rest/datasets')
+        eq_(adapter._pool_connections, 2)
+        eq_(adapter._pool_maxsize, 7)
+        eq_(adapter._pool_block, True)
+        eq_(adapter.max_retries.total, 5)
+        ok_(502 in adapter.max_retries.status_forcelist)
+
+    def testRequestUsesSessionAndDefaultTimeout(self):
+        ''' Test that requests go through the shared session with the default timeout '''
+        client = MetaxClient(timeout=12)
+        with patch.object(client.session, 'request') as mock_request:
+            client.get('https://metax.example.com/rest/datasets/1')
+            mock_request.assert_called_once_with('GET', 'https://metax.example.com/rest/datasets/1', timeout=12)
+
+    def testInvalidConfigValueFallsBackToDefault(self):
+        ''' Test that a non-integer config value does not break client creation '''
+        with patch.dict(metax_client.config, {'metax.pool_maxsize': 'many'}):
+            client = MetaxClient()
+        eq_(client.session.get_adapter('https://x')._pool_maxsize, metax_client.DEFAULT_POOL_MAXSIZE)
+
+    def testPoolBlockFromConfig(self):
+        ''' Test that metax.pool_block is read like the other boolean config options '''
+        with patch.dict(metax_client.config, {'metax.pool_block': 'true'}):
+            eq_(MetaxClient().session.get_adapter('https://x')._pool_block, True)
+        with patch.dict(metax_client.config, {'metax.pool_block': 'yes'}):
+            eq_(MetaxClient().session.get_adapter('https://x')._pool_block, False)
+
+
+if __name__ == '__main__':
+    unittest.main()
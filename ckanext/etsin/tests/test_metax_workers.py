@@ -0,0 +1,88 @@
+# coding=UTF8
+#
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for metax_workers.py"""
+import threading
+import time
+import unittest
+from unittest import TestCase
+
+from nose.tools import ok_, eq_
+
+from ckanext.etsin.metax_workers import MetaxWorkerPool
+
+
+class TestMetaxWorkerPool(TestCase):
+
+    def setUp(self):
+        self.pool = MetaxWorkerPool(4, max_in_flight=3)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def testCallbacksRunOnCallerThread(self):
+        threads = []
+        callback_threads = []
+        for i in range(10):
+            self.pool.submit(i, lambda: threads.append(threading.current_thread()) or i,
+                             lambda result: callback_threads.append(threading.current_thread()))
+        eq_(len(self.pool.join()), 10)
+        ok_(threading.current_thread() not in threads)
+        eq_(set(callback_threads), set([threading.current_thread()]))
+
+    def testSameKeyKeepsOrder(self):
+        order = []
+
+        def task(i):
+            def run():
+                time.sleep(0.001 * (5 - i))
+                order.append(i)
+                return i
+            return run
+
+        for i in range(5):
+            self.pool.submit('pid', task(i), lambda result: None)
+        self.pool.join()
+        eq_(order, range(5))
+
+    def testInFlightIsBounded(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def task():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.005)
+            with lock:
+                running.pop()
+            return True
+
+        for i in range(12):
+            self.pool.submit(i, task, lambda result: None)
+            ok_(len(self.pool) <= 3)
+        eq_(len(self.pool.join()), 12)
+        ok_(max(peak) <= 3)
+
+    def testFailingTaskDoesNotBlock(self):
+        results = []
+
+        def task():
+            raise ValueError('boom')
+
+        self.pool.submit('a', task, results.append)
+        self.pool.submit('b', lambda: 1, results.append)
+        self.pool.join()
+        eq_(results, [1])
+        eq_(len(self.pool), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
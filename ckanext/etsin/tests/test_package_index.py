@@ -0,0 +1,40 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for package_index.py"""
+import unittest
+from unittest import TestCase
+
+from nose.tools import ok_, eq_
+
+from ckanext.etsin.package_index import PackageNameIndex
+
+
+class TestPackageNameIndex(TestCase):
+
+    def testLookups(self):
+        index = PackageNameIndex([('id1', 'cr1'), ('id2', 'cr2')])
+        eq_(len(index), 2)
+        eq_(index.get('id1'), 'cr1')
+        eq_(index.get('id3'), None)
+
+    def testUpdatedInPlace(self):
+        index = PackageNameIndex({'id1': 'id1'})
+        index.set('id1', 'cr1')
+        index.set('id2', 'cr2')
+        index.remove('id2')
+        index.remove('id3')
+        eq_(index.get('id1'), 'cr1')
+        eq_(index.get('id2'), None)
+
+    def testExpiry(self):
+        ok_(not PackageNameIndex().expired())
+        ok_(PackageNameIndex(max_age=-1).expired())
+
+
+if __name__ == '__main__':
+    unittest.main()
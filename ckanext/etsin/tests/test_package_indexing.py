@@ -0,0 +1,72 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for package_indexing.py"""
+import unittest
+from unittest import TestCase
+
+from mock import Mock
+from nose.tools import ok_, eq_
+
+from ckanext.etsin.package_indexing import PackageIndexBatch
+
+
+class TestPackageIndexBatch(TestCase):
+
+    def setUp(self):
+        self.indexed = []
+
+    def testAddDoesNotIndex(self):
+        batch = PackageIndexBatch(2, self.indexed.append)
+        for i in range(3):
+            batch.add('pkg%d' % i)
+        eq_(self.indexed, [])
+        eq_(len(batch), 3)
+
+    def testFlushIndexesChunks(self):
+        batch = PackageIndexBatch(3, self.indexed.append)
+        for i in range(7):
+            batch.add('pkg%d' % i)
+        eq_(batch.flush(), ['pkg%d' % i for i in range(7)])
+        eq_(self.indexed, [['pkg0', 'pkg1', 'pkg2'], ['pkg3', 'pkg4', 'pkg5'], ['pkg6']])
+        eq_(len(batch), 0)
+
+    def testPackageWrittenTwiceIndexedOnce(self):
+        batch = PackageIndexBatch(2, self.indexed.append)
+        batch.add('pkg1')
+        batch.add('pkg1')
+        batch.flush_if_due()
+        eq_(self.indexed, [])
+        batch.add('pkg2')
+        batch.flush_if_due()
+        eq_(self.indexed, [['pkg1', 'pkg2']])
+
+    def testEmptyFlushDoesNotIndex(self):
+        index = Mock()
+        batch = PackageIndexBatch(2, index)
+        eq_(batch.flush(), [])
+        ok_(not index.called)
+
+    def testFlushIfDue(self):
+        batch = PackageIndexBatch(10, self.indexed.append, max_wait=3600)
+        batch.add('pkg1')
+        batch.flush_if_due()
+        eq_(len(batch), 1)
+        batch.max_wait = -1
+        batch.flush_if_due()
+        eq_(len(batch), 0)
+        eq_(self.indexed, [['pkg1']])
+
+    def testIndexingFailureIsLogged(self):
+        batch = PackageIndexBatch(1, Mock(side_effect=IOError('Solr is down')))
+        batch.add('pkg1')
+        eq_(batch.flush(), ['pkg1'])
+        eq_(len(batch), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
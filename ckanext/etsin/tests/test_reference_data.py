@@ -0,0 +1,129 @@
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for reference_data.py"""
+import json
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+
+from mock import Mock
+from nose.tools import ok_, eq_
+
+from ckanext.etsin.reference_data import ReferenceDataCache, ReferenceDataSnapshot
+
+KEY = ('location', 'label.fi', 'Suomi', 'code')
+
+
+class TestReferenceDataCache(TestCase):
+
+    def testHitAndMissCounters(self):
+        cache = ReferenceDataCache()
+        loader = Mock(return_value='http://www.yso.fi/onto/yso/p94426')
+        eq_(cache.get(KEY, loader), 'http://www.yso.fi/onto/yso/p94426')
+        eq_(cache.get(KEY, loader), 'http://www.yso.fi/onto/yso/p94426')
+        eq_(loader.call_count, 1)
+        eq_(cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def testNegativeCaching(self):
+        cache = ReferenceDataCache()
+        loader = Mock(return_value=None)
+        eq_(cache.get(KEY, loader), None)
+        eq_(cache.get(KEY, loader), None)
+        eq_(loader.call_count, 1)
+
+    def testLoaderErrorIsNotCached(self):
+        cache = ReferenceDataCache()
+        loader = Mock(side_effect=[ValueError, 'ta5'])
+        with self.assertRaises(ValueError):
+            cache.get(KEY, loader)
+        eq_(cache.get(KEY, loader), 'ta5')
+
+    def testTtl(self):
+        now = [1000]
+        cache = ReferenceDataCache(ttl=10, clock=lambda: now[0])
+        loader = Mock(return_value='ta5')
+        cache.get(KEY, loader)
+        now[0] += 11
+        cache.get(KEY, loader)
+        eq_(loader.call_count, 2)
+
+    def testLruEviction(self):
+        cache = ReferenceDataCache(max_size=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: 1)
+        cache.get('c', lambda: 3)
+        loader = Mock(return_value=2)
+        cache.get('b', loader)
+        eq_(loader.call_count, 1)
+        eq_(len(cache), 2)
+
+    def testInvalidate(self):
+        cache = ReferenceDataCache()
+        cache.get(KEY, lambda: 'ta5')
+        cache.get('other', lambda: 'ta6')
+        cache.invalidate(KEY)
+        eq_(len(cache), 1)
+        cache.invalidate()
+        eq_(len(cache), 0)
+
+
+DOCUMENTS = [
+    {'type': 'field_of_science', 'code': 'ta512', 'uri': 'http://www.yso.fi/onto/okm-tieteenala/ta512',
+     'label': {'fi': u'Taloustiede', 'en': 'Economics'}},
+    {'type': 'location', 'code': 'http://www.yso.fi/onto/yso/p94426',
+     'label': {'fi': 'Suomi', 'en': 'Finland'}},
+    {'type': 'license', 'id': 'CC-BY-4.0', 'uri': 'https://creativecommons.org/licenses/by/4.0/'},
+]
+
+
+class TestReferenceDataSnapshot(TestCase):
+
+    def testLookupByLabel(self):
+        snapshot = ReferenceDataSnapshot(DOCUMENTS)
+        eq_(snapshot.lookup('field_of_science', 'label.fi', 'taloustiede ', 'code'), 'ta512')
+        eq_(snapshot.lookup('location', 'label.en', 'Finland', 'code'), 'http://www.yso.fi/onto/yso/p94426')
+        eq_(snapshot.lookup('license', 'uri', 'https://creativecommons.org/licenses/by/4.0/', 'id'), 'CC-BY-4.0')
+
+    def testLookupMiss(self):
+        snapshot = ReferenceDataSnapshot(DOCUMENTS)
+        eq_(snapshot.lookup('location', 'label.fi', 'Ruotsi', 'code'), None)
+        eq_(snapshot.lookup('location', 'label.fi', None, 'code'), None)
+        eq_(snapshot.lookup('access_type', 'label.fi', 'Avoin', 'code'), None)
+
+    def testOnlyEqualValuesFound(self):
+        """ Test that terms Elasticsearch would match without being equal to a value are left to MetaX """
+        snapshot = ReferenceDataSnapshot(DOCUMENTS)
+        eq_(snapshot.lookup('location', 'label.fi', '  SUOMI ', 'code'), 'http://www.yso.fi/onto/yso/p94426')
+        eq_(snapshot.lookup('license', 'uri', 'http://creativecommons.org/licenses/by/4.0', 'id'), None)
+        eq_(snapshot.lookup('location', 'label.fi', 'Suomi (Finland)', 'code'), None)
+
+    def testCoveredTopics(self):
+        ok_(ReferenceDataSnapshot(DOCUMENTS).covers('location'))
+        ok_(not ReferenceDataSnapshot(DOCUMENTS, topics=['license']).covers('location'))
+
+    def testFileRoundTrip(self):
+        fd, file_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            ReferenceDataSnapshot(DOCUMENTS).to_file(file_path)
+            snapshot = ReferenceDataSnapshot.from_file(file_path)
+            eq_(snapshot.lookup('field_of_science', 'label.en', 'economics', 'code'), 'ta512')
+            ok_(snapshot.offline)
+
+            with open(file_path, 'w') as f:
+                json.dump({'hits': {'hits': [{'_source': d} for d in DOCUMENTS]}}, f)
+            snapshot = ReferenceDataSnapshot.from_file(file_path)
+            eq_(len(snapshot.documents()), len(DOCUMENTS))
+        finally:
+            os.remove(file_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# coding=UTF8
+#
+# This file is part of the Etsin harvester service
+#
+# Copyright 2017-2018 Ministry of Education and Culture, Finland
+#
+# :author: CSC - IT Center for Science Ltd., Espoo Finland <servicedesk@csc.fi>
+# :license: GNU Affero General Public License version 3
+
+"""Tests for utils.py"""
+import json
+import random
+import unittest
+from unittest import TestCase
+
+from mock import patch
+from nose.tools import eq_
+
+from iso639 import languages
+
+from ckanext.etsin.utils import sanitize_for_json, encode_metax_payload, convert_language, \
+    convert_language_to_6391, validate_6391, get_language_identifier, get_string_as_valid_date_string, \
+    get_string_as_valid_datetime_string, _parse_date_string, _parse_datetime_string
+
+
+class TestSanitizeForJson(TestCase):
+
+    RECORD = {
+        'data_catalog': 'urn:nbn:fi:att:data-catalog-harvest-fsd',
+        'research_dataset': {
+            'title': {'fi': 'Tampereen yliopiston ty\xc3\xb6hyvinvointikysely', u'en': u'Well-being at work'},
+            'creator': ({'@type': 'Person', 'name': u'Tutkija, Teij\xf6'},),
+            'keyword': ['talous', u'ty\xf6'],
+            'temporal': [{'start_date': None, 'count': 3, 'ratio': 0.5, 'open': True, 'big': 2 ** 70}],
+            1: 'numeric key', True: 'bool key', None: 'null key', 1.5: 'float key',
+        }
+    }
+
+    def testSameAsJsonRoundTrip(self):
+        eq_(sanitize_for_json(self.RECORD), json.loads(json.dumps(self.RECORD, ensure_ascii=True)))
+
+    def testTextIsUnicode(self):
+        sanitized = sanitize_for_json(self.RECORD)
+        for key, value in sanitized['research_dataset']['title'].items():
+            eq_((type(key), type(value)), (unicode, unicode))
+
+    def testInvalidInput(self):
+        with self.assertRaises(UnicodeDecodeError):
+            sanitize_for_json({'title': '\xff'})
+        with self.assertRaises(TypeError):
+            sanitize_for_json({'title': object()})
+
+    def testEncodedPayload(self):
+        eq_(json.loads(encode_metax_payload(self.RECORD)), sanitize_for_json(self.RECORD))
+
+    def testEncodedPayloadIsSentAsIs(self):
+        import ckanext.etsin.metax_api as api
+        payload = encode_metax_payload({'research_dataset': {'title': {'fi': u'\xe4'}}})
+        with patch('ckanext.etsin.metax_api.get_metax_client') as mock_client:
+            mock_client.return_value.post.return_value.text = '{"identifier": "1"}'
+            api.create_catalog_record(payload)
+            eq_(mock_client.return_value.post.call_args[1]['data'], payload)
+
+
+class TestLanguageCodes(TestCase):
+
+    def testConvertLanguage(self):
+        eq_(convert_language('fi'), 'fin')
+        eq_(convert_language('ger'), 'ger')
+        eq_(convert_language('GER'), '')
+        eq_(convert_language(''), 'und')
+        eq_(convert_language(None), 'und')
+
+    def testConvertLanguageTo6391(self):
+        eq_(convert_language_to_6391('fin'), 'fi')
+        eq_(convert_language_to_6391('smn'), '')
+        eq_(convert_language_to_6391('xxx'), False)
+        eq_(convert_language_to_6391(['fin']), False)
+
+    def testValidate6391(self):
+        eq_(validate_6391('sv'), True)
+        eq_(validate_6391('swe'), False)
+        eq_(validate_6391(None), False)
+
+    def testLanguageIdentifier(self):
+        eq_(get_language_identifier('fin'), 'http://lexvo.org/id/iso639-3/fin')
+        eq_(get_language_identifier('urj'), 'http://lexvo.org/id/iso639-5/urj')
+        eq_(get_language_identifier(None), 'http://lexvo.org/id/iso639-3/und')
+
+    def testSameAsIso639Lookups(self):
+        for code, lang in languages.part1.items():
+            eq_(convert_language(code), lang.terminology)
+            eq_(validate_6391(code), True)
+        for code, lang in languages.part3.items():
+            eq_(convert_language_to_6391(code), lang.part1)
+
+
+def _random_date_values(rnd, count):
+    """ Random values around the shapes of dates, datetimes and their typical mistakes """
+    years = ['2017', '1999', '0001', '0000', '9999', '201', '20170', 'abcd']
+    months = ['1', '01', '02', '12', '13', '0', '00', '002', '']
+    days = ['1', '9', '28', '29', '30', '31', '32', '0', '']
+    times = ['12:30:45', '00:00:00', '23:59:59', '24:00:00', '12:60:00', '12:30:60', '12:30', '12', '1:2:3']
+    fractions = ['', '', '.5', '.000', '.123456', '.1234567', ',5', '.']
+    offsets = ['', '', 'Z', '+00:00', '-00:00', '+02:00', '-05:30', '+24:00', '+02:60', '+0200', '+02', 'z']
+    for i in range(count):
+        value = rnd.choice(years)
+        if rnd.random() < 0.8:
+            value += '-' + rnd.choice(months)
+            if rnd.random() < 0.9:
+                value += '-' + rnd.choice(days)
+                if rnd.random() < 0.5:
+                    value += rnd.choice('TTTT t') + rnd.choice(times) + rnd.choice(fractions) + rnd.choice(offsets)
+        if rnd.random() < 0.1:
+            position = rnd.randint(0, len(value))
+            value = value[:position] + rnd.choice('-T:1 x') + value[position:]
+        yield rnd.choice([value, value.decode('ascii')])
+
+
+class TestDateStrings(TestCase):
+
+    def testCommonShapes(self):
+        eq_(get_string_as_valid_date_string('2017-6-1'), '2017-06-01')
+        eq_(get_string_as_valid_date_string('2017'), None)
+        eq_(get_string_as_valid_date_string('2017-06-01T12:00:00'), None)
+        eq_(get_string_as_valid_datetime_string('2017'), None)
+        eq_(get_string_as_valid_datetime_string('2017', '12-31', '23:59:59'), '2017-12-31T23:59:59-00:00')
+        eq_(get_string_as_valid_datetime_string('2017-06-06'), '2017-06-06T00:00:00-00:00')
+        eq_(get_string_as_valid_datetime_string('2017-06-06T12:00:00.5Z'), '2017-06-06T12:00:00.500000+00:00')
+        eq_(get_string_as_valid_datetime_string('2017-06-06T12:00:00-05:30'), '2017-06-06T12:00:00-05:30')
+        eq_(get_string_as_valid_datetime_string('2017-06-06T12:00:00'), '2017-06-06T12:00:00-00:00')
+
+    def testSameAsDateutilConversion(self):
+        rnd = random.Random(20181018)
+        for value in _random_date_values(rnd, 3000):
+            eq_(get_string_as_valid_date_string(value), _parse_date_string(value, None), value)
+
+    def testSameAsDateutilDatetimeConversion(self):
+        rnd = random.Random(20181018)
+        defaults = [(None, None), ('01-01', None), ('01-01', '00:00:00'), ('12-31', '23:59:59'), ('02-29', None)]
+        for value in _random_date_values(rnd, 3000):
+            month_day, time = rnd.choice(defaults)
+            try:
+                expected = _parse_datetime_string(value, month_day, time)
+            except ValueError:
+                self.assertRaises(ValueError, get_string_as_valid_datetime_string, value, month_day, time)
+            else:
+                eq_(get_string_as_valid_datetime_string(value, month_day, time), expected, value)
+
+    def testInvalidDefaultTimeRaises(self):
+        self.assertRaises(Exception, get_string_as_valid_datetime_string, '2017', '01-01', '00:00:00Z')
+        self.assertRaises(Exception, get_string_as_valid_datetime_string, '2017', '01-01', '12:00')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,15 +6,28 @@
 # :license: GNU Affero General Public License version 3
 
 import logging
-import csv
+import re
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from functools import wraps
 from iso639 import languages
 from dateutil import parser
-from json import dumps, loads
+from json import dumps
 from urlparse import urlparse
 
 log = logging.getLogger(__name__)
 
-from .data_catalog_service import DataCatalogMetaxAPIService, get_data_catalog_filename_for_harvest_source
+from .data_catalog_service import get_data_catalog_id_for_harvest_source
+from .mapping_tables import mapping_tables
+
+
+# ISO 639 code conversion tables, built once at import instead of looking up and catching
+# KeyErrors from iso639.languages for every language of every record
+_PART1_TO_TERMINOLOGY = dict((code, lang.terminology) for code, lang in languages.part1.items())
+_PART2B_TO_TERMINOLOGY = dict((code, lang.terminology) for code, lang in languages.part2b.items())
+_PART3_TO_PART1 = dict((code, lang.part1) for code, lang in languages.part3.items())
+_PART5_CODES = frozenset(languages.part5)
 
 
 def convert_language(language):
@@ -29,16 +42,12 @@ def convert_language(language):
     if len(language) == 3 and language[0].islower():
         return language
 
-    try:
-        lang_object = languages.get(part1=language)
-        return lang_object.terminology
-    except KeyError as ke:
-        try:
-            lang_object = languages.get(part2b=language)
-            return lang_object.terminology
-        except KeyError as ke:
-            log.error('KeyError: key not found: {0}'.format(ke.args))
-            return ''
+    if language in _PART1_TO_TERMINOLOGY:
+        return _PART1_TO_TERMINOLOGY[language]
+    if language in _PART2B_TO_TERMINOLOGY:
+        return _PART2B_TO_TERMINOLOGY[language]
+    log.error('KeyError: key not found: {0}'.format((language,)))
+    return ''
 
 
 def convert_language_to_6391(language):
@@ -47,12 +56,10 @@ def convert_language_to_6391(language):
     Note that not all languages are included in ISO 639-1.
     """
     try:
-        part1 = languages.get(part3=language).part1
-    except:
+        return _PART3_TO_PART1.get(language, False)
+    except TypeError:
         return False
 
-    return part1
-
 
 def validate_6391(language):
     """
@@ -61,12 +68,7 @@ def validate_6391(language):
     if not isinstance(language, basestring):
         return False
 
-    try:
-        part1 = languages.get(part1=language).part1
-    except:
-        return False
-
-    return language == part1
+    return language in _PART1_TO_TERMINOLOGY
 
 
 def get_language_identifier(language):
@@ -77,13 +79,11 @@ def get_language_identifier(language):
     if not isinstance(language, basestring):
         language = 'und'
 
-    try:
-        languages.get(part5=language)
+    if language in _PART5_CODES:
         # TODO: In metax language reference data iso639-5 URIs do not get validated,
         # TODO: so if the below is returned, it won't get stored to metax
         return 'http://lexvo.org/id/iso639-5/' + language
-    except KeyError:
-        return 'http://lexvo.org/id/iso639-3/' + language
+    return 'http://lexvo.org/id/iso639-3/' + language
 
 
 def get_tag_lang(tag):
@@ -107,9 +107,7 @@ def convert_to_metax_catalog_record(data_dict, context, metax_cr_id=None):
 
     metax_cr = {}
     try:
-        data_catalog = DataCatalogMetaxAPIService.get_data_catalog_from_file(
-            get_data_catalog_filename_for_harvest_source(context.get('harvest_source_name', '')))['catalog_json']
-        data_catalog_id = data_catalog.get('identifier', None)
+        data_catalog_id = get_data_catalog_id_for_harvest_source(context.get('harvest_source_name', ''))
         if not data_catalog_id:
             raise Exception("No data catalog id can be set for metax dict")
 
@@ -121,15 +119,64 @@ def convert_to_metax_catalog_record(data_dict, context, metax_cr_id=None):
         if data_dict:
             metax_cr['research_dataset'] = data_dict
 
-        # Do json dumps - loads routine to get rid of problematic character
-        # encodings
-        return loads(dumps(metax_cr, ensure_ascii=True))
+        # Get rid of problematic character encodings
+        return sanitize_for_json(metax_cr)
     except KeyError as ke:
         log.error('KeyError: key not found: {0}'.format(ke.args))
     except Exception as e:
         log.error(e)
 
 
+def sanitize_for_json(value):
+    """
+    Walk value once and return a copy of it with all text as unicode, in the same form
+    a json dumps - loads round trip would give: byte strings are decoded as UTF-8,
+    tuples become lists and dictionary keys become unicode strings.
+
+    :param value: json serializable value, e.g. a MetaX catalog record dictionary
+    :return: sanitized copy of value
+    :raises UnicodeDecodeError: if a byte string is not valid UTF-8
+    :raises TypeError: if value contains something that is not json serializable
+    """
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    if isinstance(value, dict):
+        return dict((_sanitize_json_key(k), sanitize_for_json(v)) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [sanitize_for_json(v) for v in value]
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    raise TypeError("{0!r} is not JSON serializable".format(value))
+
+
+def _sanitize_json_key(key):
+    if isinstance(key, unicode):
+        return key
+    if isinstance(key, str):
+        return key.decode('utf-8')
+    if key is True:
+        return u'true'
+    if key is False:
+        return u'false'
+    if key is None:
+        return u'null'
+    if isinstance(key, float):
+        return unicode(repr(key))
+    if isinstance(key, (int, long)):
+        return unicode(key)
+    raise TypeError("key {0!r} is not a string".format(key))
+
+
+def encode_metax_payload(value):
+    """
+    Serialize a MetaX catalog record once into ASCII-only json bytes,
+    which can be given as such to metax_api create and update functions.
+    """
+    return dumps(value, ensure_ascii=True)
+
+
 def convert_bbox_to_polygon(north, east, south, west):
     return 'POLYGON(({w} {s},{w} {n},{e} {n},{e} {s},{w} {s}))'.format(n=north, e=east, s=south, w=west)
 
@@ -198,21 +245,28 @@ def search_pid_exists_in_mapping_file(file_path, search_pid):
     :param search_pid:
     :return:
     """
-    if _find_row_from_mapping_file(file_path, search_pid):
-        return True
+    return mapping_tables.exists(file_path, search_pid)
 
-    return False
 
+def get_kata_identifier_from_mapping_file(file_path, search_pid):
+    """
+    Get the kata identifier mapped to search_pid in a mapping file which contains two columns: first column contains
+    values to search for with search_pid and the other is the kata identifier.
 
-def _find_row_from_mapping_file(file_path, search_pid):
-    with open(file_path, 'rb') as f:
-        reader = csv.reader(f, delimiter=',')
-        for row in reader:
-            if row[0] == search_pid:
-                return row
+    :param file_path:
+    :param search_pid:
+    :return: kata identifier or None if search_pid is not found
+    """
+    row = _find_row_from_mapping_file(file_path, search_pid)
+    if row:
+        return row[1]
     return None
 
 
+def _find_row_from_mapping_file(file_path, search_pid):
+    return mapping_tables.lookup(file_path, search_pid)
+
+
 def str_to_bool(s):
     if s == 'True' or s == 'true':
         return True
@@ -223,6 +277,161 @@ def str_to_bool(s):
         return False
 
 
+class RecordViewCache(object):
+    """
+    Keeps parse helpers of the most recently parsed harvested records, so that a mapper and a refiner
+    of the same record can share one. Records are recognized by the identity of their lxml object: the
+    object the mapper was given must be the same object that is passed to the refiner in
+    context['source_data']. lxml elements can not be weakly referenced, so the number of records
+    kept is bounded instead.
+    """
+
+    def __init__(self, max_size=8):
+        self.max_size = max_size
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, xml, factory):
+        """
+        :param xml: lxml object of a harvested record
+        :param factory: function creating the view for xml when there is none yet
+        :return: view of xml
+        """
+        key = id(xml)
+        with self._lock:
+            view = self._views.get(key)
+            # The view keeps a reference to its xml, so the id is not reused while the view is cached
+            if view is not None and view.xml is xml:
+                return view
+
+        view = factory(xml)
+        with self._lock:
+            self._views[key] = view
+            while len(self._views) > self.max_size:
+                self._views.popitem(last=False)
+        return view
+
+
+def memoized_field(method):
+    """
+    Decorator for record view methods without arguments: the field is extracted only once per record.
+    Lists are copied so that callers can not modify the stored value. The view must have a _fields dict.
+    """
+    @wraps(method)
+    def wrapper(self):
+        if method.__name__ not in self._fields:
+            self._fields[method.__name__] = method(self)
+        value = self._fields[method.__name__]
+        return list(value) if isinstance(value, list) else value
+    return wrapper
+
+
+# Common shapes of date values, which are converted without dateutil: YYYY, YYYY-M-D and
+# YYYY-MM-DDThh:mm:ss with optional fraction of a second and UTC offset
+_YEAR_OR_DATE = re.compile(r'(\d{4})(?:-(\d{1,2})-(\d{1,2}))?\Z')
+_DATETIME = re.compile(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?(Z|([+-])(\d{2}):(\d{2}))?\Z')
+_MONTH_DAY = re.compile(r'(\d{2})-(\d{2})\Z')
+
+# Number of converted values kept per conversion function
+DATE_CACHE_SIZE = 4096
+
+# Returned by the fast paths for values they do not handle
+_UNHANDLED = object()
+
+
+def _memoized_date_conversion(convert):
+    """
+    Remember the results of a date conversion function per (value, default month-day, default time).
+    Invalid defaults raise every time, since exceptions are not stored.
+    """
+    cache = {}
+
+    @wraps(convert)
+    def wrapper(str_val, *args, **kwargs):
+        if not isinstance(str_val, basestring):
+            return convert(str_val, *args, **kwargs)
+        key = (str_val, args, tuple(sorted(kwargs.items())))
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        value = convert(str_val, *args, **kwargs)
+        if len(cache) >= DATE_CACHE_SIZE:
+            cache.clear()
+        cache[key] = value
+        return value
+    return wrapper
+
+
+def _fast_date(str_val):
+    """
+    :return: date of a YYYY-M-D value, None for a YYYY value, or _UNHANDLED
+    """
+    match = _YEAR_OR_DATE.match(str_val)
+    if match is None:
+        return _UNHANDLED
+    year, month, day = match.groups()
+    if month is None:
+        return None
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return _UNHANDLED
+
+
+def _fast_date_string(str_val):
+    value = _fast_date(str_val)
+    if value is None:
+        # Only year, and month-day can not be given
+        return None
+    if value is _UNHANDLED:
+        if _DATETIME.match(str_val):
+            # Contains time, in which case it cannot be reliably converted to date
+            return None
+        return _UNHANDLED
+    return '%04d-%02d-%02d' % (value.year, value.month, value.day)
+
+
+def _fast_datetime_string(str_val, month_day_to_add_if_not_present, time_to_add_if_not_present):
+    value = _fast_date(str_val)
+    if value is None:
+        if month_day_to_add_if_not_present is None:
+            return None
+        month_day = _MONTH_DAY.match(month_day_to_add_if_not_present)
+        if month_day is None:
+            return _UNHANDLED
+        try:
+            value = date(int(str_val), int(month_day.group(1)), int(month_day.group(2)))
+        except ValueError:
+            return _UNHANDLED
+
+    if value is not _UNHANDLED:
+        return '%04d-%02d-%02dT%s-00:00' % (value.year, value.month, value.day,
+                                           time_to_add_if_not_present or '00:00:00')
+
+    match = _DATETIME.match(str_val)
+    if match is None:
+        return _UNHANDLED
+    year, month, day, hour, minute, second, fraction, offset, sign, offset_hour, offset_minute = match.groups()
+    try:
+        value = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                         int(fraction.ljust(6, '0')) if fraction else 0)
+    except ValueError:
+        return _UNHANDLED
+
+    if offset is None:
+        # Without offset the value is assumed to be in UTC
+        offset = '-00:00'
+    elif offset == 'Z' or int(offset_hour) == int(offset_minute) == 0:
+        offset = '+00:00'
+    elif int(offset_hour) < 24 and int(offset_minute) < 60:
+        offset = '%s%02d:%02d' % (sign, int(offset_hour), int(offset_minute))
+    else:
+        return _UNHANDLED
+    return value.isoformat() + offset
+
+
+@_memoized_date_conversion
 def get_string_as_valid_date_string(str_val, month_day_to_add_if_not_present=None):
     if str_val is None or not str_val:
         return None
@@ -233,6 +442,14 @@ def get_string_as_valid_date_string(str_val, month_day_to_add_if_not_present=Non
                 "Unable to understand month_day_to_add_if_not_present: {0}".format(month_day_to_add_if_not_present))
         exit(1)
 
+    value = _fast_date_string(str_val)
+    if value is not _UNHANDLED:
+        return value
+    return _parse_date_string(str_val, month_day_to_add_if_not_present)
+
+
+def _parse_date_string(str_val, month_day_to_add_if_not_present):
+    """ Convert values of other than the common shapes using dateutil """
     # For cases e.g. 2010-01-1, 2010-1-01, 2010-1, 2010-1-1
     # Above example would be transformed into 2010-01-01
     if 4 < len(str_val) < 10:
@@ -286,6 +503,7 @@ def get_string_as_valid_date_string(str_val, month_day_to_add_if_not_present=Non
     return str_as_datetime.isoformat().split('T')[0]
 
 
+@_memoized_date_conversion
 def get_string_as_valid_datetime_string(str_val, month_day_to_add_if_not_present=None, time_to_add_if_not_present=None):
     if str_val is None or not str_val:
         return None
@@ -305,6 +523,14 @@ def get_string_as_valid_datetime_string(str_val, month_day_to_add_if_not_present
                 "Unable to understand month_day_to_add_if_not_present: {0}".format(month_day_to_add_if_not_present))
             raise Exception
 
+    value = _fast_datetime_string(str_val, month_day_to_add_if_not_present, time_to_add_if_not_present)
+    if value is not _UNHANDLED:
+        return value
+    return _parse_datetime_string(str_val, month_day_to_add_if_not_present, time_to_add_if_not_present)
+
+
+def _parse_datetime_string(str_val, month_day_to_add_if_not_present, time_to_add_if_not_present):
+    """ Convert values of other than the common shapes using dateutil """
     # For cases e.g. 2010-01-1, 2010-1-01, 2010-1, 2010-1-1
     # Above example would be transformed into 2010-01-01
     if 4 < len(str_val) < 10:
@@ -81,6 +81,8 @@ setup(
     entry_points='''
         [ckan.plugins]
         etsin=ckanext.etsin.plugin:EtsinPlugin
+        [paste.paster_command]
+        etsin=ckanext.etsin.commands:EtsinCommand
 	[babel.extractors]
 	ckan = ckan.lib.extract:extract_ckan
     ''',